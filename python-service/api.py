@@ -1,161 +1,764 @@
 import os
+import base64
 import logging
-import subprocess
 import json
-from flask import Blueprint, request, jsonify
-from elasticsearch import Elasticsearch
-from llm import generate_elasticsearch_query, GeminiRateLimitExceeded
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from elasticsearch import NotFoundError
+from es_client import get_es_client
+from llm import generate_elasticsearch_query, generate_elasticsearch_queries, fetch_schema, fetch_schema_fields, GeminiRateLimitExceeded, LLMQueryError
+from query_cache import normalize_prompt
+from planner import plan_query, is_show_all, fallback_query
+from local_search import plan_local, rerank
+from links import LINK_INDEX, parse_relationship, relationship_query, build_relationship_response
+from result_cache import result_cache, canonical_key, generation_of, with_planner
+from populate_elasticsearch import populate
+from jobs import RepopulateRunner
+from tracing import trace_request, span, capture, annotate, record_error
+import tenants
+import metrics
+import json_codec
 
 ES_HOST = os.environ.get("ES_HOST", "elasticsearch")
 ES_PORT = os.environ.get("ES_PORT", "9200")
+# Read alias; populate_elasticsearch points it at the latest nlp_index-<timestamp> generation
 ES_INDEX = os.environ.get("ES_INDEX", "nlp_index")
-es = Elasticsearch(f'http://{ES_HOST}:{ES_PORT}')
+BATCH_MAX_PROMPTS = int(os.environ.get("BATCH_MAX_PROMPTS", "100"))
+# Answer with a plain multi_match search instead of an error while Gemini is throttled
+LLM_FALLBACK = os.environ.get("LLM_FALLBACK", "true").lower() in ("1", "true", "yes")
+# When prompts the rules cannot plan are ranked with the local TF-IDF index (local_search):
+# "fallback" only while Gemini is failing, "first" before asking Gemini at all, "off" never
+LOCAL_SEARCH = os.environ.get("LOCAL_SEARCH", "fallback").lower()
+# Reorder the hits of Gemini and multi_match searches by local index similarity to the prompt,
+# fetching LOCAL_RERANK_DEPTH hits to choose from even when only the top one is shown
+LOCAL_RERANK = os.environ.get("LOCAL_RERANK", "false").lower() in ("1", "true", "yes")
+LOCAL_RERANK_DEPTH = int(os.environ.get("LOCAL_RERANK_DEPTH", "10"))
+# Hits per "show all" page; clients follow `next_cursor` for the rest
+PROCESS_PAGE_SIZE = int(os.environ.get("PROCESS_PAGE_SIZE", "100"))
+PROCESS_MAX_PAGE_SIZE = int(os.environ.get("PROCESS_MAX_PAGE_SIZE", "1000"))
+# How long an idle point-in-time behind a cursor is kept open
+PIT_KEEP_ALIVE = os.environ.get("PIT_KEEP_ALIVE", "1m")
+# Upper bound on the hits one streamed "show all" response sends
+STREAM_MAX_HITS = int(os.environ.get("STREAM_MAX_HITS", "10000"))
+es = get_es_client(ES_HOST, ES_PORT)
 api_bp = Blueprint('api', __name__)
 logger = logging.getLogger("api")
 
-def repopulate_es_index():
-    """Call the ES repopulation script and return (success, output)."""
-    try:
-        result = subprocess.run(['python', 'populate_elasticsearch.py'], capture_output=True, text=True, cwd=os.path.dirname(__file__))
-        logger.info(f"[API] Repopulate ES output: {result.stdout}")
-        if result.returncode == 0:
-            return True, result.stdout
-        else:
-            logger.error(f"[API] Repopulate ES error: {result.stderr}")
-            return False, result.stderr
-    except Exception as e:
-        logger.error(f"[API] Repopulate ES exception: {e}")
-        return False, f"Exception: {type(e).__name__}: {e}"
+# Repopulation runs populate() in-process on a background thread; see jobs.RepopulateRunner
+repopulate_runner = RepopulateRunner(lambda **kwargs: populate(es=es, **kwargs))
+
+
+# --- Tenants ---
+
+def request_tenant(data, headers):
+    """Tenant named by the body's `tenant` field or the X-Tenant header; None for the default tenant."""
+    name = data.get('tenant') if isinstance(data, dict) else None
+    return tenants.resolve(name or headers.get('X-Tenant'))
+
+def unknown_tenant_body(e):
+    record_error("bad_request")
+    return {'intent': 'error', 'results': None, 'error': str(e)}
+
+def data_index():
+    tenant = tenants.current()
+    return ES_INDEX if tenant is None else tenant.data_index
+
+def link_index():
+    tenant = tenants.current()
+    return LINK_INDEX if tenant is None else tenant.link_index
+
+def current_result_cache():
+    tenant = tenants.current()
+    return result_cache if tenant is None else tenant.result_cache
 
 
 # --- Template schemas ---
 
+# Template for each document `type` (strict, case-insensitive); anything else is 'Unknown'
+TEMPLATES_BY_TYPE = {'component': 'TemplateA', 'cve': 'TemplateB'}
+
+def hit_template(hit):
+    doc_type = hit.get('_source', {}).get('type')
+    return TEMPLATES_BY_TYPE.get(doc_type.lower() if isinstance(doc_type, str) else None, 'Unknown')
+
 def schema_template_a(hit):
     # Component/Package: type == 'component' (strict)
-    src = hit.get('_source', {})
-    return src.get('type', '').lower() == 'component'
+    return hit_template(hit) == 'TemplateA'
 
 def schema_template_b(hit):
     # CVE: type == 'cve' (strict)
-    src = hit.get('_source', {})
-    return src.get('type', '').lower() == 'cve'
+    return hit_template(hit) == 'TemplateB'
+
+class TemplatedHit:
+    """One `{template, data}` result entry; `data` is the ES hit itself, referenced rather than copied."""
+    __slots__ = ('template', 'data')
+
+    def __init__(self, template, data):
+        self.template = template
+        self.data = data
+
+    def __json__(self):
+        return {'template': self.template, 'data': self.data}
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, TemplatedHit):
+            other = other.__json__()
+        return self.__json__() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"TemplatedHit({self.template!r}, {self.data!r})"
+
+def classify_hits(hits):
+    """(templated hits, intent) in a single pass over `hits`."""
+    tracker = IntentTracker()
+    parsed = [tracker.add(hit) for hit in hits]
+    return parsed, tracker.intent
 
 def parse_hits_with_template(hits):
-    parsed = []
-    for hit in hits:
-        if schema_template_b(hit):
-            parsed.append({'template': 'TemplateB', 'data': hit})
-        elif schema_template_a(hit):
-            parsed.append({'template': 'TemplateA', 'data': hit})
-        else:
-            parsed.append({'template': 'Unknown', 'data': hit})
-    return parsed
+    return classify_hits(hits)[0]
 
 def detect_intent_from_response(hits):
-    if not hits:
-        return 'package'
-    all_b = all(schema_template_b(hit) for hit in hits)
-    if all_b:
-        return 'cve'
-    all_a = all(schema_template_a(hit) for hit in hits)
-    if all_a:
-        return 'package'
-    return 'mixed'
+    return classify_hits(hits)[1]
+
+# Fields each template renders. `original` (the raw CVE feed record, tens of KB
+# per hit) is left out unless a request asks for `full_source`.
+TEMPLATE_SOURCE_FIELDS = {
+    'TemplateA': [
+        'type', 'doc_created', 'sbom_id', 'component_risk_metadata',
+        'package.id', 'package.name', 'package.friendly_name', 'package.version', 'package.purl',
+        'package.desc', 'package.supplier', 'package.pkg_manager', 'package.pkg_type', 'package.license',
+        'package.total_vulnerability_count', 'package.total_fixed_vulnerability_count', 'package.vulnerability',
+    ],
+    'TemplateB': ['id', 'type', 'description', 'affected_packages'],
+}
+
+# --- Paging and projection ---
+
+class InvalidCursor(ValueError):
+    pass
+
+def source_filter(full_source=False):
+    if full_source:
+        return True
+    return {"includes": sorted({field for fields in TEMPLATE_SOURCE_FIELDS.values() for field in fields})}
+
+def result_size(prompt):
+    # Single-result prompts only ever render the top hit
+    return PROCESS_PAGE_SIZE if is_show_all(prompt) else 1
+
+def search_body(es_query, size, full_source=False):
+    body = {key: value for key, value in es_query.items() if key not in ('size', 'from', '_source')}
+    body['size'] = size
+    body['_source'] = source_filter(full_source)
+    return body
+
+def encode_cursor(pit_id, search_after, index):
+    raw = json.dumps({"pit": pit_id, "after": search_after, "index": index}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor, index):
+    """Return (pit_id, search_after) from a `next_cursor` value issued for `index`."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        pit_id, search_after, issued_for = data["pit"], data["after"], data["index"]
+    except Exception:
+        raise InvalidCursor("Invalid or expired cursor")
+    # A point in time reads the index it was opened on, so another tenant's cursor would page through its data
+    if issued_for != index:
+        raise InvalidCursor("Invalid or expired cursor")
+    return pit_id, search_after
+
+def page_body(es_query, size, pit_id, search_after=None, full_source=False):
+    body = search_body(es_query, size, full_source)
+    body['pit'] = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+    sort = es_query.get('sort') or [{'_score': 'desc'}]
+    # _shard_doc is the cheapest unique tiebreaker inside a point in time
+    body['sort'] = (sort if isinstance(sort, list) else [sort]) + [{'_shard_doc': 'asc'}]
+    if search_after:
+        body['search_after'] = search_after
+    return body
+
+def page_result(results, size, pit_id, index):
+    """Return (hits, pit_id, next_cursor) for a page of `index`; next_cursor is None on the last page."""
+    body = response_body(results)
+    observe_took(body)
+    hits = body['hits']['hits']
+    # ES may hand back a new PIT id with every page
+    pit_id = body.get('pit_id', pit_id)
+    if len(hits) < size:
+        return hits, pit_id, None
+    return hits, pit_id, encode_cursor(pit_id, hits[-1]['sort'], index)
+
+def page_options(data):
+    """Validate the paging fields of a /process body; returns (page_size, cursor, error)."""
+    page_size = data.get('page_size', PROCESS_PAGE_SIZE)
+    cursor = data.get('cursor')
+    if isinstance(page_size, bool) or not isinstance(page_size, int) or not 1 <= page_size <= PROCESS_MAX_PAGE_SIZE:
+        return None, None, f"'page_size' must be an integer between 1 and {PROCESS_MAX_PAGE_SIZE}"
+    if cursor is not None and not isinstance(cursor, str):
+        return None, None, "'cursor' must be a string"
+    return page_size, cursor, None
+
+def close_pit(pit_id):
+    try:
+        es.close_point_in_time(id=pit_id)
+    except Exception as e:
+        logger.warning(f"[API] Could not close point in time ({e})")
+
+def search_page(es_query, page_size, cursor=None, full_source=False):
+    """Return (hits, next_cursor) for one page of a point-in-time search."""
+    index = data_index()
+    if cursor:
+        pit_id, search_after = decode_cursor(cursor, index)
+    else:
+        pit_id, search_after = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)['id'], None
+    try:
+        results = es.search(body=page_body(es_query, page_size, pit_id, search_after, full_source))
+    except NotFoundError:
+        if cursor:
+            # The point in time behind the cursor has expired
+            raise InvalidCursor("Invalid or expired cursor")
+        raise
+    hits, pit_id, next_cursor = page_result(results, page_size, pit_id, index)
+    if next_cursor is None:
+        close_pit(pit_id)
+    return hits, next_cursor
+
+def iter_hits(es_query, page_size=PROCESS_PAGE_SIZE, limit=STREAM_MAX_HITS, full_source=False, index=None):
+    """Yield up to `limit` hits of `index` (default ES_INDEX) page by page; the PIT is closed however iteration ends.
+
+    Streamed responses are iterated after the request's tenant scope has
+    ended, so callers pass the tenant's index explicitly.
+    """
+    index = index or ES_INDEX
+    pit_id = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)['id']
+    search_after = None
+    sent = 0
+    try:
+        while sent < limit:
+            size = min(page_size, limit - sent)
+            results = es.search(body=page_body(es_query, size, pit_id, search_after, full_source))
+            hits, pit_id, next_cursor = page_result(results, size, pit_id, index)
+            for hit in hits:
+                yield hit
+            sent += len(hits)
+            if next_cursor is None:
+                break
+            search_after = hits[-1]['sort']
+    finally:
+        close_pit(pit_id)
+
+class IntentTracker:
+    """Templates hits one at a time and keeps track of the intent they add up to."""
+
+    def __init__(self):
+        self.count = 0
+        self.all_a = True
+        self.all_b = True
+
+    def add(self, hit):
+        """Return `hit` as a TemplatedHit."""
+        template = hit_template(hit)
+        self.count += 1
+        self.all_a = self.all_a and template == 'TemplateA'
+        self.all_b = self.all_b and template == 'TemplateB'
+        return TemplatedHit(template, hit)
+
+    @property
+    def intent(self):
+        if not self.count:
+            return 'package'
+        if self.all_b:
+            return 'cve'
+        if self.all_a:
+            return 'package'
+        return 'mixed'
+
+def ndjson_lines(hits, planner=None):
+    """One `{template, data}` line per hit, then a summary line with the intent and count."""
+    tracker = IntentTracker()
+    for hit in hits:
+        yield json_codec.dumps(tracker.add(hit)) + b"\n"
+    yield json_codec.dumps({'intent': tracker.intent, 'planner': planner, 'count': tracker.count, 'done': True}) + b"\n"
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @api_bp.route('/repopulate-es', methods=['POST'])
 def repopulate_es():
     try:
-        success, output = repopulate_es_index()
-        if success:
-            return jsonify({"status": "success", "output": output})
+        data = request.get_json(silent=True) or {}
+        try:
+            tenant = request_tenant(data, request.headers)
+        except tenants.UnknownTenant as e:
+            return jsonify({"status": "error", "error": str(e)}), 404
+        job, created = repopulate_runner.submit(incremental=bool(data.get('incremental')), tenant=tenant)
+        if created:
+            logger.info(f"[API] Started repopulate job {job.id}")
         else:
-            logger.error(f"[API] Repopulate ES failed: {output}")
-            return jsonify({"status": "error", "error": output}), 500
+            logger.info(f"[API] Repopulate already in progress, joining job {job.id}")
+        return jsonify({"status": "success", "job_id": job.id, "job": job.to_dict()}), 202
     except Exception as e:
         logger.error(f"[API] Repopulate ES endpoint exception: {e}")
         return jsonify({"status": "error", "error": str(e)}), 500
 
+@api_bp.route('/repopulate-es/<job_id>', methods=['GET'])
+def repopulate_es_status(job_id):
+    job = repopulate_runner.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": f"Unknown repopulate job: {job_id}"}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
 
+def error_kind(e):
+    return e.kind if isinstance(e, LLMQueryError) else "internal"
 
+def fetch_package_names():
+    """Sorted package names of the SBOM components; empty for a schema-index written before they were recorded."""
+    return fetch_schema().get('packages', [])
 
+def local_plan(prompt):
+    """Plan from the tenant's local TF-IDF index, or None when LOCAL_SEARCH is off or it finds nothing."""
+    if LOCAL_SEARCH == "off":
+        return None
+    tenant = tenants.current()
+    with span("local_search"):
+        plan = plan_local(prompt) if tenant is None else plan_local(prompt, index_file=tenant.local_index)
+    if plan:
+        annotate(planner=plan.planner, confidence=plan.confidence)
+        capture("es_query", lambda: plan.query)
+    return plan
 
-def get_system_prompt():
-    return (
-        "You are an expert in Elasticsearch. "
-        "Given a user's natural language prompt, generate a minimal Elasticsearch JSON query (no explanations, just the JSON) "
-        "that would retrieve relevant records from an index with fields: id, name, category, value, and also nested fields like components.package.name, components.package.desc, components.package.friendly_name, components.package.version. "
-        "If the prompt is about a CVE, search for the id field (e.g., CVE-2020-1472). "
-        "If the prompt is about a component, search for both root-level fields and nested fields under components.package.*. "
-        "If the prompt is ambiguous, return a match_all query."
-    )
+def offline_query(prompt, schema_fields):
+    """(es_query, planner) for when Gemini cannot answer: the local index, else a multi_match."""
+    plan = local_plan(prompt)
+    if plan:
+        return plan.query, plan.planner
+    annotate(planner="fallback")
+    return fallback_query(prompt, schema_fields), "fallback"
 
-def log_llm_prompt(prompt):
-    system_prompt = get_system_prompt()
-    full_prompt = f"{system_prompt}\nPrompt: {prompt}\nElasticsearch Query:"
-    logger.info(f"[API] LLM full prompt sent to Gemini:\n{full_prompt}")
+# Planning and response shaping shared by this blueprint and asgi.py, which only adds the awaits around them
 
-def get_es_query(prompt):
-    try:
-        es_query = generate_elasticsearch_query(prompt)
-        logger.info(f"[API] LLM-generated ES query: {json.dumps(es_query, indent=2)}")
-        return es_query, None
-    except GeminiRateLimitExceeded as e:
+def rule_plan(prompt, schema_fields, packages=()):
+    """(es_query, planner) without Gemini: the rule planner, then the local index when LOCAL_SEARCH is "first"; or None."""
+    with span("planning"):
+        plan = plan_query(prompt, schema_fields, packages)
+    if plan:
+        annotate(planner=plan.planner, plan_intent=plan.intent, confidence=plan.confidence)
+        capture("es_query", lambda: plan.query)
+        return plan.query, plan.planner
+    if LOCAL_SEARCH == "first":
+        plan = local_plan(prompt)
+        if plan:
+            return plan.query, plan.planner
+    return None
+
+def llm_planned(es_query):
+    annotate(planner="llm")
+    capture("es_query", lambda: es_query)
+    return es_query, "llm", None
+
+def llm_failed(prompt, schema_fields, e):
+    """(es_query, planner, error) after Gemini raised `e`; re-raises it when nothing else can answer."""
+    if isinstance(e, GeminiRateLimitExceeded):
+        record_error("rate_limit")
+        if LLM_FALLBACK:
+            logger.warning(f"[API] Gemini throttled ({e}), using fallback query.")
+            return (*offline_query(prompt, schema_fields), None)
         logger.error("[API] Gemini rate-limit exceeded, raising error.")
-        return None, str(e)
+        return None, "llm", str(e)
+    # Gemini failed or timed out; the local index can still answer
+    plan = local_plan(prompt) if LLM_FALLBACK else None
+    if plan is None:
+        raise e
+    record_error(e.kind)
+    logger.warning(f"[API] Gemini failed ({e}), using the local search index.")
+    return plan.query, plan.planner, None
 
-def execute_es_query(es_query):
-    logger.info(f"[API] Executing ES query: {json.dumps(es_query, indent=2)}")
-    results = es.search(index=ES_INDEX, body=es_query, size=100)
-    # Convert ObjectApiResponse to dict for logging/processing
-    if hasattr(results, 'body'):
-        results_dict = results.body
+def rate_limited_body(planner, error):
+    return {'intent': 'error', 'results': None, 'planner': planner, 'error': 'Gemini rate-limit exceeded: ' + error}
+
+def wants_page(data, prompt, cursor):
+    return is_show_all(prompt) and ('page_size' in data or cursor is not None)
+
+def page_response(hits, next_cursor, planner):
+    with span("parse"):
+        return {**build_show_all_response(hits, planner), 'next_cursor': next_cursor}
+
+def relationship_entry(relation, schema):
+    """(key, generation, cached) of a relationship answer in the result cache; `cached` is None on a miss."""
+    key = canonical_key(relationship_query(relation), index=LINK_INDEX)
+    generation = generation_of(schema)
+    cached = lookup_result(key, generation)
+    if cached is not None:
+        annotate(planner="links", relation=relation.kind)
+    return key, generation, cached
+
+def store_relationship(key, generation, relation, hits):
+    with span("parse"):
+        return store_result(key, generation, build_relationship_response(relation, hits))
+
+def reranks(planner):
+    # Rules, links and the local index already rank exactly; Gemini and multi_match queries do not
+    return LOCAL_RERANK and LOCAL_SEARCH != "off" and planner in ("llm", "fallback")
+
+def rerank_hits(prompt, hits):
+    tenant = tenants.current()
+    with span("rerank"):
+        return rerank(prompt, hits) if tenant is None else rerank(prompt, hits, index_file=tenant.local_index)
+
+def search_entry(prompt, es_query, full_source, schema, planner=None):
+    """(size, key, generation, cached) of a non-paged search in the result cache; `cached` is None on a miss.
+
+    Identical searches against the same data generation reuse the templated response. A re-ranked
+    search fetches LOCAL_RERANK_DEPTH hits and is keyed by the prompt too, since its order depends on it.
+    """
+    size = result_size(prompt)
+    if reranks(planner):
+        size = max(size, LOCAL_RERANK_DEPTH)
+        key = canonical_key(es_query, size=size, full_source=full_source, show_all=is_show_all(prompt),
+                            rerank=normalize_prompt(prompt).text)
     else:
-        results_dict = dict(results)
-    logger.info(f"[API] Raw ES response: {json.dumps(results_dict, indent=2)[:2000]}")
-    hits = results_dict['hits']['hits']
-    logger.info(f"[API] ES hits returned: {json.dumps(hits, indent=2)}")
+        key = result_key(prompt, es_query, size, full_source)
+    generation = generation_of(schema)
+    return size, key, generation, lookup_result(key, generation)
+
+def store_search(key, generation, prompt, hits, planner):
+    if reranks(planner):
+        hits = rerank_hits(prompt, hits)[:result_size(prompt)]
+    with span("parse"):
+        return store_result(key, generation, build_process_response(prompt, hits, planner))
+
+def get_es_query(prompt, packages=()):
+    """Return (es_query, planner, error); the rule-based planner is tried before the LLM."""
+    with span("schema"):
+        schema_fields = fetch_schema_fields()
+    planned = rule_plan(prompt, schema_fields, packages)
+    if planned:
+        return (*planned, None)
+    try:
+        with span("llm"):
+            es_query = generate_elasticsearch_query(prompt)
+    except (GeminiRateLimitExceeded, LLMQueryError) as e:
+        return llm_failed(prompt, schema_fields, e)
+    return llm_planned(es_query)
+
+def execute_es_query(es_query, size=PROCESS_PAGE_SIZE, full_source=False):
+    with span("es_search"):
+        results = es.search(index=data_index(), body=search_body(es_query, size, full_source))
+    return hits_from_response(results)
+
+def execute_link_query(relation):
+    """One search of the link index answers a CVE<->component relationship prompt."""
+    annotate(planner="links", relation=relation.kind)
+    with span("es_search"):
+        results = es.search(index=link_index(), body=relationship_query(relation))
+    return hits_from_response(results)
+
+# --- Result cache ---
+
+def result_key(prompt, es_query, size, full_source=False):
+    return canonical_key(es_query, size=size, full_source=full_source, show_all=is_show_all(prompt))
+
+def lookup_result(key, generation):
+    """Cached (payload, body_bytes) for `key`, counted in nlp_cache_lookups_total."""
+    cached = current_result_cache().get(key, generation)
+    result = "miss" if cached is None else "hit"
+    metrics.CACHE_LOOKUPS.inc(cache="result", result=result)
+    annotate(result_cache=result)
+    return cached
+
+def store_result(key, generation, response):
+    """Cache a response without its planner (the same search can come from any planner)."""
+    payload = {k: v for k, v in response.items() if k != 'planner'}
+    return payload, current_result_cache().put(key, generation, payload)
+
+def cached_response(body, planner, endpoint='/process'):
+    with span("serialize"):
+        resp = Response(with_planner(body, planner), mimetype='application/json')
+    metrics.RESPONSE_BYTES.observe(resp.content_length or 0, endpoint=endpoint)
+    return resp
+
+def response_body(results):
+    # Convert ObjectApiResponse to a plain dict
+    if hasattr(results, 'body'):
+        return results.body
+    return dict(results)
+
+def observe_took(body):
+    if 'took' in body:
+        metrics.ES_TOOK_SECONDS.observe(body['took'] / 1000)
+
+def hits_from_response(results):
+    body = response_body(results)
+    observe_took(body)
+    hits = body['hits']['hits']
+    annotate(hits=len(hits))
+    capture("hits", lambda: hits)
     return hits
 
-def handle_show_all(hits):
-    parsed_hits = parse_hits_with_template(hits)
-    intent = detect_intent_from_response(hits)
-    response = {'intent': intent, 'results': parsed_hits}
-    logger.info(f"[API] Sending all ES docs: {len(parsed_hits)} docs")
-    return jsonify(response)
-
-def handle_single_result(hits):
-    if hits:
-        parsed_hit = parse_hits_with_template([hits[0]])[0]
-        intent = detect_intent_from_response([hits[0]])
-    else:
-        parsed_hit = None
-        intent = detect_intent_from_response([])
-    logger.info(f"[API] ES search hit: {hits[0] if hits else None}")
-    response = {'intent': intent, 'results': parsed_hit}
-    logger.info(f"[API] Sending single ES doc response: {response}")
-    return jsonify(response)
+def build_show_all_response(hits, planner=None):
+    parsed_hits, intent = classify_hits(hits)
+    return {'intent': intent, 'results': parsed_hits, 'planner': planner}
+
+def handle_show_all(hits, planner=None):
+    return jsonify(build_show_all_response(hits, planner))
+
+def build_single_result_response(hits, planner=None):
+    parsed, intent = classify_hits(hits[:1])
+    return {'intent': intent, 'results': parsed[0] if parsed else None, 'planner': planner}
+
+def handle_single_result(hits, planner=None):
+    return jsonify(build_single_result_response(hits, planner))
+
+def resolve_batch_queries(prompts):
+    """Map each distinct normalized prompt to (es_query, planner, error).
+
+    Rule-planned prompts never reach the LLM; the rest share one Gemini call.
+    """
+    with span("schema"):
+        schema_fields = fetch_schema_fields()
+        packages = fetch_package_names()
+    resolved = {}
+    pending = {}
+    for prompt in prompts:
+        key = normalize_prompt(prompt).key
+        if key in resolved or key in pending:
+            continue
+        relation = parse_relationship(prompt, packages)
+        if relation:
+            resolved[key] = (relationship_query(relation), "links", None)
+            continue
+        with span("planning"):
+            plan = plan_query(prompt, schema_fields, packages)
+        if not plan and LOCAL_SEARCH == "first":
+            plan = local_plan(prompt)
+        if plan:
+            resolved[key] = (plan.query, plan.planner, None)
+        else:
+            pending[key] = prompt
+    if pending:
+        try:
+            with span("llm"):
+                queries = generate_elasticsearch_queries(list(pending.values()))
+            for key, query in zip(pending, queries):
+                resolved[key] = (query, "llm", None if query else "LLM did not return a valid Elasticsearch query.")
+        except GeminiRateLimitExceeded as e:
+            record_error("rate_limit")
+            if LLM_FALLBACK:
+                logger.warning(f"[API] Gemini throttled during batch ({e}), using fallback queries.")
+                resolved.update({key: (*offline_query(prompt, schema_fields), None) for key, prompt in pending.items()})
+            else:
+                logger.error("[API] Gemini rate-limit exceeded during batch.")
+                resolved.update({key: (None, "llm", 'Gemini rate-limit exceeded: ' + str(e)) for key in pending})
+        except Exception as e:
+            record_error(error_kind(e))
+            for key, prompt in pending.items():
+                plan = local_plan(prompt) if LLM_FALLBACK and isinstance(e, LLMQueryError) else None
+                resolved[key] = (plan.query, plan.planner, None) if plan else (None, "llm", str(e))
+    return resolved
+
+def execute_es_msearch(search_bodies, indices=None):
+    """Run several search bodies in one _msearch; returns [(hits, error)] in the same order.
+
+    `indices` names the index for each body (default the tenant's data index for all).
+    """
+    body = []
+    for i, search in enumerate(search_bodies):
+        body.append({"index": indices[i] if indices else data_index()})
+        body.append(search)
+    with span("es_search"):
+        results = es.msearch(body=body)
+    responses = results.body['responses'] if hasattr(results, 'body') else results['responses']
+    out = []
+    for resp in responses:
+        if 'error' in resp:
+            record_error("es")
+            out.append((None, str(resp['error'])))
+        else:
+            observe_took(resp)
+            out.append((resp['hits']['hits'], None))
+    return out
+
+def batch_prompts_error(prompts):
+    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+        return "'prompts' must be a list of strings"
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return f"At most {BATCH_MAX_PROMPTS} prompts per batch"
+    return None
+
+def process_batch(prompts):
+    """Answer a list of prompts with per-item `{prompt, intent, results, planner}` bodies."""
+    resolved = resolve_batch_queries(prompts)
+    firsts = {}
+    for prompt in prompts:
+        firsts.setdefault(normalize_prompt(prompt).key, prompt)
+    sizes = {key: result_size(prompt) for key, prompt in firsts.items()}
+    generation = generation_of(fetch_schema())
+    cache_keys = {}
+    searched = {}
+    for key, (query, planner, _) in resolved.items():
+        if query is None:
+            continue
+        if planner == "links":
+            cache_keys[key] = canonical_key(query, index=LINK_INDEX)
+        else:
+            cache_keys[key] = result_key(firsts[key], query, sizes[key])
+        cached = lookup_result(cache_keys[key], generation)
+        if cached is not None:
+            searched[key] = (cached[0], None)
+    keys = [key for key in cache_keys if key not in searched]
+    if keys:
+        try:
+            # Relationship prompts already carry a complete link-index search body
+            links = [resolved[key][1] == "links" for key in keys]
+            bodies = [resolved[key][0] if link else search_body(resolved[key][0], sizes[key])
+                      for key, link in zip(keys, links)]
+            indices = [link_index() if link else data_index() for link in links]
+            for key, (hits, error) in zip(keys, execute_es_msearch(bodies, indices)):
+                if error is None:
+                    with span("parse"):
+                        response = build_process_response(firsts[key], hits, resolved[key][1])
+                    searched[key] = (store_result(cache_keys[key], generation, response)[0], None)
+                else:
+                    searched[key] = (None, error)
+        except Exception as e:
+            logger.error(f"[API] ES msearch failed ({e})")
+            record_error("es")
+            searched.update({key: (None, str(e)) for key in keys})
+    with span("parse"):
+        return [batch_item(prompt, resolved, searched) for prompt in prompts]
+
+def batch_item(prompt, resolved, searched):
+    key = normalize_prompt(prompt).key
+    _, planner, error = resolved[key]
+    payload, search_error = searched.get(key, (None, None))
+    error = error or search_error
+    if error:
+        return {'prompt': prompt, 'intent': 'error', 'results': None, 'planner': planner, 'error': error}
+    return {'prompt': prompt, **payload, 'planner': planner}
+
+def build_process_response(prompt, hits, planner=None):
+    """Shape ES hits into the `{intent, results, planner}` body of /process."""
+    if planner == "links":
+        return build_relationship_response(parse_relationship(prompt, fetch_package_names()), hits)
+    if is_show_all(prompt):
+        return build_show_all_response(hits, planner)
+    return build_single_result_response(hits, planner)
 
 @api_bp.route('/process', methods=['POST'])
 def process():
-    try:
+    """Answer a prompt.
+
+    Optional body fields: `full_source` returns whole documents; for "show all"
+    prompts `page_size`/`cursor` page through results with a point-in-time
+    (follow `next_cursor` until it is null) and `stream` sends NDJSON instead.
+    `tenant` (or the X-Tenant header) picks the dataset to search.
+    """
+    with trace_request('/process'):
         data = request.json
+        try:
+            tenant = request_tenant(data, request.headers)
+        except tenants.UnknownTenant as e:
+            return jsonify(unknown_tenant_body(e)), 404
+        if tenant is not None:
+            annotate(tenant=tenant.name)
+        with tenants.use(tenant):
+            return answer_process(data)
+
+def answer_process(data):
+    try:
         prompt = data.get('prompt', '')
-        logger.info(f"[API] Received prompt: {prompt}")
-        log_llm_prompt(prompt)
-        es_query, rate_limit_error = get_es_query(prompt)
+        annotate(prompt=prompt)
+        page_size, cursor, error = page_options(data)
+        if error:
+            record_error("bad_request")
+            return jsonify({'intent': 'error', 'results': None, 'error': error}), 400
+        full_source = bool(data.get('full_source'))
+        schema = fetch_schema()
+        packages = schema.get('packages', [])
+        relation = parse_relationship(prompt, packages)
+        if relation:
+            return answer_relationship(relation, schema)
+        es_query, planner, rate_limit_error = get_es_query(prompt, packages)
         if rate_limit_error:
-            return jsonify({'intent': 'error', 'results': None, 'error': 'Gemini rate-limit exceeded: ' + rate_limit_error}), 500
+            return jsonify(rate_limited_body(planner, rate_limit_error)), 500
+        if data.get('stream') and is_show_all(prompt):
+            annotate(stream=True)
+            hits = iter_hits(es_query, page_size, full_source=full_source, index=data_index())
+            return Response(stream_with_context(ndjson_lines(hits, planner)), mimetype='application/x-ndjson')
         try:
-            hits = execute_es_query(es_query)
-            if prompt.strip().lower() in ["show all", "show all documents", "show all es docs", "show all elasticsearch documents"]:
-                return handle_show_all(hits)
-            return handle_single_result(hits)
+            if wants_page(data, prompt, cursor):
+                with span("es_search"):
+                    hits, next_cursor = search_page(es_query, page_size, cursor, full_source)
+                response = page_response(hits, next_cursor, planner)
+            else:
+                size, key, generation, cached = search_entry(prompt, es_query, full_source, schema, planner)
+                if cached is None:
+                    hits = execute_es_query(es_query, size, full_source)
+                    cached = store_search(key, generation, prompt, hits, planner)
+                capture("response", lambda: cached[0])
+                return cached_response(cached[1], planner)
+            capture("response", lambda: response)
+            with span("serialize"):
+                resp = jsonify(response)
+            metrics.RESPONSE_BYTES.observe(resp.content_length or 0, endpoint='/process')
+            return resp
+        except InvalidCursor as e:
+            record_error("bad_request")
+            return jsonify({'intent': 'error', 'results': None, 'error': str(e)}), 400
         except Exception as e:
             logger.error(f"[API] ES search failed ({e})")
-            response = {"intent": "error", "results": None}
-            logger.info(f"[API] Sending ES response: {response}")
-            return jsonify(response), 500
+            record_error("es")
+            return jsonify({"intent": "error", "results": None}), 500
     except Exception as e:
         logger.error(f"[API] Unexpected error in /process: {e}")
+        record_error(error_kind(e))
         response = {"intent": "error", "results": None, "error": str(e)}
         return jsonify(response), 500
+
+def answer_relationship(relation, schema):
+    key, generation, cached = relationship_entry(relation, schema)
+    if cached is None:
+        try:
+            hits = execute_link_query(relation)
+        except Exception as e:
+            logger.error(f"[API] Link index search failed ({e})")
+            record_error("es")
+            return jsonify({"intent": "error", "results": None}), 500
+        cached = store_relationship(key, generation, relation, hits)
+    capture("response", lambda: cached[0])
+    return cached_response(cached[1], "links")
+
+@api_bp.route('/process/batch', methods=['POST'])
+def process_batch_endpoint():
+    with trace_request('/process/batch'):
+        try:
+            data = request.json
+            prompts = data.get('prompts')
+            error = batch_prompts_error(prompts)
+            if error:
+                return jsonify({'intent': 'error', 'results': None, 'error': error}), 400
+            try:
+                tenant = request_tenant(data, request.headers)
+            except tenants.UnknownTenant as e:
+                return jsonify(unknown_tenant_body(e)), 404
+            annotate(prompts=len(prompts))
+            if tenant is not None:
+                annotate(tenant=tenant.name)
+            with tenants.use(tenant):
+                items = process_batch(prompts)
+            with span("serialize"):
+                resp = jsonify({'intent': 'batch', 'results': items})
+            metrics.RESPONSE_BYTES.observe(resp.content_length or 0, endpoint='/process/batch')
+            return resp
+        except Exception as e:
+            logger.error(f"[API] Unexpected error in /process/batch: {e}")
+            response = {"intent": "error", "results": None, "error": str(e)}
+            return jsonify(response), 500
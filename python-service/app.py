@@ -1,9 +1,27 @@
 
 from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
 from api import api_bp
+import json_codec
+import tenants
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify through json_codec: orjson when installed, and templated hits encode without copies."""
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj, default=self.default).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_codec.dumps(obj, default=self.default), mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 app.register_blueprint(api_bp)
+# Load the hot tenants' schemas and prompts in the background while the app starts serving
+tenants.start_prewarm()
 
 
 # Global error handler to always return JSON
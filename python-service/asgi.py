@@ -0,0 +1,323 @@
+"""Asyncio-native serving mode for the api_bp endpoints.
+
+Run with an ASGI server, e.g. `uvicorn asgi:app --host 0.0.0.0 --port 5000`.
+Responses (including errors) have the same JSON shape as the Flask app.
+"""
+import asyncio
+import logging
+import traceback
+import contextlib
+from starlette.applications import Starlette
+from elasticsearch import NotFoundError
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import api
+from es_client import create_async_es_client
+from llm import generate_elasticsearch_query_async, fetch_schema, fetch_schema_fields, GeminiRateLimitExceeded, LLMQueryError
+from links import parse_relationship, relationship_query
+from result_cache import with_planner
+from tracing import trace_request, span, capture, annotate, record_error
+import tenants
+import metrics
+import json_codec
+
+logger = logging.getLogger("asgi")
+# How often an in-flight /process request checks whether its client is still there
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse rendered with json_codec (orjson when installed, and aware of api.TemplatedHit)."""
+
+    def render(self, content):
+        return json_codec.dumps(content)
+
+
+async def get_es_query_async(prompt, packages=()):
+    """Async counterpart of api.get_es_query: returns (es_query, planner, error)."""
+    with span("schema"):
+        schema_fields = await asyncio.to_thread(fetch_schema_fields)
+    planned = api.rule_plan(prompt, schema_fields, packages)
+    if planned:
+        return (*planned, None)
+    try:
+        with span("llm"):
+            es_query = await generate_elasticsearch_query_async(prompt)
+    except (GeminiRateLimitExceeded, LLMQueryError) as e:
+        # Includes timeouts
+        return api.llm_failed(prompt, schema_fields, e)
+    return api.llm_planned(es_query)
+
+
+async def execute_es_query_async(es, es_query, size=api.PROCESS_PAGE_SIZE, full_source=False):
+    with span("es_search"):
+        results = await es.search(index=api.data_index(), body=api.search_body(es_query, size, full_source))
+    return api.hits_from_response(results)
+
+
+async def execute_link_query_async(es, relation):
+    annotate(planner="links", relation=relation.kind)
+    with span("es_search"):
+        results = await es.search(index=api.link_index(), body=relationship_query(relation))
+    return api.hits_from_response(results)
+
+
+async def close_pit_async(es, pit_id):
+    try:
+        await es.close_point_in_time(id=pit_id)
+    except Exception as e:
+        logger.warning(f"[ASGI] Could not close point in time ({e})")
+
+
+async def search_page_async(es, es_query, page_size, cursor=None, full_source=False):
+    """Async counterpart of api.search_page: returns (hits, next_cursor)."""
+    index = api.data_index()
+    if cursor:
+        pit_id, search_after = api.decode_cursor(cursor, index)
+    else:
+        pit_id, search_after = (await es.open_point_in_time(index=index, keep_alive=api.PIT_KEEP_ALIVE))['id'], None
+    try:
+        results = await es.search(body=api.page_body(es_query, page_size, pit_id, search_after, full_source))
+    except NotFoundError:
+        if cursor:
+            raise api.InvalidCursor("Invalid or expired cursor")
+        raise
+    hits, pit_id, next_cursor = api.page_result(results, page_size, pit_id, index)
+    if next_cursor is None:
+        await close_pit_async(es, pit_id)
+    return hits, next_cursor
+
+
+async def iter_hits_async(es, es_query, page_size=api.PROCESS_PAGE_SIZE, limit=api.STREAM_MAX_HITS, full_source=False,
+                          index=None):
+    """Async counterpart of api.iter_hits."""
+    index = index or api.ES_INDEX
+    pit_id = (await es.open_point_in_time(index=index, keep_alive=api.PIT_KEEP_ALIVE))['id']
+    search_after = None
+    sent = 0
+    try:
+        while sent < limit:
+            size = min(page_size, limit - sent)
+            results = await es.search(body=api.page_body(es_query, size, pit_id, search_after, full_source))
+            hits, pit_id, next_cursor = api.page_result(results, size, pit_id, index)
+            for hit in hits:
+                yield hit
+            sent += len(hits)
+            if next_cursor is None:
+                break
+            search_after = hits[-1]['sort']
+    finally:
+        await close_pit_async(es, pit_id)
+
+
+async def ndjson_lines_async(hits, planner=None):
+    tracker = api.IntentTracker()
+    async for hit in hits:
+        yield json_codec.dumps(tracker.add(hit)) + b"\n"
+    yield json_codec.dumps({'intent': tracker.intent, 'planner': planner, 'count': tracker.count, 'done': True}) + b"\n"
+
+
+def cached_response(body, planner):
+    with span("serialize"):
+        response = Response(with_planner(body, planner), media_type="application/json")
+    metrics.RESPONSE_BYTES.observe(len(response.body), endpoint='/process')
+    return response
+
+
+async def process_prompt(es, prompt, data=None):
+    """Return (body, status) for a /process prompt, or (Response, None) when the response is already built."""
+    data = data or {}
+    page_size, cursor, error = api.page_options(data)
+    if error:
+        record_error("bad_request")
+        return {'intent': 'error', 'results': None, 'error': error}, 400
+    full_source = bool(data.get('full_source'))
+    schema = await asyncio.to_thread(fetch_schema)
+    packages = schema.get('packages', [])
+    relation = parse_relationship(prompt, packages)
+    if relation:
+        key, generation, cached = api.relationship_entry(relation, schema)
+        if cached is None:
+            try:
+                hits = await execute_link_query_async(es, relation)
+            except Exception as e:
+                logger.error(f"[ASGI] Link index search failed ({e})")
+                record_error("es")
+                return {"intent": "error", "results": None}, 500
+            cached = api.store_relationship(key, generation, relation, hits)
+        return cached_response(cached[1], "links"), None
+    es_query, planner, rate_limit_error = await get_es_query_async(prompt, packages)
+    if rate_limit_error:
+        return api.rate_limited_body(planner, rate_limit_error), 500
+    if data.get('stream') and api.is_show_all(prompt):
+        annotate(stream=True)
+        hits = iter_hits_async(es, es_query, page_size, full_source=full_source, index=api.data_index())
+        return StreamingResponse(ndjson_lines_async(hits, planner), media_type='application/x-ndjson'), None
+    try:
+        if api.wants_page(data, prompt, cursor):
+            with span("es_search"):
+                hits, next_cursor = await search_page_async(es, es_query, page_size, cursor, full_source)
+            return api.page_response(hits, next_cursor, planner), 200
+        size, key, generation, cached = api.search_entry(prompt, es_query, full_source, schema, planner)
+        if cached is None:
+            hits = await execute_es_query_async(es, es_query, size, full_source)
+            cached = api.store_search(key, generation, prompt, hits, planner)
+    except api.InvalidCursor as e:
+        record_error("bad_request")
+        return {'intent': 'error', 'results': None, 'error': str(e)}, 400
+    except Exception as e:
+        logger.error(f"[ASGI] ES search failed ({e})")
+        record_error("es")
+        return {"intent": "error", "results": None}, 500
+    capture("response", lambda: cached[0])
+    return cached_response(cached[1], planner), None
+
+
+async def run_until_disconnect(request, coro):
+    """Await `coro`, cancelling it if the client disconnects first; returns None in that case."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("[ASGI] Client disconnected, cancelling request.")
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def process(request):
+    with trace_request('/process'):
+        try:
+            data = await request.json()
+            prompt = data.get('prompt', '')
+            annotate(prompt=prompt)
+            try:
+                tenant = api.request_tenant(data, request.headers)
+            except tenants.UnknownTenant as e:
+                return JSONResponse(api.unknown_tenant_body(e), status_code=404)
+            if tenant is not None:
+                annotate(tenant=tenant.name)
+            with tenants.use(tenant):
+                # The task copies the tenant along with the rest of the context
+                outcome = await run_until_disconnect(request, process_prompt(request.app.state.es, prompt, data))
+            if outcome is None:
+                # Nobody is reading this; 499 is the conventional "client closed request" status
+                record_error("client_disconnected")
+                return JSONResponse({"intent": "error", "results": None, "error": "Client disconnected"}, status_code=499)
+            body, status = outcome
+            if status is None:
+                return body
+            with span("serialize"):
+                response = JSONResponse(body, status_code=status)
+            metrics.RESPONSE_BYTES.observe(len(response.body), endpoint='/process')
+            return response
+        except Exception as e:
+            logger.error(f"[ASGI] Unexpected error in /process: {e}")
+            record_error(api.error_kind(e))
+            return JSONResponse({"intent": "error", "results": None, "error": str(e)}, status_code=500)
+
+
+async def process_batch(request):
+    with trace_request('/process/batch'):
+        try:
+            data = await request.json()
+            prompts = data.get('prompts')
+            error = api.batch_prompts_error(prompts)
+            if error:
+                return JSONResponse({'intent': 'error', 'results': None, 'error': error}, status_code=400)
+            try:
+                tenant = api.request_tenant(data, request.headers)
+            except tenants.UnknownTenant as e:
+                return JSONResponse(api.unknown_tenant_body(e), status_code=404)
+            annotate(prompts=len(prompts))
+            if tenant is not None:
+                annotate(tenant=tenant.name)
+            with tenants.use(tenant):
+                # One LLM call and one _msearch per batch, so a worker thread is an acceptable cost here
+                items = await asyncio.to_thread(api.process_batch, prompts)
+            with span("serialize"):
+                response = JSONResponse({'intent': 'batch', 'results': items})
+            metrics.RESPONSE_BYTES.observe(len(response.body), endpoint='/process/batch')
+            return response
+        except Exception as e:
+            logger.error(f"[ASGI] Unexpected error in /process/batch: {e}")
+            return JSONResponse({"intent": "error", "results": None, "error": str(e)}, status_code=500)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def repopulate_es(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        data = data or {}
+        try:
+            tenant = api.request_tenant(data, request.headers)
+        except tenants.UnknownTenant as e:
+            return JSONResponse({"status": "error", "error": str(e)}, status_code=404)
+        job, created = api.repopulate_runner.submit(incremental=bool(data.get('incremental')), tenant=tenant)
+        if not created:
+            logger.info(f"[ASGI] Repopulate already in progress, joining job {job.id}")
+        return JSONResponse({"status": "success", "job_id": job.id, "job": job.to_dict()}, status_code=202)
+    except Exception as e:
+        logger.error(f"[ASGI] Repopulate ES endpoint exception: {e}")
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
+
+
+async def repopulate_es_status(request):
+    job_id = request.path_params['job_id']
+    job = api.repopulate_runner.get(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "error": f"Unknown repopulate job: {job_id}"}, status_code=404)
+    return JSONResponse({"status": "success", "job": job.to_dict()})
+
+
+# Same JSON error contract as the handlers in app.py
+async def handle_exception(request, exc):
+    response = {
+        "intent": "error",
+        "results": None,
+        "error": str(exc),
+        "trace": "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    }
+    return JSONResponse(response, status_code=500)
+
+async def handle_404(request, exc):
+    return JSONResponse({"intent": "error", "results": None, "error": "Not Found", "message": str(exc.detail)}, status_code=404)
+
+async def handle_405(request, exc):
+    return JSONResponse({"intent": "error", "results": None, "error": "Method Not Allowed", "message": str(exc.detail)}, status_code=405)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.es = create_async_es_client(api.ES_HOST, api.ES_PORT)
+    tenants.start_prewarm()
+    try:
+        yield
+    finally:
+        await app.state.es.close()
+
+
+routes = [
+    Route('/process', process, methods=['POST']),
+    Route('/process/batch', process_batch, methods=['POST']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/repopulate-es', repopulate_es, methods=['POST']),
+    Route('/repopulate-es/{job_id}', repopulate_es_status, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    exception_handlers={Exception: handle_exception, 404: handle_404, 405: handle_405},
+)
@@ -0,0 +1,620 @@
+"""Offline benchmarks for /process and populate() with a fake Gemini model and an in-memory Elasticsearch.
+
+    python benchmark.py                          # 1k docs, checked against benchmark_baseline.json
+    python benchmark.py --size 100k --scenarios populate process_rules
+    python benchmark.py --update-baseline        # record the current numbers as the baseline
+
+Nothing here talks to a live service: the corpus is generated from the shapes
+of data/log4.json and data/cve.json, populate() bulk-loads it into
+FakeElasticsearch, and LLM calls are answered by FakeGeminiModel after a
+configurable, seeded delay. Exits with status 1 when a scenario regresses
+against the stored baseline by more than the tolerance.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import fnmatch
+import argparse
+import tempfile
+import threading
+import contextlib
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import api
+import llm
+import local_search
+import populate_elasticsearch
+from app import app
+from bulk_indexer import peak_rss_mb
+from llm_guard import LLMGuard, TokenBucket, CircuitBreaker
+from query_cache import query_cache
+from schema_cache import SchemaCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+SCENARIOS = ["populate", "process_rules", "process_llm", "process_show_all", "process_batch", "process_links",
+             "process_local"]
+# Allowed slowdown before a scenario counts as a regression (0.5 = 50% lower throughput or higher p95);
+# generous because shared CI machines are noisy
+BENCH_TOLERANCE = float(os.environ.get("BENCH_TOLERANCE", "0.5"))
+
+
+# --- Fake Gemini ---
+
+# Answer shapes parse_llm_response has to cope with
+LLM_RESPONSE_FORMATS = [
+    "{body}",
+    "```json\n{body}\n```",
+    "Here is the Elasticsearch query:\n{body}\nIt searches the package and CVE fields.",
+    "{clause}",
+]
+
+
+class FakeLLMResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Stands in for genai.GenerativeModel with a seeded latency and canned answers."""
+
+    def __init__(self, latency=0.05, jitter=0.01, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            return max(0.0, self._random.gauss(self.latency, self.jitter))
+
+    def answer(self, prompt):
+        batch = re.search(r"Prompts:\n(.*)\nElasticsearch Queries:", prompt, re.S)
+        if batch:
+            prompts = [re.sub(r"^\d+\.\s*", "", line) for line in batch.group(1).splitlines()]
+            return json.dumps([self.query_for(p) for p in prompts])
+        match = re.search(r"Prompt: (.*)\nElasticsearch Query:", prompt, re.S)
+        text = match.group(1) if match else prompt
+        body = self.query_for(text)
+        template = LLM_RESPONSE_FORMATS[self.calls % len(LLM_RESPONSE_FORMATS)]
+        return template.format(body=json.dumps(body), clause=json.dumps(body["query"]))
+
+    def query_for(self, prompt):
+        return {"query": {"multi_match": {"query": prompt, "fields": ["package.name", "description"]}}}
+
+    def generate_content(self, prompt):
+        time.sleep(self._delay())
+        return FakeLLMResponse(self.answer(prompt))
+
+    async def generate_content_async(self, prompt):
+        import asyncio
+        await asyncio.sleep(self._delay())
+        return FakeLLMResponse(self.answer(prompt))
+
+
+# --- Fake Elasticsearch ---
+
+def field_values(doc, path):
+    """Values at a dotted path, descending through lists."""
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(v.get(part) for v in value if isinstance(v, dict) and part in v)
+            elif isinstance(value, dict) and part in value:
+                found.append(value[part])
+        values = found
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return [v for v in flat if v is not None]
+
+
+def leaf_values(doc):
+    if isinstance(doc, dict):
+        for value in doc.values():
+            yield from leaf_values(value)
+    elif isinstance(doc, list):
+        for value in doc:
+            yield from leaf_values(value)
+    elif doc is not None:
+        yield doc
+
+
+def text_matches(values, needle):
+    needle = str(needle).lower()
+    return any(needle in str(v).lower() for v in values)
+
+
+def clause_value(spec):
+    return spec.get("query", spec.get("value")) if isinstance(spec, dict) else spec
+
+
+def matches(query, doc_id, doc):
+    """Evaluate the subset of the query DSL the planner, fallback and fake LLM produce."""
+    if not query:
+        return True
+    kind, spec = next(iter(query.items()))
+    if kind == "match_all":
+        return True
+    if kind == "ids":
+        return doc_id in spec.get("values", [])
+    if kind == "bool":
+        if not all(matches(q, doc_id, doc) for q in as_list(spec.get("must")) + as_list(spec.get("filter"))):
+            return False
+        if any(matches(q, doc_id, doc) for q in as_list(spec.get("must_not"))):
+            return False
+        should = as_list(spec.get("should"))
+        return not should or any(matches(q, doc_id, doc) for q in should)
+    if kind == "nested":
+        return matches(spec.get("query"), doc_id, doc)
+    if kind == "constant_score":
+        return matches(spec.get("filter"), doc_id, doc)
+    if kind == "multi_match":
+        words = str(spec.get("query", "")).split()
+        fields = [f.split("^")[0] for f in spec.get("fields", ["*"])]
+        values = [v for f in fields for v in (leaf_values(doc) if "*" in f else field_values(doc, f))]
+        return any(text_matches(values, word) for word in words)
+    if kind in ("term", "terms", "prefix", "match", "match_phrase"):
+        field, value = next(iter(spec.items()))
+        values = field_values(doc, field)
+        # Keyword fields use a lowercase normalizer (index_mapping), so exact matches ignore case
+        values = {str(v).lower() for v in values}
+        if kind == "term":
+            return str(clause_value(value)).lower() in values
+        if kind == "terms":
+            return bool({str(v).lower() for v in value} & values)
+        if kind == "prefix":
+            return any(v.startswith(str(clause_value(value)).lower()) for v in values)
+        return text_matches(values, clause_value(value))
+    return False
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def project(source, source_filter):
+    if source_filter is True or source_filter is None:
+        return source
+    if source_filter is False:
+        return {}
+    includes = source_filter.get("includes") if isinstance(source_filter, dict) else source_filter
+    out = {}
+    for path in includes or []:
+        parts = path.split(".")
+        value = source
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = out
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return out
+
+
+class FakeIndices:
+    def __init__(self, es):
+        self.es = es
+
+    def create(self, index, body=None, **kwargs):
+        with self.es.lock:
+            self.es.docs.setdefault(index, {})
+
+    def exists(self, index):
+        return index in self.es.docs
+
+    def delete(self, index, ignore_unavailable=False, **kwargs):
+        with self.es.lock:
+            for name in as_list(index):
+                self.es.docs.pop(name, None)
+                for targets in self.es.aliases.values():
+                    targets.discard(name)
+
+    def put_settings(self, index, body=None, **kwargs):
+        return {"acknowledged": True}
+
+    def refresh(self, index=None, **kwargs):
+        return {}
+
+    def get(self, index, **kwargs):
+        return {name: {} for name in self.es.docs if fnmatch.fnmatch(name, index)}
+
+    def exists_alias(self, name):
+        return bool(self.es.aliases.get(name))
+
+    def get_alias(self, name):
+        return {index: {"aliases": {name: {}}} for index in self.es.aliases.get(name, ())}
+
+    def update_aliases(self, body):
+        with self.es.lock:
+            for action in body["actions"]:
+                kind, spec = next(iter(action.items()))
+                if kind == "add":
+                    self.es.aliases.setdefault(spec["alias"], set()).add(spec["index"])
+                elif kind == "remove":
+                    self.es.aliases.get(spec["alias"], set()).discard(spec["index"])
+                elif kind == "remove_index":
+                    self.es.docs.pop(spec["index"], None)
+        return {"acknowledged": True}
+
+
+class FakeElasticsearch:
+    """Just enough of the Elasticsearch client for populate() and the /process paths.
+
+    Searches scan documents in insertion order and stop once a page is full,
+    so their cost stays small next to the service code being measured;
+    `search_latency` adds a fixed delay per search to mimic the network.
+    """
+
+    def __init__(self, search_latency=0.0):
+        self.docs = {}
+        self.aliases = {}
+        self.pits = {}
+        self.lock = threading.Lock()
+        self.indices = FakeIndices(self)
+        self.search_latency = search_latency
+
+    def ping(self):
+        return True
+
+    def resolve(self, index):
+        names = []
+        for name in as_list(index):
+            names.extend(sorted(self.aliases[name]) if name in self.aliases else [name])
+        return names
+
+    def bulk(self, body, **kwargs):
+        lines = [json.loads(line) for line in body]
+        items = []
+        i = 0
+        with self.lock:
+            while i < len(lines):
+                op, meta = next(iter(lines[i].items()))
+                docs = self.docs.setdefault(meta["_index"], {})
+                if op == "delete":
+                    status = 200 if docs.pop(meta["_id"], None) is not None else 404
+                    i += 1
+                else:
+                    docs[meta["_id"]] = lines[i + 1]
+                    status = 201
+                    i += 2
+                items.append({op: {"_id": meta["_id"], "status": status}})
+        return {"errors": False, "items": items}
+
+    def index(self, index, id, body=None, document=None, **kwargs):
+        with self.lock:
+            self.docs.setdefault(self.resolve(index)[0], {})[id] = body if body is not None else document
+        return {"_id": id, "result": "created"}
+
+    def get(self, index, id, source_includes=None, **kwargs):
+        for name in self.resolve(index):
+            if id in self.docs.get(name, {}):
+                source = self.docs[name][id]
+                return {"_id": id, "_source": project(source, source_includes) if source_includes else source}
+        raise LookupError(f"{index}/{id} not found")
+
+    def update(self, index, id, body, **kwargs):
+        with self.lock:
+            self.docs[self.resolve(index)[0]][id].update(body["doc"])
+
+    def count(self, index, **kwargs):
+        return {"count": sum(len(self.docs.get(name, {})) for name in self.resolve(index))}
+
+    def open_point_in_time(self, index, keep_alive, **kwargs):
+        pit_id = f"pit-{len(self.pits)}-{random.random()}"
+        self.pits[pit_id] = self.resolve(index)
+        return {"id": pit_id}
+
+    def close_point_in_time(self, id=None, **kwargs):
+        self.pits.pop(id, None)
+        return {"succeeded": True}
+
+    def search(self, index=None, body=None, size=None, **kwargs):
+        started = time.perf_counter()
+        if self.search_latency:
+            time.sleep(self.search_latency)
+        body = body or {}
+        pit = body.get("pit")
+        names = self.pits[pit["id"]] if pit else self.resolve(index)
+        size = body.get("size", size if size is not None else 10)
+        after = body.get("search_after", [-1])[-1]
+        hits = []
+        position = -1
+        for name in names:
+            for doc_id, source in list(self.docs.get(name, {}).items()):
+                position += 1
+                if position <= after or not matches(body.get("query"), doc_id, source):
+                    continue
+                hit = {"_index": name, "_id": doc_id, "_score": 1.0,
+                       "_source": project(source, body.get("_source", True))}
+                if pit:
+                    hit["sort"] = [1.0, position]
+                hits.append(hit)
+                if len(hits) >= size:
+                    break
+            if len(hits) >= size:
+                break
+        response = {"took": int((time.perf_counter() - started) * 1000), "hits": {"hits": hits}}
+        if pit:
+            response["pit_id"] = pit["id"]
+        return response
+
+    def msearch(self, body, **kwargs):
+        responses = []
+        for header, search in zip(body[::2], body[1::2]):
+            responses.append(self.search(index=header.get("index"), body=search))
+        return {"responses": responses}
+
+
+# --- Synthetic corpus ---
+
+def load_templates():
+    with open(populate_elasticsearch.LOG4_PATH) as f:
+        components = json.load(f)["components"]
+    with open(populate_elasticsearch.CVE_PATH) as f:
+        cve = json.load(f)
+    return components, cve
+
+
+def cve_id(i):
+    return f"CVE-{2000 + i % 25}-{100000 + i}"
+
+
+def synthetic_component(template, i):
+    comp = json.loads(json.dumps(template))
+    package = comp.setdefault("package", {})
+    name = f"{package.get('name') or 'pkg'}-{i}"
+    version = f"{i % 7}.{i % 13}.{i % 5}"
+    package.update({"name": name, "friendly_name": name, "version": version,
+                    "id": f"SPDX-PACKAGE-{i:08d}", "purl": f"pkg:pypi/{name}@{version}"})
+    comp["sbom_id"] = f"sbom-{i:08d}"
+    return comp
+
+
+def synthetic_cve(template, i, purl=None):
+    """A copy of the template CVE; with `purl`, it also affects that exact component version."""
+    doc = json.loads(json.dumps(template))
+    cve = doc.setdefault("cve", {})
+    for source, key in (("osv", "id"), ("kev", "cveID"), ("epss", "cve")):
+        if isinstance(cve.get(source), dict):
+            cve[source][key] = cve_id(i)
+    if purl and isinstance(cve.get("osv"), dict):
+        package, version = purl.rsplit("@", 1)
+        cve["osv"]["affected"] = [{"package": {"ecosystem": "PyPI", "purl": package}, "versions": [version]}] + \
+            (cve["osv"].get("affected") or [])
+    return doc
+
+
+def generate_corpus(directory, docs, seed=0):
+    """Write an SBOM and a CVE JSON-lines file holding `docs` documents in total; returns their paths."""
+    components, cve = load_templates()
+    rng = random.Random(seed)
+    sbom_path = os.path.join(directory, "sbom.json")
+    cve_path = os.path.join(directory, "cve.jsonl")
+    n_components = docs // 2
+    # Every tenth CVE affects a component, so populate has links to join
+    linked = []
+    with open(sbom_path, "w") as f:
+        f.write('{"status": true, "total": %d, "components": [' % n_components)
+        for i in range(n_components):
+            if i:
+                f.write(",")
+            comp = synthetic_component(rng.choice(components), i)
+            if i % 10 == 0:
+                linked.append(comp["package"]["purl"])
+            f.write(json.dumps(comp))
+        f.write("]}")
+    with open(cve_path, "w") as f:
+        for i in range(docs - n_components):
+            purl = linked[i // 10] if i % 10 == 0 and i // 10 < len(linked) else None
+            f.write(json.dumps(synthetic_cve(cve, i, purl)) + "\n")
+    return sbom_path, cve_path
+
+
+# --- Scenarios ---
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, seconds, errors, rss_before, units=None):
+    latencies = sorted(latencies)
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round((units if units is not None else len(latencies)) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    result["rss_growth_mb"] = round(result["peak_rss_mb"] - rss_before, 1)
+    return result
+
+
+def run_populate(es, sbom_path, cve_path, manifest_path):
+    rss_before = peak_rss_mb()
+    save_manifest = populate_elasticsearch.save_manifest
+    with mock.patch.object(populate_elasticsearch, "LOG4_PATH", sbom_path), \
+            mock.patch.object(populate_elasticsearch, "CVE_PATH", cve_path), \
+            mock.patch.object(populate_elasticsearch, "save_manifest",
+                              lambda manifest, path=None: save_manifest(manifest, manifest_path)), \
+            contextlib.redirect_stdout(open(os.devnull, "w")):
+        started = time.perf_counter()
+        stats = populate_elasticsearch.populate(es=es)
+        seconds = time.perf_counter() - started
+    result = summarize([seconds], seconds, stats["errors"], rss_before, units=stats["docs"])
+    result["docs"] = stats["docs"]
+    return result
+
+
+def run_requests(client, path, bodies, concurrency):
+    rss_before = peak_rss_mb()
+    latencies = []
+    errors = []
+
+    def send(body):
+        started = time.perf_counter()
+        resp = client.post(path, json=body)
+        resp.get_data()
+        elapsed = time.perf_counter() - started
+        if resp.status_code != 200:
+            errors.append(resp.status_code)
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies.extend(pool.map(send, bodies))
+    return summarize(latencies, time.perf_counter() - started, len(errors), rss_before)
+
+
+def scenario_bodies(name, requests, docs):
+    n_cves = docs - docs // 2
+    if name == "process_rules":
+        return [{"prompt": f"show me {cve_id(i % n_cves)}"} for i in range(requests)]
+    if name in ("process_llm", "process_local"):
+        # Unique wording so every request misses the query cache and reaches the model (or the local index)
+        return [{"prompt": f"which packages are affected by remote code execution issue number {i}"}
+                for i in range(requests)]
+    if name == "process_show_all":
+        return [{"prompt": "show all"} for _ in range(requests)]
+    if name == "process_links":
+        return [{"prompt": f"which components are affected by {cve_id((i * 10) % n_cves)}"} for i in range(requests)]
+    if name == "process_batch":
+        return [{"prompts": [f"show me {cve_id((i + j) % n_cves)}" if j % 2 else
+                             f"risky packages in batch {i} item {j}" for j in range(20)]}
+                for i in range(max(1, requests // 5))]
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+@contextlib.contextmanager
+def fake_services(es, model):
+    """Point the service modules at the fakes for the duration of a run."""
+    guard = LLMGuard(bucket=TokenBucket(rate_per_min=0, db_path=""), breaker=CircuitBreaker(),
+                     retry_on=(llm.exceptions.ResourceExhausted,))
+    with mock.patch.object(api, "es", es), \
+            mock.patch.object(llm, "schema_cache", SchemaCache(client_factory=lambda: es)), \
+            mock.patch.object(llm, "get_model", lambda: model), \
+            mock.patch.object(llm, "llm_guard", guard):
+        yield
+
+
+def run(size="1k", scenarios=SCENARIOS, requests=200, concurrency=8, llm_latency=0.05, llm_jitter=0.01,
+        es_latency=0.0, seed=0):
+    """Run the scenarios and return {scenario: result}; `size` is a SIZES key or a document count."""
+    docs = SIZES[size] if isinstance(size, str) else size
+    es = FakeElasticsearch(search_latency=es_latency)
+    model = FakeGeminiModel(latency=llm_latency, jitter=llm_jitter, seed=seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, fake_services(es, model), \
+            mock.patch.object(local_search, "LOCAL_INDEX_PATH", os.path.join(tmp, "local_index.bin")):
+        sbom_path, cve_path = generate_corpus(tmp, docs, seed)
+        # The request scenarios need data, so populate always runs first
+        results["populate"] = run_populate(es, sbom_path, cve_path, os.path.join(tmp, "manifest.json"))
+        client = app.test_client()
+        for name in scenarios:
+            if name == "populate":
+                continue
+            query_cache.invalidate()
+            path = "/process/batch" if name == "process_batch" else "/process"
+            with mock.patch.object(api, "LOCAL_SEARCH", "first" if name == "process_local" else api.LOCAL_SEARCH):
+                results[name] = run_requests(client, path, scenario_bodies(name, requests, docs), concurrency)
+    if "populate" not in scenarios:
+        results.pop("populate")
+    return results
+
+
+# --- Baseline ---
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results, baseline, tolerance=BENCH_TOLERANCE):
+    """Compare results with the baseline for the same size; returns a list of messages."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: {result['errors']} errors (baseline {base.get('errors', 0)})")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']}/s (baseline {base['throughput']}/s)")
+        if name != "populate" and result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms (baseline {base['p95_ms']} ms)")
+    return regressions
+
+
+def format_results(results):
+    header = f"{'scenario':<18}{'requests':>9}{'errors':>8}{'throughput/s':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}"
+    lines = [header]
+    for name, r in results.items():
+        lines.append(f"{name:<18}{r['requests']:>9}{r['errors']:>8}{r['throughput']:>14}{r['p50_ms']:>10}"
+                     f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['peak_rss_mb']:>13}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the Python service.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="1k", help="Synthetic corpus size.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per /process scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Mean fake Gemini latency in seconds.")
+    parser.add_argument("--llm-jitter", type=float, default=0.01)
+    parser.add_argument("--es-latency", type=float, default=0.0, help="Fixed delay per fake ES search in seconds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.scenarios, args.requests, args.concurrency, args.llm_latency,
+                  args.llm_jitter, args.es_latency, args.seed)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        baseline[args.size] = results
+        save_baseline(baseline, args.baseline)
+        print(f"[benchmark] Baseline for {args.size} written to {args.baseline}")
+        return 0
+    regressions = find_regressions(results, baseline.get(args.size, {}), args.tolerance)
+    for message in regressions:
+        print(f"[benchmark] REGRESSION {message}")
+    if not baseline.get(args.size):
+        print(f"[benchmark] No baseline for {args.size}; run with --update-baseline to record one.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import random
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import ijson
+except ImportError:  # optional: fall back to loading the whole file
+    ijson = None
+
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "4"))
+BULK_MAX_RETRIES = int(os.environ.get("BULK_MAX_RETRIES", "3"))
+# Item statuses that mean "cluster is busy, try again" rather than a bad document
+RETRYABLE_STATUSES = {429, 503}
+
+
+def iter_json_lines(path):
+    """Yield one record per non-empty line of a JSON-lines file."""
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_components(path):
+    """Yield the items of the top-level `components` array without loading the whole file.
+
+    Uses ijson when it is installed; otherwise the file is parsed in one go.
+    Yields nothing if the file has no top-level `components` array.
+    """
+    if ijson is not None:
+        with open(path, "rb") as f:
+            # use_float keeps numbers as float instead of Decimal, which json.dumps can't encode
+            yield from ijson.items(f, "components.item", use_float=True)
+        return
+    with open(path, "r") as f:
+        doc = json.load(f)
+    if isinstance(doc, dict):
+        yield from doc.get("components") or []
+
+
+def read_components(path):
+    """(components, None) for a file with a top-level `components` array, else (None, the parsed document).
+
+    The file is parsed once either way: with ijson the components are streamed by
+    iter_components after a scan of the top-level keys that builds nothing.
+    """
+    if ijson is None:
+        with open(path, "r") as f:
+            doc = json.load(f)
+        if isinstance(doc, dict) and "components" in doc:
+            return doc["components"] or [], None
+        return None, doc
+    if _has_components(path):
+        return iter_components(path), None
+    with open(path, "r") as f:
+        return None, json.load(f)
+
+
+def _has_components(path):
+    """Whether `path` is an object with a top-level `components` key; stops at that key."""
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix != "":
+                continue
+            if event == "map_key" and value == "components":
+                return True
+            if event != "start_map" and event != "map_key":
+                # a scalar or array at the top, or the end of the object
+                return False
+    return False
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class BulkIndexer:
+    """Batch documents into `_bulk` requests sent by a pool of worker threads.
+
+    At most `workers * 2` chunks are in flight; `add` blocks beyond that so a
+    fast reader can't buffer an entire feed in memory. Items rejected with a
+    retryable status are resent with exponential backoff.
+    """
+
+    def __init__(self, es, index_name, chunk_size=BULK_CHUNK_SIZE, max_bytes=BULK_MAX_BYTES,
+                 workers=BULK_WORKERS, max_retries=BULK_MAX_RETRIES, on_progress=None):
+        self.es = es
+        self.index_name = index_name
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        # Called with stats() from a worker thread after every bulk response
+        self.on_progress = on_progress
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._chunk = []
+        self._chunk_bytes = 0
+        self.indexed = 0
+        self.errors = []
+        self.started = time.time()
+        self.finished = None
+
+    def add(self, doc_id, doc):
+        action = json.dumps({"index": {"_index": self.index_name, "_id": doc_id}}).encode("utf-8") + b"\n"
+        source = json.dumps(doc).encode("utf-8") + b"\n"
+        self._append(doc_id, action, source)
+
+    def delete(self, doc_id):
+        action = json.dumps({"delete": {"_index": self.index_name, "_id": doc_id}}).encode("utf-8") + b"\n"
+        self._append(doc_id, action, None)
+
+    def _append(self, doc_id, action, source):
+        self._chunk.append((doc_id, action, source))
+        self._chunk_bytes += len(action) + (len(source) if source else 0)
+        if len(self._chunk) >= self.chunk_size or self._chunk_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._chunk:
+            return
+        # Drop finished requests (surfacing worker exceptions) so a long feed doesn't accumulate futures;
+        # done before taking the chunk and a slot, so a raising worker neither loses the chunk nor leaks the slot
+        done, pending = [], []
+        for f in self._futures:
+            (done if f.done() else pending).append(f)
+        self._futures = pending
+        for f in done:
+            f.result()
+        chunk, self._chunk, self._chunk_bytes = self._chunk, [], 0
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._send, chunk)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _send(self, chunk):
+        attempt = 0
+        while chunk:
+            body = [line for _, action, source in chunk for line in (action, source) if line is not None]
+            try:
+                resp = self.es.bulk(body=body)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self.errors.extend((doc_id, str(e)) for doc_id, _, _ in chunk)
+                    return
+                attempt += 1
+                self._backoff(attempt)
+                continue
+            retry = []
+            ok = 0
+            for item, entry in zip(resp["items"], chunk):
+                op, result = next(iter(item.items()))
+                status = result.get("status", 500)
+                # Deleting a doc that is already gone is not an error
+                if status < 300 or (op == "delete" and status == 404):
+                    ok += 1
+                elif status in RETRYABLE_STATUSES and attempt < self.max_retries:
+                    retry.append(entry)
+                else:
+                    with self._lock:
+                        self.errors.append((entry[0], result.get("error")))
+            with self._lock:
+                self.indexed += ok
+            if self.on_progress is not None:
+                self.on_progress(self.stats())
+            chunk = retry
+            if chunk:
+                attempt += 1
+                self._backoff(attempt)
+
+    def _backoff(self, attempt):
+        time.sleep(min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def close(self):
+        """Flush the last chunk, wait for every request and return run stats."""
+        try:
+            self.flush()
+            for future in self._futures:
+                future.result()
+        finally:
+            self._pool.shutdown()
+            self.finished = time.time()
+        return self.stats()
+
+    def stats(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            "docs": self.indexed,
+            "errors": len(self.errors),
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round(self.indexed / elapsed, 1) if elapsed > 0 else 0.0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
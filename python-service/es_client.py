@@ -0,0 +1,59 @@
+import os
+import threading
+from elasticsearch import Elasticsearch
+import json_codec
+
+# Connection pool tuning shared by the API, the LLM schema lookups and populate.
+# urllib3 keeps pooled connections alive between requests.
+ES_POOL_MAXSIZE = int(os.environ.get("ES_POOL_MAXSIZE", "16"))
+ES_REQUEST_TIMEOUT = float(os.environ.get("ES_REQUEST_TIMEOUT", "30"))
+ES_MAX_RETRIES = int(os.environ.get("ES_MAX_RETRIES", "3"))
+ES_RETRY_ON_TIMEOUT = os.environ.get("ES_RETRY_ON_TIMEOUT", "true").lower() in ("1", "true", "yes")
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_es_client(host=None, port=None):
+    """Return the process-wide pooled client for host:port, creating it on first use.
+
+    Host and port default to ES_HOST/ES_PORT, read at call time so a .env
+    loaded after import still applies.
+    """
+    host = host or os.environ.get("ES_HOST", "elasticsearch")
+    port = port or os.environ.get("ES_PORT", "9200")
+    url = f"http://{host}:{port}"
+    client = _clients.get(url)
+    if client is None:
+        with _lock:
+            client = _clients.get(url)
+            if client is None:
+                client = Elasticsearch(
+                    url,
+                    connections_per_node=ES_POOL_MAXSIZE,
+                    request_timeout=ES_REQUEST_TIMEOUT,
+                    max_retries=ES_MAX_RETRIES,
+                    retry_on_timeout=ES_RETRY_ON_TIMEOUT,
+                    serializer=json_codec.serializer(),
+                )
+                _clients[url] = client
+    return client
+
+
+def create_async_es_client(host=None, port=None):
+    """Build an AsyncElasticsearch client with the same pool settings.
+
+    Async clients are bound to the event loop that uses them, so the ASGI app
+    creates one at startup and closes it at shutdown instead of caching it here.
+    """
+    from elasticsearch import AsyncElasticsearch
+    host = host or os.environ.get("ES_HOST", "elasticsearch")
+    port = port or os.environ.get("ES_PORT", "9200")
+    return AsyncElasticsearch(
+        f"http://{host}:{port}",
+        connections_per_node=ES_POOL_MAXSIZE,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=ES_MAX_RETRIES,
+        retry_on_timeout=ES_RETRY_ON_TIMEOUT,
+        serializer=json_codec.serializer(),
+    )
@@ -0,0 +1,145 @@
+"""Explicit settings and mappings for the data index, and what they mean for queries.
+
+Ids, types, names, versions and purls are keywords (lowercase-normalized, so
+term queries are case-insensitive), `affected_packages` is nested, and the raw
+`original` CVE feed is kept in _source only. Fields not listed here are still
+mapped dynamically.
+"""
+import os
+import copy
+
+# Primary shards per data-index generation
+INDEX_SHARDS = int(os.environ.get("ES_INDEX_SHARDS", "1"))
+# Replicas once a bulk load is done; 0 suits the single-node Docker Compose setup
+INDEX_REPLICAS = int(os.environ.get("ES_INDEX_REPLICAS", "0"))
+
+EXACT = {"type": "keyword", "normalizer": "lowercase", "ignore_above": 256}
+
+MAPPINGS = {
+    "properties": {
+        "id": EXACT,
+        "type": EXACT,
+        "sbom_id": EXACT,
+        "description": {"type": "text"},
+        "package": {
+            "properties": {
+                "id": EXACT,
+                # "ecosystem:name:version", e.g. pypi:log4jscanner:1.0.0
+                "name": EXACT,
+                # The bare name ("log4jscanner"), derived at load time for term lookups by name
+                "short_name": EXACT,
+                "version": EXACT,
+                "purl": EXACT,
+                "friendly_name": {"type": "text"},
+                "desc": {"type": "text"},
+            }
+        },
+        "affected_packages": {
+            "type": "nested",
+            "properties": {
+                "name": EXACT,
+                "purl": EXACT,
+                "ecosystem": EXACT,
+            }
+        },
+        # Raw feed, returned with the hit but never searched; the fields above are flattened from it
+        "original": {"type": "object", "enabled": False},
+    }
+}
+
+# Documents written by links.LinkBuilder; every field is an exact-match key except the description
+LINK_MAPPINGS = {
+    "properties": {
+        "cve_id": EXACT,
+        "cve_description": {"type": "text", "index": False},
+        "component_id": EXACT,
+        "package_key": EXACT,
+        "package_name": EXACT,
+        "version": EXACT,
+        "purl": EXACT,
+        "friendly_name": EXACT,
+        "ecosystem": EXACT,
+        "match": EXACT,
+    }
+}
+
+SETTINGS = {
+    "index": {
+        "number_of_shards": INDEX_SHARDS,
+        # No replicas or refreshes while bulk loading; see bulk_load_done_settings()
+        "number_of_replicas": 0,
+        "refresh_interval": "-1",
+    },
+    "analysis": {
+        "normalizer": {"lowercase": {"type": "custom", "filter": ["lowercase"]}},
+    },
+}
+
+
+def _collect(properties, prefix=""):
+    exact, nested, unindexed = set(), set(), set()
+    for name, spec in properties.items():
+        path = f"{prefix}{name}"
+        if spec.get("type") == "keyword":
+            exact.add(path)
+        if spec.get("type") == "nested":
+            nested.add(path)
+        if spec.get("enabled") is False:
+            unindexed.add(path)
+        if "properties" in spec:
+            sub = _collect(spec["properties"], path + ".")
+            exact |= sub[0]
+            nested |= sub[1]
+            unindexed |= sub[2]
+    return exact, nested, unindexed
+
+
+EXACT_FIELDS, NESTED_PATHS, UNINDEXED_PATHS = (frozenset(s) for s in _collect(MAPPINGS["properties"]))
+
+
+def index_body(bulk_load=True):
+    """Body for indices.create of a data index; pass bulk_load=False for one that is written to directly."""
+    settings = copy.deepcopy(SETTINGS)
+    if not bulk_load:
+        settings["index"].update(bulk_load_done_settings()["index"])
+        del settings["index"]["refresh_interval"]
+    return {"settings": settings, "mappings": copy.deepcopy(MAPPINGS)}
+
+
+def link_index_body():
+    """Body for indices.create of a link-index generation (small, so no bulk-load settings)."""
+    settings = copy.deepcopy(SETTINGS)
+    settings["index"].update(bulk_load_done_settings()["index"])
+    del settings["index"]["refresh_interval"]
+    return {"settings": settings, "mappings": copy.deepcopy(LINK_MAPPINGS)}
+
+
+def bulk_load_done_settings():
+    """Settings to apply once a bulk load has finished (None restores the default refresh interval)."""
+    return {"index": {"refresh_interval": None, "number_of_replicas": INDEX_REPLICAS}}
+
+
+def _under(path, prefixes):
+    return next((p for p in prefixes if path == p or path.startswith(p + ".")), None)
+
+
+def is_exact(path):
+    return path in EXACT_FIELDS
+
+
+def is_searchable(path):
+    return _under(path, UNINDEXED_PATHS) is None
+
+
+def nested_path(path):
+    """The nested object `path` lives in, or None."""
+    return _under(path, NESTED_PATHS)
+
+
+def field_clause(kind, field, value):
+    """A `{kind: {field: value}}` clause, wrapped in a nested query when the field needs one."""
+    clause = {kind: {field: value}}
+    path = nested_path(field)
+    if path and path != field:
+        return {"nested": {"path": path, "query": clause}}
+    return clause
@@ -0,0 +1,129 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("jobs")
+
+# How many finished jobs stay queryable through GET /repopulate-es/<job_id>
+JOB_HISTORY = 20
+
+
+class RepopulateJob:
+    """State of one background populate() run, updated from the worker thread."""
+
+    def __init__(self, incremental=False, tenant=None):
+        self.id = uuid.uuid4().hex
+        self.incremental = incremental
+        # A tenants.Tenant, or None for the default tenant
+        self.tenant = tenant
+        self.state = "queued"
+        self.phase = "queued"
+        self.docs_indexed = 0
+        self.docs_per_sec = 0.0
+        self.errors = []
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def progress(self, phase, **stats):
+        self.phase = phase
+        if "docs" in stats:
+            self.docs_indexed = stats["docs"]
+        if "docs_per_sec" in stats:
+            self.docs_per_sec = stats["docs_per_sec"]
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "phase": self.phase,
+            "incremental": self.incremental,
+            "tenant": self.tenant.name if self.tenant is not None else None,
+            "docs_indexed": self.docs_indexed,
+            "docs_per_sec": self.docs_per_sec,
+            "errors": self.errors,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class RepopulateRunner:
+    """Run populate() on a background thread, one job at a time per tenant.
+
+    A request that arrives while a job for the same tenant is queued or
+    running gets that job back instead of starting a second load, as long as
+    the job covers it: a full load absorbs any request, an incremental load
+    only incremental ones. A full request during an incremental load is
+    queued as a follow-up that starts when the incremental load finishes.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._follow_ups = {}
+
+    def submit(self, incremental=False, tenant=None):
+        """Return (job, created) where created is False if an active or queued job was reused."""
+        key = tenant.name if tenant is not None else None
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None and active.active:
+                if incremental or not active.incremental:
+                    return active, False
+                follow_up = self._follow_ups.get(key)
+                if follow_up is not None:
+                    return follow_up, False
+                job = self._follow_ups[key] = self._add(incremental, tenant)
+                return job, True
+            job = self._active[key] = self._add(incremental, tenant)
+        self._start(job)
+        return job, True
+
+    def _add(self, incremental, tenant):
+        # Callers hold self._lock
+        job = RepopulateJob(incremental=incremental, tenant=tenant)
+        self._jobs[job.id] = job
+        while len(self._jobs) > JOB_HISTORY:
+            self._jobs.popitem(last=False)
+        return job
+
+    def _start(self, job):
+        thread = threading.Thread(target=self._run, args=(job,), name=f"repopulate-{job.id[:8]}", daemon=True)
+        thread.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.state = "running"
+        job.started = time.time()
+        try:
+            kwargs = {"tenant": job.tenant} if job.tenant is not None else {}
+            job.result = self.target(incremental=job.incremental, progress=job.progress, **kwargs)
+            job.state = "succeeded"
+            job.phase = "done"
+        except Exception as e:
+            logger.error(f"[Jobs] Repopulate job {job.id} failed: {e}")
+            job.errors.append(f"{type(e).__name__}: {e}")
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
+            key = job.tenant.name if job.tenant is not None else None
+            with self._lock:
+                follow_up = self._follow_ups.pop(key, None)
+                if follow_up is not None:
+                    self._active[key] = follow_up
+            if follow_up is not None:
+                self._start(follow_up)
@@ -0,0 +1,41 @@
+"""JSON encoding for responses and cached bodies: orjson when it is installed, the stdlib encoder otherwise.
+
+Objects with a `__json__()` method (api.TemplatedHit) are encoded through it,
+so result entries can reference ES hits instead of copying them into new dicts.
+"""
+import json
+import functools
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+
+def encode_default(obj, fallback=None):
+    to_json = getattr(obj, "__json__", None)
+    if to_json is not None:
+        return to_json()
+    if fallback is not None:
+        return fallback(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, default=None):
+    """Compact UTF-8 JSON bytes; `default` handles types neither encoder knows."""
+    hook = encode_default if default is None else functools.partial(encode_default, fallback=default)
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=hook)
+        except TypeError:
+            # Non-string keys or integers over 64 bits; the stdlib encoder copes with both
+            pass
+    return json.dumps(obj, default=hook, separators=(",", ":")).encode("utf-8")
+
+
+def serializer():
+    """Elasticsearch client serializer to parse responses with, or None for the client's default."""
+    if orjson is None:
+        return None
+    from elasticsearch.serializer import OrjsonSerializer
+    return OrjsonSerializer()
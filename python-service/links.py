@@ -0,0 +1,247 @@
+"""CVE-to-component links, joined once at populate time and read back by relationship prompts.
+
+populate feeds every document to a LinkBuilder, which keys components and
+the packages each CVE affects by a normalized purl (type, namespace for
+ecosystems that have one, and name). Every CVE/component pair sharing a key
+whose component version is affected becomes one document in the link index,
+so "which components does CVE-X affect" and "what CVEs hit log4j-core 2.14"
+are answered with a single search instead of a client-side join.
+"""
+import os
+import re
+import bisect
+from collections import namedtuple
+from urllib.parse import unquote
+from query_cache import normalize_prompt
+
+# Read alias; populate points it at the link generation built alongside nlp_index
+LINK_INDEX = os.environ.get("LINK_INDEX", "nlp_links")
+# Most links one relationship prompt returns
+LINK_MAX_RESULTS = int(os.environ.get("LINK_MAX_RESULTS", "500"))
+DESCRIPTION_MAX_CHARS = 200
+
+# OSV ecosystem names to purl types
+OSV_PURL_TYPES = {
+    "pypi": "pypi", "npm": "npm", "maven": "maven", "go": "golang", "crates.io": "cargo", "rubygems": "gem",
+    "nuget": "nuget", "packagist": "composer", "hex": "hex", "pub": "pub", "alpine": "apk", "debian": "deb",
+    "ubuntu": "deb",
+}
+# purl types whose namespace is part of the package identity (maven group, npm scope, Go module path)
+NAMESPACED_TYPES = {"maven", "npm", "golang", "composer"}
+
+# A CVE prompt only asks for components when it names them; "what is the impact of CVE-X" is about the CVE
+COMPONENT_WORDS = {"component", "components", "package", "packages", "library", "libraries", "dependency",
+                   "dependencies"}
+CVE_WORDS = {"cve", "cves", "vulnerability", "vulnerabilities", "advisories"}
+TARGET_RE = re.compile(r'\b(?:hit|hits|affect|affects|affecting|impact|impacts|impacting|in|for|of|against)\s+'
+                       r'([a-z0-9@][\w.\-/]*)(?:[\s:@]+v?(\d[\w.\-]*))?$')
+
+Relationship = namedtuple("Relationship", ["kind", "cves", "name", "version"])
+
+
+def purl_key(purl):
+    """(key, name, version) for a package URL, e.g. ("maven/org.apache/log4j-core", "log4j-core", "2.14.1")."""
+    if not purl or not purl.startswith("pkg:"):
+        return None, None, None
+    rest = purl[4:].split("#", 1)[0].split("?", 1)[0]
+    version = None
+    if "@" in rest.lstrip("@"):
+        rest, version = rest.rsplit("@", 1)
+        version = unquote(version)
+    parts = [unquote(p) for p in rest.strip("/").split("/")]
+    if len(parts) < 2:
+        return None, None, None
+    ptype, name = parts[0].lower(), parts[-1].lower()
+    namespace = "/".join(parts[1:-1]).lower()
+    if ptype in NAMESPACED_TYPES and namespace:
+        return f"{ptype}/{namespace}/{name}", name, version
+    return f"{ptype}/{name}", name, version
+
+
+def ecosystem_key(ecosystem, name):
+    """Key for an OSV (ecosystem, name) pair with no purl, matching purl_key's format."""
+    if not ecosystem or not name:
+        return None
+    ptype = OSV_PURL_TYPES.get(ecosystem.split(":", 1)[0].lower(), ecosystem.split(":", 1)[0].lower())
+    name = name.lower()
+    if ptype == "maven":
+        name = name.replace(":", "/")
+    if ptype not in NAMESPACED_TYPES:
+        name = name.rsplit("/", 1)[-1]
+    return f"{ptype}/{name}"
+
+
+def version_key(version):
+    """Sortable form of a version string; good enough for the dotted versions in OSV ranges."""
+    return [(0, int(p), "") if p.isdigit() else (1, 0, p) for p in re.split(r"[.\-+_~]", str(version)) if p]
+
+
+def in_ranges(version, ranges):
+    """True/False when the OSV ranges decide whether `version` is affected, None when they can't."""
+    decided = None
+    for rng in ranges or []:
+        if rng.get("type") not in ("ECOSYSTEM", "SEMVER"):
+            continue
+        decided = False
+        introduced = None
+        for event in rng.get("events") or []:
+            if event.get("introduced") is not None:
+                introduced = event["introduced"]
+            upper = event.get("fixed") or event.get("last_affected")
+            if upper is None or introduced is None:
+                continue
+            v = version_key(version)
+            low = introduced == "0" or v >= version_key(introduced)
+            high = v < version_key(upper) if event.get("fixed") else v <= version_key(upper)
+            if low and high:
+                return True
+            introduced = None
+        if introduced is not None and (introduced == "0" or version_key(version) >= version_key(introduced)):
+            # Introduced and never fixed
+            return True
+    return decided
+
+
+def affected_entries(doc):
+    """The OSV `affected` entries of a CVE doc, or its flattened affected_packages when the feed has none."""
+    osv = ((doc.get("original") or {}).get("cve") or {}).get("osv") or {}
+    entries = osv.get("affected")
+    if entries:
+        return entries
+    return [{"package": pkg} for pkg in doc.get("affected_packages") or []]
+
+
+class LinkBuilder:
+    """Streaming hash join: components are kept by package key and each CVE is joined as it arrives.
+
+    Components must be added before CVEs (populate loads the SBOM first), so
+    only the component side and the resulting links are held in memory.
+    """
+
+    def __init__(self):
+        self.components = {}  # package key -> [(doc_id, version, purl, friendly_name)]
+        self._names = set()
+        self._links = {}
+
+    def add(self, doc_id, doc):
+        kind = doc.get("type")
+        if kind == "component":
+            package = doc.get("package") or {}
+            if package.get("short_name"):
+                self._names.add(package["short_name"])
+            key, _, purl_version = purl_key(package.get("purl"))
+            if key:
+                version = package.get("version") or purl_version
+                self.components.setdefault(key, []).append(
+                    (doc_id, version, package.get("purl"), package.get("friendly_name")))
+        elif kind == "cve" and self.components:
+            self._join(doc.get("id") or doc_id, doc)
+
+    def _join(self, cve_id, doc):
+        seen = set()
+        for entry in affected_entries(doc):
+            package = entry.get("package") or {}
+            key = purl_key(package.get("purl"))[0] or ecosystem_key(package.get("ecosystem"), package.get("name"))
+            candidates = self.components.get(key)
+            if not candidates:
+                continue
+            versions = set(entry.get("versions") or ())
+            for component_id, version, purl, friendly_name in candidates:
+                if component_id in seen:
+                    continue
+                match = self.match(version, versions, entry.get("ranges"))
+                if match is None:
+                    continue
+                seen.add(component_id)
+                self._links[f"{cve_id}|{component_id}"] = {
+                    "cve_id": cve_id,
+                    "cve_description": (doc.get("description") or "")[:DESCRIPTION_MAX_CHARS],
+                    "component_id": component_id,
+                    "package_key": key,
+                    "package_name": key.rsplit("/", 1)[-1],
+                    "version": version,
+                    "purl": purl,
+                    "friendly_name": friendly_name,
+                    "ecosystem": package.get("ecosystem"),
+                    "match": match,
+                }
+
+    def links(self):
+        """(link_id, link_doc) for every affected component, one per CVE/component pair."""
+        return iter(self._links.items())
+
+    def package_names(self):
+        """Sorted bare names of every component's package, as stored in the schema-index for is_known_package."""
+        return sorted(self._names)
+
+    @staticmethod
+    def match(version, versions, ranges):
+        """How a component version was matched ("version", "range" or "name"), or None when it is not affected."""
+        if version and versions and version in versions:
+            return "version"
+        if version and ranges:
+            affected = in_ranges(version, ranges)
+            if affected is not None:
+                return "range" if affected else None
+        if versions:
+            return None
+        # Nothing to check the version against; the package itself is affected
+        return "name"
+
+
+def is_known_package(name, packages):
+    """True when `name` is in `packages`, the sorted package names populate records in the schema-index."""
+    i = bisect.bisect_left(packages, name)
+    return i < len(packages) and packages[i] == name
+
+
+def parse_relationship(prompt, packages=()):
+    """Recognize CVE<->component prompts; returns a Relationship or None.
+
+    `packages` are the known package names (the schema-index's "packages");
+    a "CVEs in X" prompt is only a relationship when X is one of them, so
+    "cves in 2021" or "vulnerabilities in production" go to the planner.
+    """
+    norm = normalize_prompt(prompt)
+    words = set(re.findall(r"[a-z]+", norm.text))
+    if norm.cves and words & COMPONENT_WORDS:
+        return Relationship("components_for_cve", norm.cves, None, None)
+    if norm.cves or not words & CVE_WORDS:
+        return None
+    if norm.components:
+        name, version = norm.components[0]
+    else:
+        match = TARGET_RE.search(norm.text)
+        if not match:
+            return None
+        name, version = match.groups()
+    if not is_known_package(name.rsplit("/", 1)[-1], packages):
+        return None
+    return Relationship("cves_for_component", [], name, version)
+
+
+def relationship_query(relation, size=LINK_MAX_RESULTS):
+    """Search body for the link index."""
+    if relation.kind == "components_for_cve":
+        clauses = [{"terms": {"cve_id": relation.cves}}]
+        sort = [{"package_name": "asc"}, {"version": "asc"}]
+    else:
+        # A bare name, or the last segment of a purl-style name
+        clauses = [{"term": {"package_name": relation.name.rsplit("/", 1)[-1]}}]
+        if relation.version:
+            clauses.append({"bool": {"should": [
+                {"term": {"version": relation.version}},
+                {"prefix": {"version": relation.version + "."}},
+            ], "minimum_should_match": 1}})
+        sort = [{"cve_id": "desc"}]
+    return {"query": {"bool": {"filter": clauses}}, "size": size, "sort": sort}
+
+
+def build_relationship_response(relation, hits):
+    """Shape link hits into the `{intent, relation, results, planner}` body of /process."""
+    return {
+        'intent': 'relationship',
+        'relation': relation.kind,
+        'results': [hit['_source'] for hit in hits],
+        'planner': 'links',
+    }
@@ -3,78 +3,314 @@
 import os
 import json
 import re
+import time
+import asyncio
+import datetime
+import logging
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 import google.generativeai as genai
 from google.api_core import exceptions
+from query_cache import query_cache, normalize_prompt
+from schema_cache import schema_cache
+import tenants
+from prompt_compiler import compile_prompt, build_prefix, fields_section, single_request, batch_request
+from llm_guard import LLMGuard, Throttled
+from tracing import annotate, capture
+import metrics
+
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))
+# Upper bound on concurrent Gemini calls from the async serving mode
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+_llm_semaphore = None
+# Put the static prompt prefix in a Gemini context cache instead of sending it with every call.
+# Gemini only caches prefixes above a minimum size; smaller ones are sent inline as before.
+LLM_CONTEXT_CACHE = os.environ.get("LLM_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+LLM_CONTEXT_CACHE_TTL = int(os.environ.get("LLM_CONTEXT_CACHE_TTL", "3600"))
+_models = {}
+_context_caches = {}
+_model_lock = threading.Lock()
+# Shared by every Gemini call in the process: coalescing, rate limiting, backoff and circuit breaking.
+# Built by get_llm_guard() on first use; its token bucket may create a SQLite file.
+llm_guard = None
 
 class GeminiRateLimitExceeded(Exception):
     pass
 
+class LLMQueryError(RuntimeError):
+    """The LLM gave no usable query; `kind` is the nlp_errors_total label (llm or llm_parse)."""
+
+    def __init__(self, message, kind="llm"):
+        super().__init__(message)
+        self.kind = kind
+
+def record_cache_lookup(cached):
+    result = "miss" if cached is None else "hit"
+    metrics.CACHE_LOOKUPS.inc(cache="query", result=result)
+    annotate(query_cache=result)
+
+def fetch_schema():
+    """Return the current tenant's schema document from its schema-index (cached, version-checked)."""
+    tenant = tenants.current()
+    return (schema_cache if tenant is None else tenant.schema_cache).get()
+
+def current_query_cache():
+    tenant = tenants.current()
+    return query_cache if tenant is None else tenant.query_cache
+
+def guard_key(cache_key):
+    """Key identical in-flight Gemini calls are coalesced on; tenants' schemas differ, so never shared across them."""
+    tenant = tenants.current()
+    return cache_key if tenant is None else f"{tenant.name}:{cache_key}"
+
 def fetch_schema_fields():
     """Fetch schema fields from schema-index in Elasticsearch."""
-    from elasticsearch import Elasticsearch
-    ES_HOST = os.environ.get("ES_HOST", "localhost")
-    ES_PORT = os.environ.get("ES_PORT", "9200")
-    SCHEMA_INDEX = "schema-index"
-    es = Elasticsearch(f"http://{ES_HOST}:{ES_PORT}")
-    try:
-        schema_doc = es.get(index=SCHEMA_INDEX, id="current")['_source']
-        return schema_doc.get('fields', [])
-    except Exception:
-        return []
+    return fetch_schema().get('fields', [])
+
+def prompt_fields(schema, prompt):
+    """Fields to list in the prompt: the catalog's best matches for `prompt`, or every path for an older schema-index."""
+    return compile_prompt(schema).fields_for(prompt)
 
 def build_system_prompt(schema_fields):
-    schema_str = ", ".join(schema_fields) if schema_fields else "id, name, category, value, package.name, package.friendly_name, package.desc, package.version"
-    return (
-        "You are an expert in Elasticsearch. "
-        "Given a user's natural language prompt, generate a minimal Elasticsearch JSON query (no explanations, just the JSON) "
-        f"that would retrieve relevant records from an index with these available fields: {schema_str}. "
-        "If the prompt is about a CVE, search for the value in all likely fields, including: id, original.cve.epss.cve, original.cve.kev.cveID, original.cve.osv.affected.package.name, and any other field that could contain a CVE identifier. "
-        "If the prompt is about a component, search for both root-level fields and nested fields under package.name and package.friendly_name. "
-        "For example, if the user prompt is a component name like 'Log4jScanner', match on package.friendly_name and package.name fields. "
-        "If the prompt is ambiguous, return a match_all query."
-    )
+    return build_prefix() + fields_section(schema_fields)
+
+def as_es_query(parsed):
+    """Accept a full search body, or wrap a bare query clause in {"query": ...}."""
+    if not isinstance(parsed, dict):
+        return None
+    if 'query' in parsed:
+        return parsed
+    if any(k in parsed for k in ["match", "multi_match", "bool", "match_all"]):
+        return {"query": parsed}
+    return None
 
 def parse_llm_response(text):
     """Parse LLM response and extract valid Elasticsearch query dict."""
     match = re.search(r'\{[\s\S]*\}', text)
     if match:
         try:
-            parsed = json.loads(match.group(0))
-            if 'query' in parsed:
-                return parsed
-            if any(k in parsed for k in ["match", "multi_match", "bool", "match_all"]):
-                return {"query": parsed}
+            return as_es_query(json.loads(match.group(0)))
         except Exception:
             pass
     return None
 
-def generate_elasticsearch_query(prompt):
-    import logging
-    logger = logging.getLogger("llm")
+def parse_llm_responses(text, expected):
+    """Parse an answer to a multi-prompt request into `expected` queries (None where invalid).
+
+    Accepts a JSON array of queries or several JSON bodies one after another,
+    with or without surrounding prose or code fences.
+    """
+    decoder = json.JSONDecoder()
+    values = []
+    idx = 0
+    while True:
+        starts = [i for i in (text.find('{', idx), text.find('[', idx)) if i != -1]
+        if not starts:
+            break
+        start = min(starts)
+        try:
+            value, idx = decoder.raw_decode(text, start)
+        except ValueError:
+            idx = start + 1
+            continue
+        if isinstance(value, list):
+            values.extend(value)
+        else:
+            values.append(value)
+    queries = [as_es_query(v) for v in values[:expected]]
+    return queries + [None] * (expected - len(queries))
+
+def lookup_cached_query(prompt):
+    """Return (cache_key, schema, cached_query); cached_query is None on a miss."""
+    schema = fetch_schema()
+    cache_key = normalize_prompt(prompt).key
+    return cache_key, schema, current_query_cache().get(cache_key, schema.get('version'))
+
+def model_settings():
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
-        logger.error("[LLM] No GEMINI_API_KEY found. Cannot generate query.")
+        logging.getLogger("llm").error("[LLM] No GEMINI_API_KEY found. Cannot generate query.")
         raise RuntimeError("No GEMINI_API_KEY found. LLM query generation is required.")
-    genai.configure(api_key=api_key)
-    model_name = os.environ.get('GEMINI_MODEL', 'models/gemini-1.5-pro-latest')
-    logger.info(f"[LLM] Using Gemini model: {model_name}")
-    model = genai.GenerativeModel(model_name)
-    schema_fields = fetch_schema_fields()
-    logger.info(f"[LLM] Loaded schema fields from schema-index: {schema_fields}")
-    system_prompt = build_system_prompt(schema_fields)
-    full_prompt = f"{system_prompt}\nPrompt: {prompt}\nElasticsearch Query:"
+    return api_key, os.environ.get('GEMINI_MODEL', 'models/gemini-1.5-pro-latest')
+
+def get_model():
+    """The process-wide GenerativeModel, configured on first use and rebuilt only if the key or model changes."""
+    settings = model_settings()
+    model = _models.get(settings)
+    if model is None:
+        with _model_lock:
+            model = _models.get(settings)
+            if model is None:
+                genai.configure(api_key=settings[0])
+                logging.getLogger("llm").info(f"[LLM] Using Gemini model: {settings[1]}")
+                model = _models[settings] = genai.GenerativeModel(settings[1])
+    return model
+
+def _context_cache_stale(entry):
+    # Recreated a little before the provider expires it; a refused upload is retried on the same schedule
+    return entry is None or time.monotonic() - entry[1] > LLM_CONTEXT_CACHE_TTL * 0.9
+
+def context_cached_model(prefix):
+    """A model whose context cache holds `prefix`, or None when Gemini will not cache it."""
+    from google.generativeai import caching
+    logger = logging.getLogger("llm")
+    api_key, model_name = model_settings()
+    key = (model_name, prefix)
+    entry = _context_caches.get(key)
+    if _context_cache_stale(entry):
+        with _model_lock:
+            entry = _context_caches.get(key)
+            if _context_cache_stale(entry):
+                genai.configure(api_key=api_key)
+                try:
+                    cached = caching.CachedContent.create(model=model_name, system_instruction=prefix,
+                                                          ttl=datetime.timedelta(seconds=LLM_CONTEXT_CACHE_TTL))
+                    entry = (genai.GenerativeModel.from_cached_content(cached_content=cached), time.monotonic())
+                    logger.info(f"[LLM] Cached the prompt prefix as {cached.name}.")
+                except Exception as e:
+                    # Typically a prefix below the model's minimum cacheable size, but it may be a transient
+                    # error, so it is tried again once the TTL has passed
+                    logger.warning(f"[LLM] Context caching unavailable, sending the prompt prefix inline: {e}")
+                    entry = (None, time.monotonic())
+                _context_caches[key] = entry
+    return entry[0]
+
+def model_and_prompt(compiled, request):
+    """(model, prompt text) for a compiled prompt's per-request part."""
+    if LLM_CONTEXT_CACHE:
+        model = context_cached_model(compiled.prefix)
+        if model is not None:
+            annotate(context_cache=True)
+            return model, request.lstrip("\n")
+    return get_model(), compiled.prefix + request
+
+def single_prompt(schema, prompt):
+    """(model, prompt text) for one prompt; may upload the context cache, so keep it off the event loop."""
+    compiled = compile_prompt(schema)
+    return model_and_prompt(compiled, compiled.request(prompt))
+
+def build_full_prompt(prompt, schema_fields):
+    return build_system_prompt(schema_fields) + single_request(prompt)
+
+def build_batch_prompt(prompts, schema_fields):
+    return build_system_prompt(schema_fields) + batch_request(prompts)
+
+def finish_llm_text(text, cache_key, schema_version):
+    """Parse the model's answer into an ES query and cache it."""
+    import logging
+    logger = logging.getLogger("llm")
+    parsed = parse_llm_response(text.strip())
+    if parsed:
+        current_query_cache().put(cache_key, parsed, schema_version)
+        return parsed
+    logger.error("[LLM] LLM did not return a valid Elasticsearch query.")
+    raise LLMQueryError("LLM did not return a valid Elasticsearch query.", kind="llm_parse")
+
+def generate_elasticsearch_query(prompt):
+    import logging
+    logger = logging.getLogger("llm")
+    cache_key, schema, cached = lookup_cached_query(prompt)
+    record_cache_lookup(cached)
+    if cached is not None:
+        return cached
+    model, full_prompt = single_prompt(schema, prompt)
+    capture("llm_prompt", lambda: full_prompt)
+    try:
+        response = get_llm_guard().call(guard_key(cache_key), lambda: model.generate_content(full_prompt))
+        return finish_llm_text(response.text, cache_key, schema.get('version'))
+    except (exceptions.ResourceExhausted, Throttled) as e:
+        raise GeminiRateLimitExceeded(str(e))
+    except LLMQueryError:
+        raise
+    except Exception as e:
+        logger.error(f"[LLM] LLM query generation failed: {e}")
+        raise LLMQueryError("LLM query generation failed.")
+
+def generate_elasticsearch_queries(prompts):
+    """Generate queries for several prompts with at most one Gemini call.
+
+    Returns a list aligned with `prompts`; an entry is None if the model gave
+    no usable query for that prompt. Cached prompts are not sent to the model.
+    """
+    import logging
+    logger = logging.getLogger("llm")
+    results = [None] * len(prompts)
+    pending = []
+    schema = {}
+    for i, prompt in enumerate(prompts):
+        cache_key, schema, cached = lookup_cached_query(prompt)
+        record_cache_lookup(cached)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, cache_key))
+    if not pending:
+        return results
+    compiled = compile_prompt(schema)
+    model, full_prompt = model_and_prompt(compiled, compiled.batch([prompts[i] for i, _ in pending]))
+    batch_key = "batch:" + "|".join(key for _, key in pending)
+    try:
+        response = get_llm_guard().call(guard_key(batch_key), lambda: model.generate_content(full_prompt))
+    except (exceptions.ResourceExhausted, Throttled) as e:
+        raise GeminiRateLimitExceeded(str(e))
+    except Exception as e:
+        logger.error(f"[LLM] Batch LLM query generation failed: {e}")
+        raise LLMQueryError("LLM query generation failed.")
+    queries = parse_llm_responses(response.text, len(pending))
+    for query in queries:
+        if query is None:
+            metrics.ERRORS.inc(kind="llm_parse")
+    for (i, cache_key), query in zip(pending, queries):
+        if query is not None:
+            current_query_cache().put(cache_key, query, schema.get('version'))
+        results[i] = query
+    annotate(llm_batch=len(pending), llm_batch_parsed=sum(q is not None for q in queries))
+    return results
+
+def get_llm_guard():
+    # Created lazily so importing this module has no filesystem side effects
+    global llm_guard
+    if llm_guard is None:
+        with _model_lock:
+            if llm_guard is None:
+                llm_guard = LLMGuard(retry_on=(exceptions.ResourceExhausted,))
+    return llm_guard
+
+def get_llm_semaphore():
+    # Created lazily so it belongs to the running event loop
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+async def generate_elasticsearch_query_async(prompt, timeout=LLM_TIMEOUT):
+    """Async variant of generate_elasticsearch_query for the ASGI service.
+
+    At most LLM_MAX_CONCURRENCY Gemini calls run at once; each attempt is
+    bounded by `timeout` seconds and is cancelled with the calling task.
+    """
+    import logging
+    logger = logging.getLogger("llm")
+    cache_key, schema, cached = await asyncio.to_thread(lookup_cached_query, prompt)
+    record_cache_lookup(cached)
+    if cached is not None:
+        return cached
+    model, full_prompt = await asyncio.to_thread(single_prompt, schema, prompt)
+    capture("llm_prompt", lambda: full_prompt)
+    async def attempt():
+        async with get_llm_semaphore():
+            return await asyncio.wait_for(model.generate_content_async(full_prompt), timeout)
     try:
-        response = model.generate_content(full_prompt)
-        text = response.text.strip()
-        parsed = parse_llm_response(text)
-        if parsed:
-            return parsed
-        logger.error("[LLM] LLM did not return a valid Elasticsearch query.")
-        raise RuntimeError("LLM did not return a valid Elasticsearch query.")
-    except exceptions.ResourceExhausted as e:
+        response = await get_llm_guard().call_async(guard_key(cache_key), attempt)
+        return finish_llm_text(response.text, cache_key, schema.get('version'))
+    except asyncio.TimeoutError:
+        logger.error(f"[LLM] LLM query generation timed out after {timeout}s.")
+        raise LLMQueryError("LLM query generation timed out.", kind="llm_timeout")
+    except (exceptions.ResourceExhausted, Throttled) as e:
         raise GeminiRateLimitExceeded(str(e))
+    except LLMQueryError:
+        raise
     except Exception as e:
         logger.error(f"[LLM] LLM query generation failed: {e}")
-        raise RuntimeError("LLM query generation failed.")
+        raise LLMQueryError("LLM query generation failed.")
@@ -0,0 +1,256 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+import threading
+
+# Client-side budget for Gemini calls; 0 disables the limiter
+LLM_RATE_LIMIT_PER_MIN = float(os.environ.get("LLM_RATE_LIMIT_PER_MIN", "60"))
+LLM_RATE_LIMIT_BURST = float(os.environ.get("LLM_RATE_LIMIT_BURST", "10"))
+# The bucket lives in SQLite so every worker process on the host draws from the same budget;
+# set to an empty string to keep it in-process.
+LLM_RATE_LIMIT_DB = os.environ.get("LLM_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "nlp_llm_ratelimit.db"))
+# How long a request may wait for a token before it is treated as throttled
+LLM_RATE_LIMIT_WAIT = float(os.environ.get("LLM_RATE_LIMIT_WAIT", "5"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_CAP = float(os.environ.get("LLM_BACKOFF_CAP", "8"))
+LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class Throttled(Exception):
+    """Raised when the call was not attempted because of the limiter or an open breaker."""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min=LLM_RATE_LIMIT_PER_MIN, capacity=LLM_RATE_LIMIT_BURST,
+                 db_path=LLM_RATE_LIMIT_DB, name="gemini"):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity
+        self.db_path = db_path
+        self.name = name
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.time()
+        if self.rate > 0 and self.db_path:
+            with self._connect() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+                conn.execute("INSERT OR IGNORE INTO token_bucket VALUES (?, ?, ?)", (name, capacity, time.time()))
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _refill_and_take(self, tokens, updated, now):
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def try_take(self):
+        """Take a token if one is available; returns seconds to wait otherwise (0 on success)."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.time()
+        if not self.db_path:
+            with self._lock:
+                self._tokens, wait = self._refill_and_take(self._tokens, self._updated, now)
+                self._updated = now
+            return wait
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        try:
+            # IMMEDIATE takes the write lock up front so processes can't race on the same tokens
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, updated = conn.execute(
+                "SELECT tokens, updated FROM token_bucket WHERE name = ?", (self.name,)).fetchone()
+            tokens, wait = self._refill_and_take(tokens, updated, now)
+            conn.execute("UPDATE token_bucket SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return wait
+
+    def acquire(self, timeout=LLM_RATE_LIMIT_WAIT):
+        deadline = time.time() + timeout
+        while True:
+            wait = self.try_take()
+            if wait == 0:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=LLM_RATE_LIMIT_WAIT):
+        deadline = time.time() + timeout
+        while True:
+            wait = await asyncio.to_thread(self.try_take) if self.db_path else self.try_take()
+            if wait == 0:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive throttling failures and stays open for `cooldown` seconds.
+
+    After the cooldown a single probe call is let through; its outcome closes
+    the breaker or opens it for another cooldown.
+    """
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def abort_probe(self):
+        """Let another probe through when the last one ended for reasons unrelated to throttling."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGuard:
+    """Wrap LLM calls with coalescing, a token bucket, backoff and a circuit breaker.
+
+    Concurrent calls with the same key share one underlying call. Exceptions in
+    `retry_on` (the provider's quota errors) are retried with exponential
+    backoff and full jitter and count against the breaker; while the breaker is
+    open calls fail fast with Throttled.
+    """
+
+    def __init__(self, bucket=None, breaker=None, retry_on=(), max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_cap=LLM_BACKOFF_CAP, acquire_timeout=LLM_RATE_LIMIT_WAIT):
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.retry_on = tuple(retry_on)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._call(fn)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def _call(self, fn):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise Throttled("LLM circuit breaker is open")
+            if not self.bucket.acquire(self.acquire_timeout):
+                self.breaker.abort_probe()
+                raise Throttled("LLM client-side rate limit reached")
+            try:
+                result = fn()
+            except self.retry_on:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                time.sleep(self.backoff(attempt))
+                continue
+            except Exception:
+                self.breaker.abort_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, key, coro_fn):
+        """Async counterpart of call(); `coro_fn()` must return a fresh awaitable each time."""
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+        flight = asyncio.ensure_future(self._call_async(coro_fn))
+        self._async_flights[key] = flight
+        flight.add_done_callback(lambda _: self._async_flights.pop(key, None))
+        return await asyncio.shield(flight)
+
+    async def _call_async(self, coro_fn):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise Throttled("LLM circuit breaker is open")
+            if not await self.bucket.acquire_async(self.acquire_timeout):
+                self.breaker.abort_probe()
+                raise Throttled("LLM client-side rate limit reached")
+            try:
+                result = await coro_fn()
+            except self.retry_on:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            except Exception:
+                self.breaker.abort_probe()
+                raise
+            self.breaker.record_success()
+            return result
@@ -0,0 +1,311 @@
+"""Hashed TF-IDF index over the data documents, for answering prompts without Gemini.
+
+populate feeds every document to a LocalIndexBuilder, which hashes the
+tokens of its id, names, versions, purls and descriptions into LOCAL_SEARCH_DIM
+buckets and writes an inverted index (per-bucket postings of document
+ordinals and L2-normalized TF-IDF weights) to LOCAL_INDEX_PATH. Workers
+memory-map that file, so it is shared between processes and costs nothing to
+open; a prompt is scored by walking the postings of its own tokens only,
+which is the cosine similarity between the prompt and every document.
+"""
+import os
+import re
+import json
+import math
+import mmap
+import zlib
+import heapq
+import logging
+import threading
+from array import array
+from itertools import accumulate
+from collections import Counter
+from operator import itemgetter
+from planner import Plan
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Written by populate and re-read by every worker when it changes
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", os.path.join(BASE_DIR, ".local_index.bin"))
+# Hash buckets per index; collisions only blur rarely-used tokens together
+LOCAL_SEARCH_DIM = int(os.environ.get("LOCAL_SEARCH_DIM", str(2 ** 20)))
+# Documents a local plan asks Elasticsearch for, best first
+LOCAL_SEARCH_TOP_K = int(os.environ.get("LOCAL_SEARCH_TOP_K", "10"))
+# Cosine similarity below which a document is not considered an answer
+LOCAL_SEARCH_MIN_SCORE = float(os.environ.get("LOCAL_SEARCH_MIN_SCORE", "0.1"))
+# Buckets with more postings than this are skipped when the prompt has rarer tokens to go on
+LOCAL_MAX_POSTINGS = int(os.environ.get("LOCAL_MAX_POSTINGS", "50000"))
+# Leading characters of each text field that are indexed
+TEXT_MAX_CHARS = 400
+
+MAGIC = b"NLPLOCAL1\n"
+# Tokens from these fields count this many times; ids and names matter more than free text
+FIELD_WEIGHTS = {
+    "id": 3, "package.name": 3, "package.friendly_name": 2, "package.version": 1, "package.purl": 1,
+    "affected_packages.name": 2, "description": 1, "package.desc": 1,
+}
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-_:/@][a-z0-9]+)*")
+PART_RE = re.compile(r"[.\-_:/@]")
+STOP_WORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "can", "do", "does", "find", "for", "from", "give",
+    "get", "has", "have", "i", "in", "is", "it", "its", "list", "me", "of", "on", "or", "please", "show", "that",
+    "the", "this", "to", "was", "what", "which", "with", "all",
+}
+
+logger = logging.getLogger("local_search")
+
+
+def tokens(text):
+    """Lowercase tokens of `text`; compound tokens such as "log4j-core" also yield their parts."""
+    for token in TOKEN_RE.findall(text.lower()):
+        if token not in STOP_WORDS:
+            yield token
+        if not token.isalnum():
+            for part in PART_RE.split(token):
+                if part and part not in STOP_WORDS:
+                    yield part
+
+
+def bucket(token, dim):
+    # crc32 rather than hash(): the index is read by other processes, where str hashes are salted differently
+    return zlib.crc32(token.encode("utf-8")) % dim
+
+
+def field_values(doc, path):
+    values = [doc]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and item.get(key) is not None:
+                    found.append(item[key])
+        values = found
+    return [v for value in values for v in (value if isinstance(value, list) else [value])]
+
+
+def doc_terms(doc, dim):
+    """{bucket: weighted term frequency} for a document."""
+    counts = Counter()
+    for path, weight in FIELD_WEIGHTS.items():
+        for value in field_values(doc, path):
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                for token in tokens(str(value)[:TEXT_MAX_CHARS]):
+                    counts[bucket(token, dim)] += weight
+    return counts
+
+
+def idf(df, docs):
+    return math.log((1 + docs) / (1 + df)) + 1
+
+
+class LocalIndexBuilder:
+    """Collects (bucket, doc, tf) triples in flat arrays as documents stream past, then writes the index."""
+
+    def __init__(self, dim=None):
+        self.dim = dim or LOCAL_SEARCH_DIM
+        self.ids = []
+        self._buckets = array("I")
+        self._docs = array("I")
+        self._tf = array("f")
+
+    def add(self, doc_id, doc):
+        counts = doc_terms(doc, self.dim)
+        if not counts:
+            return
+        ordinal = len(self.ids)
+        self.ids.append(str(doc_id))
+        for b, tf in counts.items():
+            self._buckets.append(b)
+            self._docs.append(ordinal)
+            self._tf.append(tf)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def write(self, path=None):
+        """Write the index to `path` (default LOCAL_INDEX_PATH), replacing any previous one atomically."""
+        path = path or LOCAL_INDEX_PATH
+        publish(self.stage(path), path)
+
+    def stage(self, path=None):
+        """Write the index beside `path` without replacing it; returns the staged file for publish()."""
+        path = path or LOCAL_INDEX_PATH
+        n, dim, total = len(self.ids), self.dim, len(self._buckets)
+        df = array("I", bytes(4 * dim))
+        for b in self._buckets:
+            df[b] += 1
+        offsets = array("I", [0])
+        offsets.extend(accumulate(df))
+        idfs = {}
+        weights = array("f", bytes(4 * total))
+        norms = array("d", bytes(8 * n))
+        for i, (b, d, tf) in enumerate(zip(self._buckets, self._docs, self._tf)):
+            weight = idfs.get(b)
+            if weight is None:
+                weight = idfs[b] = idf(df[b], n)
+            weight *= 1 + math.log(tf)
+            weights[i] = weight
+            norms[d] += weight * weight
+        # Counting sort by bucket; docs stay in ascending order within each bucket
+        position = array("I", offsets)
+        posting_docs = array("I", bytes(4 * total))
+        posting_weights = array("f", bytes(4 * total))
+        for b, d, weight in zip(self._buckets, self._docs, weights):
+            p = position[b]
+            posting_docs[p] = d
+            posting_weights[p] = weight / math.sqrt(norms[d])
+            position[b] = p + 1
+        encoded = [doc_id.encode("utf-8") for doc_id in self.ids]
+        id_offsets = array("I", [0])
+        id_offsets.extend(accumulate(len(e) for e in encoded))
+        header = json.dumps({"dim": dim, "docs": n, "postings": total}).encode("utf-8")
+        header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+            for section in (offsets, posting_docs, posting_weights, id_offsets):
+                section.tofile(f)
+            f.write(b"".join(encoded))
+        print(f"[populate] Local search index: {n} docs, {total} postings staged for {path}.")
+        return tmp_path
+
+
+def publish(staged_path, path=None):
+    """Atomically replace the index at `path` (default LOCAL_INDEX_PATH) with a staged one."""
+    os.replace(staged_path, path or LOCAL_INDEX_PATH)
+
+
+class LocalIndex:
+    """Read-only view of an index file written by LocalIndexBuilder.write()."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a local search index")
+        start = len(MAGIC) + 4
+        size = int.from_bytes(self._mm[len(MAGIC):start], "little")
+        meta = json.loads(self._mm[start:start + size])
+        self.dim, self.docs = meta["dim"], meta["docs"]
+        view = memoryview(self._mm)
+        pos = start + size
+        sections = []
+        for count, fmt in ((self.dim + 1, "I"), (meta["postings"], "I"), (meta["postings"], "f"),
+                           (self.docs + 1, "I")):
+            sections.append(view[pos:pos + 4 * count].cast(fmt))
+            pos += 4 * count
+        self._offsets, self._posting_docs, self._posting_weights, self._id_offsets = sections
+        self._ids = pos
+
+    def doc_id(self, ordinal):
+        start = self._ids + self._id_offsets[ordinal]
+        return self._mm[start:self._ids + self._id_offsets[ordinal + 1]].decode("utf-8")
+
+    def search(self, prompt, k=LOCAL_SEARCH_TOP_K, min_score=LOCAL_SEARCH_MIN_SCORE):
+        """[(doc_id, cosine similarity)] of the best `k` documents for `prompt`."""
+        scores, norm = self._scores(prompt)
+        best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [(self.doc_id(d), score / norm) for d, score in best if score / norm >= min_score]
+
+    def scores(self, prompt, doc_ids):
+        """{doc_id: cosine similarity} for those of `doc_ids` that share a token with `prompt`."""
+        wanted = set(doc_ids)
+        scores, norm = self._scores(prompt)
+        found = {}
+        for d, score in scores.items():
+            doc_id = self.doc_id(d)
+            if doc_id in wanted:
+                found[doc_id] = score / norm
+        return found
+
+    def _scores(self, prompt):
+        """({ordinal: dot product with the prompt}, prompt norm)."""
+        terms = []
+        for b, tf in Counter(bucket(token, self.dim) for token in tokens(prompt)).items():
+            start, end = self._offsets[b], self._offsets[b + 1]
+            if end > start:
+                terms.append((end - start, start, end, tf))
+        if not terms:
+            return {}, 1.0
+        # Rarest tokens first, so the cut-off below only ever drops the common ones
+        terms.sort()
+        scores = {}
+        norm = 0.0
+        for i, (df, start, end, tf) in enumerate(terms):
+            weight = idf(df, self.docs) * (1 + math.log(tf))
+            norm += weight * weight
+            if i and df > LOCAL_MAX_POSTINGS:
+                continue
+            get = scores.get
+            for d, w in zip(self._posting_docs[start:end], self._posting_weights[start:end]):
+                scores[d] = get(d, 0.0) + weight * w
+        return scores, math.sqrt(norm)
+
+
+class IndexFile:
+    """The LocalIndex at `path` (default LOCAL_INDEX_PATH), reopened after populate replaces it."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._current = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The open LocalIndex, or None when there is none."""
+        path = self.path or LOCAL_INDEX_PATH
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+        current = self._current
+        if current is not None and current[0] == key:
+            return current[1]
+        with self._lock:
+            if self._current is None or self._current[0] != key:
+                try:
+                    self._current = (key, LocalIndex(path))
+                except (OSError, ValueError) as e:
+                    logger.error(f"[LOCAL] Could not open {path}: {e}")
+                    return None
+            return self._current[1]
+
+
+default_index = IndexFile()
+
+
+def current_index():
+    """The LocalIndex at LOCAL_INDEX_PATH, or None when there is none."""
+    return default_index.get()
+
+
+def ranked_query(doc_ids):
+    """Query for exactly `doc_ids`, scored so Elasticsearch returns them in the given order."""
+    return {"query": {"bool": {"should": [
+        {"constant_score": {"filter": {"ids": {"values": [doc_id]}}, "boost": float(len(doc_ids) - i)}}
+        for i, doc_id in enumerate(doc_ids)
+    ], "minimum_should_match": 1}}}
+
+
+def rerank(prompt, hits, index_file=None):
+    """`hits` reordered by their local index similarity to `prompt`, Elasticsearch's order breaking ties.
+
+    Returned unchanged when there is no index (`index_file`, default LOCAL_INDEX_PATH).
+    """
+    index = current_index() if index_file is None else index_file.get()
+    if index is None or len(hits) < 2:
+        return hits
+    scores = index.scores(prompt, [hit.get("_id") for hit in hits])
+    if not scores:
+        return hits
+    return sorted(hits, key=lambda hit: -scores.get(hit.get("_id"), 0.0))
+
+
+def plan_local(prompt, k=LOCAL_SEARCH_TOP_K, index_file=None):
+    """A Plan fetching the documents the local index (`index_file`, default LOCAL_INDEX_PATH) ranks highest, or None."""
+    index = current_index() if index_file is None else index_file.get()
+    if index is None:
+        return None
+    ranked = index.search(prompt, k)
+    if not ranked:
+        return None
+    return Plan(ranked_query([doc_id for doc_id, _ in ranked]), "local", "search", round(ranked[0][1], 4))
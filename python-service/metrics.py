@@ -0,0 +1,196 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Hot-path updates never take a lock: every thread writes to its own shard and
+/metrics sums the shards when scraped. When a thread is gone its shard is
+folded into a retired total, so a server that starts a thread per request
+does not accumulate shards. Each worker process keeps its own numbers, so
+scrape every worker (or run one) to see all traffic.
+"""
+import bisect
+import weakref
+import threading
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REGISTRY = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        # id(shard) -> shard of every live thread; single dict operations are atomic under the GIL
+        self._shards = {}
+        # Totals of threads that have finished
+        self._retired = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            self._shards[id(shard)] = shard
+            weakref.finalize(threading.current_thread(), self._retire, shard).atexit = False
+        return shard
+
+    def _retire(self, shard):
+        """Fold a finished thread's shard into the retired totals."""
+        with self._lock:
+            for key, value in shard.items():
+                self._retired[key] = self._merge(self._retired.get(key), value)
+            self._shards.pop(id(shard), None)
+
+    @staticmethod
+    def _merge(total, value):
+        return value if total is None else total + value
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _snapshots(self):
+        with self._lock:
+            # Histogram values are lists that _retire adds into, so those are copied too
+            retired = {key: list(value) if isinstance(value, list) else value for key, value in self._retired.items()}
+            shards = list(self._shards.copy().values())
+        # dict.copy() is atomic under the GIL, so writers never need to pause
+        return [retired] + [shard.copy() for shard in shards]
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = self._key(labels)
+        return sum(shard.get(key, 0) for shard in self._snapshots())
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return [f"{self.name}{self._label_text(key)} {format_value(value)}" for key, value in sorted(totals.items())]
+
+
+class Gauge(Metric):
+    """Last value set, from whichever thread set it most recently."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+    def samples(self):
+        return [f"{self.name}{self._label_text(key)} {format_value(value)}"
+                for key, value in sorted(self._values.copy().items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    @staticmethod
+    def _merge(total, value):
+        if total is None:
+            return list(value)
+        for i, count in enumerate(value):
+            total[i] += count
+        return total
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def count(self, **labels):
+        key = self._key(labels)
+        return sum(sum(shard[key][:-1]) for shard in self._snapshots() if key in shard)
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, counts in shard.items():
+                merged = totals.setdefault(key, [0] * len(counts))
+                for i, value in enumerate(list(counts)):
+                    merged[i] += value
+        lines = []
+        for key, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_value(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render():
+    """The whole registry in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUESTS = Counter("nlp_requests_total", "Requests handled, by endpoint.", ["endpoint"])
+ERRORS = Counter("nlp_errors_total", "Request failures by kind (rate_limit, llm, llm_parse, llm_timeout, es, bad_request, client_disconnected, internal).", ["kind"])
+REQUEST_SECONDS = Histogram("nlp_request_duration_seconds", "Wall time per request.", ["endpoint"])
+STAGE_SECONDS = Histogram("nlp_stage_duration_seconds", "Wall time per pipeline stage (schema, planning, llm, es_search, parse, serialize).", ["stage"])
+ES_TOOK_SECONDS = Histogram("nlp_es_took_seconds", "Search time reported by Elasticsearch (`took`); compare with the es_search stage for client/network overhead.")
+CACHE_LOOKUPS = Counter("nlp_cache_lookups_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"])
+PLANNER = Counter("nlp_planner_total", "Queries by the planner that produced them (rules, llm, fallback).", ["planner"])
+RESPONSE_BYTES = Histogram("nlp_response_bytes", "Response body size.", ["endpoint"], buckets=BYTES_BUCKETS)
+POPULATE_DOCS = Counter("nlp_populate_docs_total", "Documents sent to Elasticsearch by populate.")
+POPULATE_ERRORS = Counter("nlp_populate_errors_total", "Documents Elasticsearch rejected during populate.")
+POPULATE_DOCS_PER_SEC = Gauge("nlp_populate_docs_per_second", "Throughput of the last populate run.")
+POPULATE_SECONDS = Histogram("nlp_populate_duration_seconds", "Duration of the bulk-indexing phase of populate runs.",
+                             buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
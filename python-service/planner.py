@@ -0,0 +1,114 @@
+import os
+import re
+from collections import namedtuple
+from query_cache import normalize_prompt
+from index_mapping import is_exact, is_searchable, nested_path, field_clause
+from links import is_known_package
+
+# Plans below this confidence are handed to the LLM instead.
+PLANNER_MIN_CONFIDENCE = float(os.environ.get("PLANNER_MIN_CONFIDENCE", "0.7"))
+
+SHOW_ALL_PROMPTS = {"show all", "show all documents", "show all es docs", "show all elasticsearch documents"}
+# Keyword fields holding a CVE id; `original.*` is kept in _source only, so its copies are not searchable
+CVE_FIELDS = ["id"]
+# package.name holds "ecosystem:name:version"; names alone are looked up on the derived package.short_name
+COMPONENT_FIELDS = ["package.short_name", "package.friendly_name"]
+# Searched by the non-LLM fallback when Gemini is throttled
+FALLBACK_FIELDS = ["id", "description", "package.name", "package.short_name", "package.friendly_name", "package.desc",
+                   "affected_packages.name"]
+NAME_RE = re.compile(r'^[a-z0-9][\w.\-]*$')
+
+Plan = namedtuple("Plan", ["query", "planner", "intent", "confidence"])
+
+
+def is_show_all(prompt):
+    return (prompt or "").strip().lower() in SHOW_ALL_PROMPTS
+
+
+def _known(fields, schema_fields):
+    # Without a schema we cannot rule anything out, so keep every candidate field.
+    if not schema_fields:
+        return list(fields)
+    known = set(schema_fields)
+    return [f for f in fields if f in known]
+
+
+def match_clause(field, value):
+    """Term lookup on keyword fields, phrase match on analyzed ones."""
+    return field_clause("term" if is_exact(field) else "match_phrase", field, value)
+
+
+def plan_cve(cves, schema_fields):
+    should = [{"ids": {"values": cves}}]
+    for field in _known(CVE_FIELDS, schema_fields):
+        should.append(field_clause("terms", field, cves))
+    return {"query": {"bool": {"should": should, "minimum_should_match": 1}}}
+
+
+def plan_components(components, schema_fields):
+    should = []
+    name_and_version = len(_known(["package.short_name", "package.version"], schema_fields)) == 2
+    for name, version in components:
+        if name_and_version:
+            should.append({"bool": {"filter": [
+                match_clause("package.short_name", name),
+                match_clause("package.version", version),
+            ]}})
+        for field in _known(["package.friendly_name"], schema_fields):
+            should.append(match_clause(field, f"{name}:{version}"))
+    if not should:
+        return None
+    return {"query": {"bool": {"should": should, "minimum_should_match": 1}}}
+
+
+def plan_component_name(name, schema_fields):
+    should = [{"ids": {"values": [name]}}]
+    for field in _known(COMPONENT_FIELDS, schema_fields):
+        should.append(match_clause(field, name))
+    return {"query": {"bool": {"should": should, "minimum_should_match": 1}}}
+
+
+def plan_query(prompt, schema_fields=None, packages=()):
+    """Build an ES query for recognizable prompts without calling the LLM.
+
+    `packages` are the known package names (the schema-index's "packages").
+    Returns a Plan, or None when no rule matches with enough confidence.
+    """
+    plan = None
+    norm = normalize_prompt(prompt)
+    if is_show_all(prompt):
+        plan = Plan({"query": {"match_all": {}}}, "rules", "all", 1.0)
+    elif norm.cves:
+        plan = Plan(plan_cve(norm.cves, schema_fields), "rules", "cve", 0.95)
+    elif norm.components:
+        query = plan_components(norm.components, schema_fields)
+        if query:
+            plan = Plan(query, "rules", "package", 0.9)
+    elif NAME_RE.match(norm.key):
+        # A bare word is only trusted when it names a known package; "help" or "kev" are left to the LLM.
+        known = schema_fields and _known(COMPONENT_FIELDS, schema_fields) and is_known_package(norm.key, packages)
+        confidence = 0.75 if known else 0.5
+        plan = Plan(plan_component_name(norm.key, schema_fields), "rules", "package", confidence)
+    if plan is None or plan.confidence < PLANNER_MIN_CONFIDENCE:
+        return None
+    return plan
+
+
+def fallback_query(prompt, schema_fields=None):
+    """Plain full-text search used instead of the LLM while it is throttled."""
+    fields = _known(FALLBACK_FIELDS, schema_fields) or FALLBACK_FIELDS
+    text = normalize_prompt(prompt).key
+    if not text:
+        return {"query": {"match_all": {}}}
+    # multi_match cannot reach into nested objects, so each nested path gets its own clause
+    groups = {}
+    for field in fields:
+        if is_searchable(field):
+            groups.setdefault(nested_path(field), []).append(field)
+    should = []
+    for path, group in groups.items():
+        clause = {"multi_match": {"query": text, "fields": group, "lenient": True}}
+        should.append({"nested": {"path": path, "query": clause}} if path else clause)
+    if len(should) == 1:
+        return {"query": should[0]}
+    return {"query": {"bool": {"should": should, "minimum_should_match": 1}}}
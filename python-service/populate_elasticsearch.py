@@ -1,14 +1,34 @@
 
 import json
 import os
+import sys
 import time
-from elasticsearch import Elasticsearch
+import hashlib
+import argparse
+from collections import namedtuple
+from datetime import datetime, timezone
+import es_client
+import query_cache
+import schema_cache
+import result_cache
+import local_search
+import tenants
+import metrics
+from bulk_indexer import BulkIndexer, read_components, iter_json_lines
+from schema_catalog import FieldCatalog, merge_entries
+from index_mapping import index_body, link_index_body, bulk_load_done_settings
+from links import LinkBuilder, LINK_INDEX, purl_key
 
 
 ES_HOST = os.environ.get("ES_HOST", "localhost")
 ES_PORT = os.environ.get("ES_PORT", "9200")
 INDEX_NAME = os.environ.get("ES_INDEX", "nlp_index")
 SCHEMA_INDEX = "schema-index"
+# INDEX_NAME and SCHEMA_INDEX are read aliases; each populate builds fresh "<alias>-<timestamp>" indices
+KEEP_GENERATIONS = int(os.environ.get("POPULATE_KEEP_GENERATIONS", "2"))
+POPULATE_MAX_ERRORS = int(os.environ.get("POPULATE_MAX_ERRORS", "0"))
+# The catalog is only ever read back whole, so it is stored but not indexed
+SCHEMA_INDEX_BODY = {"mappings": {"properties": {"catalog": {"type": "object", "enabled": False}}}}
 def extract_field_paths(doc, prefix=""):
     """Recursively extract all unique field paths from a document."""
     paths = set()
@@ -27,18 +47,40 @@ def update_schema_index(es, index_name, docs):
     all_paths = set()
     for doc in docs:
         all_paths.update(extract_field_paths(doc))
+    write_schema_index(es, all_paths, len(docs))
+
+def write_schema_index(es, all_paths, doc_count, index_name=SCHEMA_INDEX, catalog=None, queries=query_cache,
+                       packages=None):
+    """Overwrite the schema-index document with an already collected set of field paths.
+
+    `catalog` is the list of schema_catalog.FieldCatalog entries (type,
+    cardinality, doc types, samples and score per field) the prompt builder
+    picks fields from. `packages` is the sorted list of component package
+    names (LinkBuilder.package_names()). `queries` is the query cache to invalidate.
+    """
     schema_doc = {
         "fields": sorted(list(all_paths)),
-        "doc_count": len(docs)
+        "doc_count": doc_count,
+        # Bumped on every write so cached LLM queries built on an older schema are discarded
+        "version": str(time.time_ns()),
+        # Bumped whenever any document changes, so cached /process results are discarded
+        "data_version": str(time.time_ns()),
     }
+    if catalog is not None:
+        schema_doc["catalog"] = catalog
+    if packages is not None:
+        schema_doc["packages"] = packages
     # Use a fixed id so we always overwrite
-    es.index(index=SCHEMA_INDEX, id="current", body=schema_doc)
+    es.index(index=index_name, id="current", body=schema_doc)
+    queries.invalidate()
     print(f"[populate] Updated schema-index with {len(all_paths)} fields.")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 LOG4_PATH = os.path.join(DATA_DIR, "log4.json")
 CVE_PATH = os.path.join(DATA_DIR, "cve.json")
+# Content hashes of the last load, used by incremental populate to send only what changed
+MANIFEST_PATH = os.environ.get("POPULATE_MANIFEST", os.path.join(BASE_DIR, ".populate_manifest.json"))
 
 def load_json(path):
     with open(path, "r") as f:
@@ -73,7 +115,7 @@ def transform_cve(doc):
     return flat
 
 def get_es_client():
-    return Elasticsearch(f"http://{ES_HOST}:{ES_PORT}")
+    return es_client.get_es_client(ES_HOST, ES_PORT)
 
 def wait_for_es(es, timeout=180, interval=2):
     """Wait for Elasticsearch to be available before proceeding."""
@@ -92,43 +134,386 @@ def wait_for_es(es, timeout=180, interval=2):
 def reset_index(es, index_name):
     if es.indices.exists(index=index_name):
         es.indices.delete(index=index_name)
-    es.indices.create(index=index_name, ignore=400)
+    es.indices.create(index=index_name, body=index_body(bulk_load=False), ignore=400)
 
 def index_document(es, index_name, doc):
     es.index(index=index_name, id=doc["id"], body=doc)
 
-def process_and_index_file(es, path, transform_func, collected_docs=None):
-    doc = load_json(path)
-    # Special handling for log4.json: index each component as a separate doc
-    if path.endswith("log4.json") and isinstance(doc, dict) and "components" in doc:
-        for comp in doc["components"]:
-            comp["type"] = "component"
-            # Use sbom_id or package.name+version as id if available
-            doc_id = comp.get("sbom_id") or comp.get("package", {}).get("name") or None
-            if not doc_id:
-                doc_id = str(hash(json.dumps(comp)))
-            es.index(index=INDEX_NAME, id=doc_id, body=comp)
-            if collected_docs is not None:
-                collected_docs.append(comp)
-    else:
+def set_refresh_interval(es, index_name, interval):
+    """Set the index refresh_interval; "-1" disables refreshes, None restores the default."""
+    es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": interval}})
+
+def package_short_name(package):
+    """Bare lowercase name of a component's package, from its purl or its "ecosystem:name:version" name."""
+    name = purl_key(package.get("purl"))[1]
+    if name:
+        return name
+    raw = package.get("name")
+    if not isinstance(raw, str) or not raw:
+        return None
+    parts = raw.split(":")
+    return (parts[-2] if len(parts) >= 3 else parts[0]).lower()
+
+def add_short_name(comp):
+    package = comp.get("package")
+    if isinstance(package, dict) and "short_name" not in package:
+        short_name = package_short_name(package)
+        if short_name:
+            package["short_name"] = short_name
+    return comp
+
+def component_doc_id(comp):
+    # Use sbom_id or package.name as id if available
+    doc_id = comp.get("sbom_id") or comp.get("package", {}).get("name") or None
+    if not doc_id:
+        # Must be stable across runs so incremental loads can match the doc again
+        doc_id = content_hash(comp)
+    return doc_id
+
+def content_hash(doc):
+    return hashlib.sha1(json.dumps(doc, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def iter_documents(path, transform_func):
+    """Yield (doc_id, doc) pairs for a data file without holding the whole file in memory.
+
+    JSON-lines files (.jsonl/.ndjson) are treated as one record per line; files
+    with a top-level `components` array (SBOMs like log4.json) yield each
+    component; anything else is a single document.
+    """
+    if path.endswith((".jsonl", ".ndjson")):
+        for record in iter_json_lines(path):
+            doc = transform_func(record)
+            yield doc["id"], doc
+        return
+    components, doc = read_components(path)
+    if components is None:
         doc = transform_func(doc)
-        index_document(es, INDEX_NAME, doc)
+        yield doc["id"], doc
+        return
+    for comp in components:
+        comp["type"] = "component"
+        add_short_name(comp)
+        yield component_doc_id(comp), comp
+
+def process_and_index_file(es, path, transform_func, collected_docs=None, indexer=None, field_paths=None,
+                           hashes=None, previous_hashes=None, catalog=None, links=None, local_index=None):
+    """Stream a data file into the index through a BulkIndexer; returns the number of docs read.
+
+    Pass `field_paths` (a set) to accumulate schema field paths, or `catalog`
+    (a FieldCatalog) to gather per-field statistics, without keeping the docs;
+    `collected_docs` still collects the docs themselves. `hashes`
+    (a dict) records each doc's content hash, and docs whose hash matches
+    `previous_hashes` are skipped entirely. `links` (a links.LinkBuilder) and
+    `local_index` (a local_search.LocalIndexBuilder) see every doc, changed or
+    not, since links join and TF-IDF weights are computed across the whole feed.
+    """
+    owns_indexer = indexer is None
+    if owns_indexer:
+        indexer = BulkIndexer(es, INDEX_NAME)
+    count = 0
+    for doc_id, doc in iter_documents(path, transform_func):
+        count += 1
+        if links is not None:
+            links.add(doc_id, doc)
+        if local_index is not None:
+            local_index.add(doc_id, doc)
+        if hashes is not None or previous_hashes is not None:
+            digest = content_hash(doc)
+            if hashes is not None:
+                hashes[doc_id] = digest
+            if previous_hashes is not None and previous_hashes.get(doc_id) == digest:
+                continue
+        indexer.add(doc_id, doc)
+        if field_paths is not None:
+            field_paths.update(extract_field_paths(doc))
+        if catalog is not None:
+            catalog.add(doc)
         if collected_docs is not None:
             collected_docs.append(doc)
+    if owns_indexer:
+        report_bulk_stats(indexer.close())
+    return count
+
+def write_links(es, builder, index_name, previous=None):
+    """Index the links a LinkBuilder joined into `index_name`; returns {link_id: content hash}.
+
+    With `previous` (the hashes from the manifest) only new or changed links
+    are sent and links that no longer exist are deleted.
+    """
+    hashes = {}
+    indexer = BulkIndexer(es, index_name)
+    try:
+        for link_id, link in builder.links():
+            digest = content_hash(link)
+            hashes[link_id] = digest
+            if previous is None or previous.get(link_id) != digest:
+                indexer.add(link_id, link)
+        for link_id in previous or ():
+            if link_id not in hashes:
+                indexer.delete(link_id)
+    finally:
+        stats = indexer.close()
+    if stats["errors"] > POPULATE_MAX_ERRORS:
+        raise RuntimeError(f"{index_name}: {stats['errors']} links failed to index.")
+    print(f"[populate] {len(hashes)} CVE-component links in {index_name}.")
+    return hashes
+
+def report_bulk_stats(stats):
+    metrics.POPULATE_DOCS.inc(stats['docs'])
+    metrics.POPULATE_ERRORS.inc(stats['errors'])
+    metrics.POPULATE_DOCS_PER_SEC.set(stats['docs_per_sec'])
+    metrics.POPULATE_SECONDS.observe(stats['seconds'])
+    print(
+        f"[populate] Indexed {stats['docs']} docs in {stats['seconds']}s "
+        f"({stats['docs_per_sec']} docs/sec, {stats['errors']} errors, peak RSS {stats['peak_rss_mb']} MB)"
+    )
+
+def generation_name(alias, stamp):
+    return f"{alias}-{stamp}"
 
-def populate():
-    es = get_es_client()
+def list_generations(es, alias):
+    """Return the timestamped generations of an alias, oldest first."""
+    prefix = f"{alias}-"
+    names = es.indices.get(index=f"{prefix}*", ignore_unavailable=True, allow_no_indices=True)
+    return sorted(n for n in names if n[len(prefix):].isdigit())
+
+def alias_targets(es, alias):
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias).keys())
+
+def swap_aliases(es, targets):
+    """Atomically point each alias in `targets` ({alias: new_index}) at its new index.
+
+    A concrete index left over from before aliases were used is removed in the
+    same request, so readers never see the name disappear.
+    """
+    actions = []
+    for alias, new_index in targets.items():
+        current = alias_targets(es, alias)
+        if not current and es.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+        for old_index in current:
+            actions.append({"remove": {"index": old_index, "alias": alias}})
+        actions.append({"add": {"index": new_index, "alias": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+
+def prune_generations(es, alias, keep=KEEP_GENERATIONS):
+    """Delete all but the newest `keep` generations, never touching the live one."""
+    live = set(alias_targets(es, alias))
+    generations = list_generations(es, alias)
+    stale = [g for g in generations[:-keep] if g not in live] if keep > 0 else [g for g in generations if g not in live]
+    for name in stale:
+        es.indices.delete(index=name, ignore_unavailable=True)
+        print(f"[populate] Pruned old generation {name}.")
+
+def validate_generation(es, index_name, stats, expected=None):
+    """Refuse to publish a generation that lost documents or came out empty.
+
+    `expected` is the number of distinct doc ids sent (stats["docs"] when
+    None); at most POPULATE_MAX_ERRORS of them may be missing from the index.
+    """
+    count = es.count(index=index_name)["count"]
+    expected = stats["docs"] if expected is None else expected
+    if stats["errors"] > POPULATE_MAX_ERRORS:
+        raise RuntimeError(f"{index_name}: {stats['errors']} documents failed to index.")
+    if count == 0:
+        raise RuntimeError(f"{index_name}: no documents were indexed.")
+    if expected - count > POPULATE_MAX_ERRORS:
+        raise RuntimeError(f"{index_name}: only {count} of {expected} documents are searchable.")
+    print(f"[populate] Validated {index_name}: {count} docs searchable ({stats['docs']} indexed).")
+    return count
+
+def no_progress(phase, **stats):
+    pass
+
+# Where one load reads and writes; the caches are modules or cache objects, both with invalidate()
+Layout = namedtuple("Layout", ["data_alias", "schema_alias", "link_alias", "log4_path", "cve_path", "manifest_path",
+                               "local_index_path", "query_cache", "schema_cache", "result_cache"])
+
+def layout(tenant=None):
+    """Layout of a tenants.Tenant's load; the single-tenant indices, files and caches for None."""
+    if tenant is None:
+        return Layout(INDEX_NAME, SCHEMA_INDEX, LINK_INDEX, LOG4_PATH, CVE_PATH, MANIFEST_PATH,
+                      local_search.LOCAL_INDEX_PATH, query_cache, schema_cache, result_cache)
+    return Layout(tenant.data_index, tenant.schema_index, tenant.link_index, tenant.log4_path, tenant.cve_path,
+                  tenant.path(MANIFEST_PATH), tenant.local_index_path, tenant.query_cache, tenant.schema_cache,
+                  tenant.result_cache)
+
+def populate(incremental=False, es=None, progress=no_progress, tenant=None):
+    """Load the data files; returns the bulk stats of the run.
+
+    `progress(phase, **stats)` is called as the load moves through its phases
+    and after every bulk response, so a caller can report on a background run.
+    `tenant` (a tenants.Tenant) loads that tenant's data directory into its
+    own indices instead.
+    """
+    if es is None:
+        es = get_es_client()
+    where = layout(tenant)
+    progress("waiting_for_es")
     wait_for_es(es)
-    reset_index(es, INDEX_NAME)
-    # Also reset schema-index
-    if es.indices.exists(index=SCHEMA_INDEX):
-        es.indices.delete(index=SCHEMA_INDEX)
-    es.indices.create(index=SCHEMA_INDEX, ignore=400)
-    # Collect all docs for schema extraction
-    all_docs = []
-    process_and_index_file(es, LOG4_PATH, transform_log4, collected_docs=all_docs)
-    process_and_index_file(es, CVE_PATH, transform_cve, collected_docs=all_docs)
-    update_schema_index(es, INDEX_NAME, all_docs)
+    if incremental:
+        manifest = load_manifest(where.manifest_path)
+        if manifest and manifest.get("index") in alias_targets(es, where.data_alias):
+            return populate_incremental(es, manifest, progress, where)
+        print("[populate] No manifest for the live generation; doing a full load.")
+    return populate_full(es, progress, where)
+
+def populate_full(es, progress=no_progress, where=None):
+    where = where or layout()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
+    data_index = generation_name(where.data_alias, stamp)
+    schema_index = generation_name(where.schema_alias, stamp)
+    link_index = generation_name(where.link_alias, stamp)
+    # Created without refreshes or replicas, which only slow a bulk load down; both are restored afterwards
+    es.indices.create(index=data_index, body=index_body())
+    es.indices.create(index=schema_index, body=SCHEMA_INDEX_BODY)
+    es.indices.create(index=link_index, body=link_index_body())
+    try:
+        progress("indexing")
+        indexer = BulkIndexer(es, data_index, on_progress=lambda stats: progress("indexing", **stats))
+        # Build the field catalog as docs stream past instead of keeping every doc for schema extraction
+        catalog = FieldCatalog()
+        links = LinkBuilder()
+        local_index = local_search.LocalIndexBuilder()
+        hashes = {}
+        doc_count = 0
+        try:
+            doc_count += process_and_index_file(es, where.log4_path, transform_log4, indexer=indexer, hashes=hashes,
+                                                catalog=catalog, links=links, local_index=local_index)
+            doc_count += process_and_index_file(es, where.cve_path, transform_cve, indexer=indexer, hashes=hashes,
+                                                catalog=catalog, links=links, local_index=local_index)
+        finally:
+            stats = indexer.close()
+        es.indices.put_settings(index=data_index, body=bulk_load_done_settings())
+        es.indices.refresh(index=data_index)
+        report_bulk_stats(stats)
+        progress("validating", **stats)
+        validate_generation(es, data_index, stats, expected=len(hashes))
+        write_schema_index(es, catalog.paths(), doc_count, index_name=schema_index, catalog=catalog.entries(),
+                           queries=where.query_cache, packages=links.package_names())
+        es.indices.refresh(index=schema_index)
+        progress("linking", **stats)
+        link_hashes = write_links(es, links, link_index)
+        es.indices.refresh(index=link_index)
+        # Written before the swap so a failure here leaves everything on the previous generation;
+        # only the rename is left for afterwards
+        staged_local_index = local_index.stage(where.local_index_path)
+    except Exception:
+        # Leave the live aliases on the previous generation
+        es.indices.delete(index=[data_index, schema_index, link_index], ignore_unavailable=True)
+        raise
+    progress("swapping_aliases", **stats)
+    swap_aliases(es, {where.data_alias: data_index, where.schema_alias: schema_index, where.link_alias: link_index})
+    local_search.publish(staged_local_index, where.local_index_path)
+    where.schema_cache.invalidate()
+    where.result_cache.invalidate()
+    print(f"[populate] Aliases {where.data_alias} -> {data_index}, {where.schema_alias} -> {schema_index}, "
+          f"{where.link_alias} -> {link_index}.")
+    prune_generations(es, where.data_alias)
+    prune_generations(es, where.schema_alias)
+    prune_generations(es, where.link_alias)
+    save_manifest({"index": data_index, "docs": hashes, "links": link_hashes}, where.manifest_path)
+    return stats
+
+def populate_incremental(es, manifest, progress=no_progress, where=None):
+    """Send only creates/updates/deletes relative to the manifest into the live generation.
+
+    Field paths of changed docs are merged into the existing schema-index
+    document; paths only used by deleted docs are kept until the next full load.
+    """
+    where = where or layout()
+    data_index = manifest["index"]
+    previous = manifest["docs"]
+    hashes = {}
+    changed = FieldCatalog()
+    links = LinkBuilder()
+    local_index = local_search.LocalIndexBuilder()
+    progress("indexing")
+    indexer = BulkIndexer(es, data_index, on_progress=lambda stats: progress("indexing", **stats))
+    try:
+        doc_count = process_and_index_file(es, where.log4_path, transform_log4, indexer=indexer, catalog=changed,
+                                           hashes=hashes, previous_hashes=previous, links=links,
+                                           local_index=local_index)
+        doc_count += process_and_index_file(es, where.cve_path, transform_cve, indexer=indexer, catalog=changed,
+                                            hashes=hashes, previous_hashes=previous, links=links,
+                                            local_index=local_index)
+        deleted = [doc_id for doc_id in previous if doc_id not in hashes]
+        for doc_id in deleted:
+            indexer.delete(doc_id)
+    finally:
+        stats = indexer.close()
+    created = sum(1 for doc_id in hashes if doc_id not in previous)
+    updated = sum(1 for doc_id, digest in hashes.items() if doc_id in previous and previous[doc_id] != digest)
+    report_bulk_stats(stats)
+    print(f"[populate] Incremental load: {created} created, {updated} updated, {len(deleted)} deleted, "
+          f"{doc_count - created - updated} unchanged.")
+    if stats["errors"] > POPULATE_MAX_ERRORS:
+        # Keep the old manifest so the failed docs are retried on the next run
+        raise RuntimeError(f"{data_index}: {stats['errors']} documents failed to index.")
+    es.indices.refresh(index=data_index)
+    progress("linking", **stats)
+    link_hashes = manifest.get("links", {})
+    link_targets = alias_targets(es, where.link_alias)
+    if link_targets:
+        link_hashes = write_links(es, links, link_targets[0], previous=link_hashes)
+        es.indices.refresh(index=link_targets[0])
+    else:
+        print(f"[populate] No {where.link_alias} alias yet; run a full load to build CVE-component links.")
+    # The schema-index is updated last: a new data_version is what tells other workers to drop cached results
+    progress("updating_schema", **stats)
+    try:
+        current = es.get(index=where.schema_alias, id="current")["_source"]
+    except Exception:
+        current = {}
+    known_paths = set(current.get("fields", []))
+    changed_paths = changed.paths()
+    data_changed = created or updated or deleted or link_hashes != manifest.get("links", {})
+    if data_changed or not os.path.exists(where.local_index_path):
+        local_index.write(where.local_index_path)
+    packages = links.package_names()
+    # Workers only refetch the whole document on a new version, so new package names need one too
+    if not changed_paths <= known_paths or packages != current.get("packages"):
+        write_schema_index(es, known_paths | changed_paths, doc_count, index_name=where.schema_alias,
+                           catalog=merge_entries(current.get("catalog", []), changed.entries()),
+                           queries=where.query_cache, packages=packages)
+        where.schema_cache.invalidate()
+    elif data_changed or current.get("doc_count") != doc_count:
+        # Same fields: keep the schema version so cached queries stay valid
+        es.update(index=where.schema_alias, id="current",
+                  body={"doc": {"doc_count": doc_count, "data_version": str(time.time_ns())}})
+    if data_changed:
+        where.result_cache.invalidate()
+    save_manifest({"index": data_index, "docs": hashes, "links": link_hashes}, where.manifest_path)
+    stats.update({"created": created, "updated": updated, "deleted": len(deleted)})
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the data files into Elasticsearch.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only send documents that changed since the last load")
+    parser.add_argument("--tenant", default=None,
+                        help=f"load {tenants.TENANT_DATA_DIR}/<tenant>/ into that tenant's indices")
+    args = parser.parse_args(argv)
+    try:
+        tenant = tenants.resolve(args.tenant)
+    except tenants.UnknownTenant as e:
+        parser.error(str(e))
+    populate(incremental=args.incremental, tenant=tenant)
 
 if __name__ == "__main__":
-    populate()
+    main(sys.argv[1:])
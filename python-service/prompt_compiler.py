@@ -0,0 +1,143 @@
+"""Gemini prompts, compiled once per schema version and kept within a token budget.
+
+A prompt is a static prefix (instructions and few-shot examples, identical for
+every request so providers can cache it), the fields chosen for the prompt,
+and the request itself. compile_prompt() does the per-schema work once: it
+filters the catalog down to searchable leaf fields and renders and sizes each
+field description, so a request only ranks fields and joins strings.
+"""
+import os
+import json
+import math
+import threading
+from collections import OrderedDict
+from schema_catalog import select_fields, describe_field, TYPE_WEIGHTS, PROMPT_MAX_FIELDS
+from index_mapping import EXACT_FIELDS, NESTED_PATHS, is_exact, is_searchable
+
+# Rough upper bound on the tokens of one Gemini prompt, request text included
+LLM_PROMPT_TOKEN_BUDGET = int(os.environ.get("LLM_PROMPT_TOKEN_BUDGET", "1500"))
+# Heuristic for English and JSON; close enough for budgeting without a tokenizer round trip
+CHARS_PER_TOKEN = 4
+# Compiled prompts kept in memory, one per schema version in use (a version per tenant)
+PROMPT_COMPILED_KEEP = int(os.environ.get("PROMPT_COMPILED_KEEP", "64"))
+DEFAULT_FIELDS = ["id", "name", "category", "value", "package.name", "package.short_name", "package.friendly_name",
+                  "package.desc", "package.version"]
+
+RULES = (
+    "You are an expert in Elasticsearch. "
+    "Given a user's natural language prompt, generate a minimal Elasticsearch JSON query (no explanations, just the JSON) "
+    "that would retrieve relevant records from an index with the available fields listed below. "
+    f"These fields are exact-match keywords (case-insensitive); query them with term or terms, not match: {', '.join(sorted(EXACT_FIELDS))}. "
+    f"These fields are nested objects and must be queried inside a nested query with that path: {', '.join(sorted(NESTED_PATHS))}. "
+    "If the prompt is about a CVE, use a terms query on id with the CVE identifier. "
+    "If the prompt is about a component, search package.short_name (the bare name; package.name is ecosystem:name:version) "
+    "and package.version with term queries and package.friendly_name with match_phrase. "
+    "If the prompt is ambiguous, return a match_all query."
+)
+# Few-shot examples, most useful first; the last ones are dropped when the budget is tight
+EXAMPLES = [
+    ("show me CVE-2021-44228", {"query": {"terms": {"id": ["CVE-2021-44228"]}}}),
+    ("Log4jScanner", {"query": {"bool": {"should": [
+        {"term": {"package.short_name": "log4jscanner"}},
+        {"match_phrase": {"package.friendly_name": "Log4jScanner"}},
+    ], "minimum_should_match": 1}}}),
+]
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def build_prefix(budget=LLM_PROMPT_TOKEN_BUDGET):
+    """Rules plus as many examples as fit in half the budget."""
+    prefix = RULES
+    for prompt, query in EXAMPLES:
+        example = f'\nExample: "{prompt}" -> {json.dumps(query)}'
+        if estimate_tokens(prefix + example) > budget // 2:
+            break
+        prefix += example
+    return prefix
+
+
+def fields_section(fields):
+    return "\nAvailable fields: " + (", ".join(fields) if fields else ", ".join(DEFAULT_FIELDS)) + "."
+
+
+def single_request(prompt):
+    return f"\nPrompt: {prompt}\nElasticsearch Query:"
+
+
+def batch_request(prompts):
+    numbered = "\n".join(f"{i}. {p}" for i, p in enumerate(prompts, 1))
+    return (
+        f"\nAnswer the {len(prompts)} numbered prompts below with a JSON array of exactly {len(prompts)} "
+        "Elasticsearch queries, one per prompt, in the same order.\n"
+        f"Prompts:\n{numbered}\nElasticsearch Queries:"
+    )
+
+
+class CompiledPrompt:
+    """Everything about the prompt that depends only on the schema-index document."""
+
+    def __init__(self, schema, budget=LLM_PROMPT_TOKEN_BUDGET):
+        self.version = schema.get('version')
+        self.budget = budget
+        self.prefix = build_prefix(budget)
+        self._prefix_tokens = estimate_tokens(self.prefix)
+        catalog = schema.get('catalog')
+        if catalog:
+            self.entries = [e for e in catalog if e['type'] in TYPE_WEIGHTS and is_searchable(e['path'])]
+            self.descriptions = {e['path']: describe_field({**e, 'type': 'keyword'} if is_exact(e['path']) else e)
+                                 for e in self.entries}
+        else:
+            # An older schema-index without a catalog: every searchable path, in stored order
+            self.entries = None
+            self.fields = [f for f in schema.get('fields', []) if is_searchable(f)]
+
+    def fields_for(self, prompt, reserved=0):
+        """Field descriptions for `prompt`, best first, within what is left of the budget after `reserved` tokens."""
+        if self.entries is not None:
+            candidates = [self.descriptions[e['path']] for e in select_fields(self.entries, prompt, PROMPT_MAX_FIELDS)]
+        else:
+            candidates = self.fields
+        room = self.budget - self._prefix_tokens - reserved - estimate_tokens(fields_section(["."]))
+        chosen = []
+        for text in candidates:
+            cost = estimate_tokens(text) + 1
+            if cost > room and chosen:
+                break
+            chosen.append(text)
+            room -= cost
+        return chosen
+
+    def request(self, prompt):
+        """Per-request part of a single-prompt call: its fields and the prompt."""
+        tail = single_request(prompt)
+        return fields_section(self.fields_for(prompt, estimate_tokens(tail))) + tail
+
+    def batch(self, prompts):
+        tail = batch_request(prompts)
+        return fields_section(self.fields_for(" ".join(prompts), estimate_tokens(tail))) + tail
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compile_prompt(schema):
+    """CompiledPrompt for this schema document, reused while its version is among the PROMPT_COMPILED_KEEP latest."""
+    version = schema.get('version')
+    if version is None:
+        return CompiledPrompt(schema, LLM_PROMPT_TOKEN_BUDGET)
+    key = (version, LLM_PROMPT_TOKEN_BUDGET)
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+    compiled = CompiledPrompt(schema, LLM_PROMPT_TOKEN_BUDGET)
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > PROMPT_COMPILED_KEEP:
+            _compiled.popitem(last=False)
+    return compiled
@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from collections import OrderedDict, namedtuple
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+# Optional on-disk tier shared by every worker process on the host; empty disables it.
+QUERY_CACHE_DB = os.environ.get("QUERY_CACHE_DB", "")
+
+CVE_RE = re.compile(r'\bcve-\d{4}-\d{4,}\b', re.IGNORECASE)
+# name:version tokens such as log4jscanner:1.0.0 or log4j-core:2.14.1
+COMPONENT_RE = re.compile(r'\b([a-z0-9][\w.\-]*):(\d[\w.\-]*)\b', re.IGNORECASE)
+FILLER_RE = re.compile(r'^(?:please\s+)?(?:show\s+me|show|find|get|give\s+me|search\s+for|look\s+up|lookup)\s+')
+
+NormalizedPrompt = namedtuple("NormalizedPrompt", ["key", "text", "cves", "components"])
+
+
+def normalize_prompt(prompt):
+    """Reduce a prompt to a canonical cache key plus the entities it mentions."""
+    text = " ".join((prompt or "").split()).lower()
+    text = text.rstrip(" ?.!")
+    cves = sorted({m.upper() for m in CVE_RE.findall(text)})
+    components = sorted({(name, version) for name, version in COMPONENT_RE.findall(text)})
+    key = FILLER_RE.sub("", text)
+    key = CVE_RE.sub(lambda m: m.group(0).upper(), key)
+    return NormalizedPrompt(key=key, text=text, cves=cves, components=components)
+
+
+class QueryCache:
+    """LRU + TTL cache of generated ES queries, with an optional SQLite tier.
+
+    Entries remember the schema version they were generated against; a lookup
+    with a different version is treated as a miss and the entry is dropped.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, db_path=QUERY_CACHE_DB):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_cache ("
+                    "key TEXT PRIMARY KEY, schema_version TEXT, query TEXT, expires REAL)"
+                )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection for one transaction (committed, or rolled back on error), closed afterwards."""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, schema_version=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                query, version, expires = entry
+                if expires > now and version == schema_version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return query
+                del self._entries[key]
+        query = self._disk_get(key, schema_version, now)
+        with self._lock:
+            if query is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, query, schema_version, now + self.ttl)
+        return query
+
+    def put(self, key, query, schema_version=None):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, query, schema_version, expires)
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, schema_version, query, expires) VALUES (?, ?, ?, ?)",
+                    (key, str(schema_version), json.dumps(query), expires),
+                )
+
+    def _store(self, key, query, schema_version, expires):
+        self._entries[key] = (query, schema_version, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, schema_version, now):
+        if not self.db_path:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT query FROM query_cache WHERE key = ? AND schema_version = ? AND expires > ?",
+                (key, str(schema_version), now),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def invalidate(self):
+        """Drop every cached query, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM query_cache")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+query_cache = QueryCache()
+
+
+def invalidate():
+    query_cache.invalidate()
@@ -0,0 +1,99 @@
+import os
+import json
+import threading
+import json_codec
+from collections import OrderedDict
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+# Upper bound on the serialized payloads held in memory; 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def canonical_key(search, **options):
+    """Stable key for a search body plus whatever else shapes the response (size, projection, ...)."""
+    return json.dumps({"search": search, **options}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def generation_of(schema):
+    """Data generation named by the schema-index document, or None when it has none (nothing is cached then)."""
+    if not schema.get('data_version'):
+        return None
+    return f"{schema.get('version')}:{schema.get('data_version')}"
+
+
+class ResultCache:
+    """LRU of templated /process payloads, keyed on the canonical search and valid for one data generation.
+
+    Entries hold the `{intent, results}` payload and its JSON bytes, so a hit
+    skips Elasticsearch, the template parsing and most of the serialization.
+    A lookup for a different generation empties the cache.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.generation = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """Return (payload, body_bytes) or None."""
+        if generation is None:
+            return None
+        with self._lock:
+            if generation != self.generation:
+                self._clear()
+                self.generation = generation
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, generation, payload):
+        """Store `payload` and return its serialized bytes."""
+        body = json_codec.dumps(payload)
+        # Large payloads are not worth evicting several other entries for
+        if generation is None or not self.max_bytes or len(body) > self.max_bytes // 4:
+            return body
+        with self._lock:
+            if generation != self.generation:
+                return body
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (payload, body)
+            self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return body
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.generation = None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def with_planner(body, planner):
+    """Append `planner` to a cached payload's JSON object without re-serializing it."""
+    return body[:-1] + b',"planner":' + json_codec.dumps(planner) + b"}"
+
+
+result_cache = ResultCache()
+
+
+def invalidate():
+    result_cache.invalidate()
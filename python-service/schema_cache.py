@@ -0,0 +1,63 @@
+import os
+import time
+import threading
+from es_client import get_es_client
+
+SCHEMA_INDEX = "schema-index"  # alias of the latest schema-index-<timestamp> generation
+# How long a cached schema is trusted before its version is checked again
+SCHEMA_CHECK_INTERVAL = float(os.environ.get("SCHEMA_CHECK_INTERVAL", "30"))
+
+
+class SchemaCache:
+    """In-memory copy of the schema-index document, refetched only when its version changes.
+
+    Every `check_interval` seconds a lookup fetches just the `version` and
+    `data_version` fields; the full document (which can hold thousands of
+    field paths) is only downloaded again when `version` differs from the
+    cached one. A new `data_version` alone (an incremental load that added no
+    fields) is copied into the cached document.
+    """
+
+    def __init__(self, index=SCHEMA_INDEX, check_interval=SCHEMA_CHECK_INTERVAL, client_factory=get_es_client):
+        self.index = index
+        self.check_interval = check_interval
+        self.client_factory = client_factory
+        self._schema = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        schema = self._schema
+        if schema is not None and now - self._checked < self.check_interval:
+            return schema
+        with self._lock:
+            if self._schema is not None and now - self._checked < self.check_interval:
+                return self._schema
+            es = self.client_factory()
+            try:
+                if self._schema is not None:
+                    head = es.get(index=self.index, id="current", source_includes=["version", "data_version"])["_source"]
+                    if head.get("version") == self._schema.get("version"):
+                        if head.get("data_version") != self._schema.get("data_version"):
+                            self._schema = {**self._schema, "data_version": head.get("data_version")}
+                        self._checked = now
+                        return self._schema
+                self._schema = es.get(index=self.index, id="current")["_source"]
+                self._checked = now
+            except Exception:
+                # Keep serving a stale schema rather than none; retry on the next lookup
+                return self._schema or {}
+            return self._schema
+
+    def invalidate(self):
+        with self._lock:
+            self._schema = None
+            self._checked = 0.0
+
+
+schema_cache = SchemaCache()
+
+
+def invalidate():
+    schema_cache.invalidate()
@@ -0,0 +1,217 @@
+import os
+import re
+import heapq
+import hashlib
+import functools
+from collections import Counter
+from query_cache import CVE_RE, COMPONENT_RE
+from index_mapping import is_searchable
+
+# How many catalog fields build_system_prompt lists for one prompt
+PROMPT_MAX_FIELDS = int(os.environ.get("PROMPT_MAX_FIELDS", "40"))
+# Distinct values kept per field for the prompt and for debugging
+CATALOG_SAMPLES = 3
+# Hashes kept per field by the cardinality sketch; larger is more accurate
+SKETCH_SIZE = 64
+# Fields with at most this many distinct values get their samples shown in the prompt
+ENUM_CARDINALITY = 20
+SAMPLE_MAX_CHARS = 40
+# Only the first few items of each list feed a field's statistics; the rest are walked for paths only
+LIST_SAMPLE = 8
+
+CVE_WORDS = {"cve", "cves", "vulnerability", "vulnerabilities", "exploit", "exploited", "epss", "kev",
+             "advisory", "severity", "cvss", "zero-day"}
+COMPONENT_WORDS = {"package", "packages", "component", "components", "library", "libraries", "version",
+                   "versions", "supplier", "license", "purl", "dependency", "dependencies", "sbom"}
+TYPE_WEIGHTS = {"string": 1.0, "text": 0.9, "number": 0.7, "boolean": 0.5}
+
+
+class DistinctSketch:
+    """K-minimum-values estimate of the number of distinct values, in O(SKETCH_SIZE) memory."""
+
+    def __init__(self, k=SKETCH_SIZE):
+        self.k = k
+        self._heap = []  # negated hashes, so the largest kept hash is on top
+        self._kept = set()
+
+    def add(self, value):
+        # A fixed hash rather than hash(), which is salted per process, so every load and worker gets the same estimate
+        h = int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), "big") / 2.0 ** 64
+        if h in self._kept:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -h)
+            self._kept.add(h)
+        elif h < -self._heap[0]:
+            self._kept.discard(-heapq.heapreplace(self._heap, -h))
+            self._kept.add(h)
+
+    def estimate(self):
+        if len(self._heap) < self.k:
+            return len(self._heap)
+        return int((self.k - 1) / -self._heap[0])
+
+
+class FieldStats:
+    def __init__(self):
+        self.count = 0
+        self.types = Counter()
+        self.doc_types = Counter()
+        self.samples = []
+        self.sketch = DistinctSketch()
+
+
+def value_type(value):
+    if isinstance(value, str):
+        return "text" if len(value) > 64 or " " in value.strip() else "string"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, dict):
+        return "object"
+    return "string"
+
+
+class FieldCatalog:
+    """Per-field statistics gathered in one streaming pass over the documents.
+
+    `paths()` gives the same set as populate_elasticsearch.extract_field_paths
+    over every document, except that unindexed objects (the raw `original` CVE
+    feed) are recorded without their subfields; `entries()` is the catalog
+    stored in the schema-index.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.doc_counts = Counter()
+
+    def add(self, doc):
+        doc_type = str(doc.get("type") or "unknown")
+        self.doc_counts[doc_type] += 1
+        seen = set()
+        self._walk(doc, "", seen, True)
+        for path in seen:
+            self.fields[path].count += 1
+            self.fields[path].doc_types[doc_type] += 1
+
+    def _walk(self, value, prefix, seen, sample):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                path = f"{prefix}.{key}" if prefix else key
+                stats = self.fields.get(path)
+                if stats is None:
+                    stats = self.fields[path] = FieldStats()
+                seen.add(path)
+                if sample:
+                    self._leaf(stats, child)
+                # Nothing under an unindexed object can be queried, so it is not worth walking
+                if isinstance(child, (dict, list)) and is_searchable(path):
+                    self._walk(child, path, seen, sample)
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, (dict, list)):
+                    self._walk(item, prefix, seen, sample and i < LIST_SAMPLE)
+
+    def _leaf(self, stats, value):
+        if isinstance(value, list):
+            for item in value[:LIST_SAMPLE]:
+                self._leaf(stats, item)
+            return
+        if value is None:
+            return
+        kind = value_type(value)
+        stats.types[kind] += 1
+        if kind == "object":
+            return
+        stats.sketch.add(value)
+        if len(stats.samples) < CATALOG_SAMPLES and value not in stats.samples:
+            stats.samples.append(value)
+
+    def paths(self):
+        return set(self.fields)
+
+    def entries(self):
+        """Catalog entries, best first."""
+        out = []
+        for path, stats in self.fields.items():
+            kind = stats.types.most_common(1)[0][0] if stats.types else "null"
+            type_docs = sum(self.doc_counts[t] for t in stats.doc_types) or 1
+            cardinality = stats.sketch.estimate()
+            out.append({
+                "path": path,
+                "type": kind,
+                "count": stats.count,
+                "cardinality": cardinality,
+                "doc_types": sorted(stats.doc_types),
+                "samples": [str(v)[:SAMPLE_MAX_CHARS] for v in stats.samples],
+                "score": field_score(path, kind, stats.count, stats.count / type_docs, cardinality),
+            })
+        out.sort(key=lambda e: (-e["score"], e["path"]))
+        return out
+
+
+def field_score(path, kind, count, coverage, cardinality):
+    """How useful a field is to name in a prompt: common, shallow, varied leaf values score highest."""
+    if kind not in TYPE_WEIGHTS:
+        return 0.0
+    depth = path.count(".")
+    score = coverage * TYPE_WEIGHTS[kind] / (1 + 0.5 * max(0, depth - 1))
+    if path.startswith("original."):
+        # Raw copy of the CVE feed; the flattened top-level fields say the same thing more cheaply
+        score *= 0.5
+    if cardinality <= 1 and count > 1:
+        # Same value in every document, so there is nothing to filter on
+        score *= 0.2
+    return round(score, 4)
+
+
+def merge_entries(existing, added):
+    """Keep existing entries and add the ones for new paths (incremental loads see only changed docs)."""
+    known = {e["path"] for e in existing}
+    merged = list(existing) + [e for e in added if e["path"] not in known]
+    merged.sort(key=lambda e: (-e["score"], e["path"]))
+    return merged
+
+
+def prompt_doc_types(prompt):
+    """Which document types a prompt is about: {"cve"}, {"component"}, or both when unclear."""
+    words = set(re.findall(r"[a-z][a-z\-]*", prompt.lower()))
+    cve = bool(CVE_RE.search(prompt)) or bool(words & CVE_WORDS)
+    component = bool(COMPONENT_RE.search(prompt)) or bool(words & COMPONENT_WORDS)
+    if cve and not component:
+        return {"cve"}
+    if component and not cve:
+        return {"component"}
+    return {"cve", "component"}
+
+
+@functools.lru_cache(maxsize=4096)
+def path_words(path):
+    return frozenset(re.split(r"[._]", path.lower()))
+
+
+def select_fields(entries, prompt, limit=PROMPT_MAX_FIELDS):
+    """Top `limit` leaf fields for `prompt`, favouring its doc types and fields whose names it mentions."""
+    doc_types = prompt_doc_types(prompt)
+    words = set(re.findall(r"[a-z0-9]+", prompt.lower()))
+    # "versions" should still pick out package.version
+    words |= {w[:-1] for w in words if w.endswith("s")}
+
+    def rank(entry):
+        score = entry["score"]
+        if words & path_words(entry["path"]):
+            score *= 2
+        if not doc_types & set(entry["doc_types"]):
+            score *= 0.1
+        return score
+
+    leaves = [e for e in entries if e["type"] in TYPE_WEIGHTS]
+    return heapq.nlargest(limit, leaves, key=rank)
+
+
+def describe_field(entry):
+    text = f"{entry['path']} ({entry['type']}"
+    if entry["samples"] and entry["cardinality"] <= ENUM_CARDINALITY:
+        text += ", e.g. " + " | ".join(entry["samples"])
+    return text + ")"
@@ -0,0 +1,173 @@
+"""Tenants: several customers' datasets served by one process.
+
+A request names its tenant with a `tenant` body field or the X-Tenant header,
+and populate with `--tenant`. Each tenant has its own read aliases
+("<alias>-<tenant>" for the data, schema-index and link indices), its own
+data directory, local search index and populate manifest, and its own
+schema, query and result caches. Those caches have per-tenant quotas, so a
+busy tenant cannot evict another tenant's hot entries. Requests that name
+no tenant, or DEFAULT_TENANT, use the single-tenant names and process-wide
+caches as before.
+"""
+import os
+import re
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
+import query_cache
+import result_cache
+import schema_cache
+import local_search
+from links import LINK_INDEX
+from prompt_compiler import compile_prompt
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ES_INDEX = os.environ.get("ES_INDEX", "nlp_index")
+# The name that maps to the single-tenant indices and caches
+DEFAULT_TENANT = os.environ.get("DEFAULT_TENANT", "default")
+# Comma-separated tenants this process serves; empty serves every tenant with a directory under TENANT_DATA_DIR
+TENANTS = [t.strip() for t in os.environ.get("TENANTS", "").split(",") if t.strip()]
+# Hot tenants whose schema, compiled prompt and local index are loaded at startup and never evicted
+TENANT_PREWARM = [t.strip() for t in os.environ.get("TENANT_PREWARM", "").split(",") if t.strip()]
+# Tenants whose caches are kept in memory at once, prewarmed ones not counted; the least recently used goes first
+TENANT_MAX_LOADED = int(os.environ.get("TENANT_MAX_LOADED", "32"))
+# Per-tenant quotas
+TENANT_QUERY_CACHE_SIZE = int(os.environ.get("TENANT_QUERY_CACHE_SIZE", "256"))
+TENANT_RESULT_CACHE_SIZE = int(os.environ.get("TENANT_RESULT_CACHE_SIZE", "256"))
+TENANT_RESULT_CACHE_MAX_BYTES = int(os.environ.get("TENANT_RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# <dir>/<tenant>/log4.json and cve.json are what populate loads for a tenant
+TENANT_DATA_DIR = os.environ.get("TENANT_DATA_DIR", os.path.join(BASE_DIR, "data", "tenants"))
+# Lowercase (index names must be) and no "-", which separates an alias from its generation stamp
+TENANT_RE = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+
+logger = logging.getLogger("tenants")
+_current = contextvars.ContextVar("tenant", default=None)
+
+
+class UnknownTenant(ValueError):
+    pass
+
+
+class Tenant:
+    """Where one tenant's data lives and the caches that serve it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.data_index = f"{ES_INDEX}-{name}"
+        self.schema_index = f"{schema_cache.SCHEMA_INDEX}-{name}"
+        self.link_index = f"{LINK_INDEX}-{name}"
+        data_dir = os.path.join(TENANT_DATA_DIR, name)
+        self.log4_path = os.path.join(data_dir, "log4.json")
+        self.cve_path = os.path.join(data_dir, "cve.json")
+        self.local_index_path = self.path(local_search.LOCAL_INDEX_PATH)
+        self.schema_cache = schema_cache.SchemaCache(index=self.schema_index)
+        db_path = f"{query_cache.QUERY_CACHE_DB}.{name}" if query_cache.QUERY_CACHE_DB else ""
+        self.query_cache = query_cache.QueryCache(maxsize=TENANT_QUERY_CACHE_SIZE, db_path=db_path)
+        self.result_cache = result_cache.ResultCache(TENANT_RESULT_CACHE_SIZE, TENANT_RESULT_CACHE_MAX_BYTES)
+        self.local_index = local_search.IndexFile(self.local_index_path)
+
+    def path(self, default):
+        """This tenant's copy of a single-tenant file, e.g. .local_index.bin -> .local_index.acme.bin."""
+        root, ext = os.path.splitext(default)
+        return f"{root}.{self.name}{ext}"
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+
+class TenantRegistry:
+    """Tenants with caches in memory, least recently used first."""
+
+    def __init__(self, max_loaded=TENANT_MAX_LOADED, pinned=TENANT_PREWARM):
+        self.max_loaded = max_loaded
+        self.pinned = set(pinned)
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is not None:
+                self._tenants.move_to_end(name)
+                return tenant
+            tenant = self._tenants[name] = Tenant(name)
+            unpinned = [n for n in self._tenants if n not in self.pinned]
+            # Evicted caches are simply dropped; the tenant's next request reloads its schema
+            for evicted in unpinned[:max(0, len(unpinned) - self.max_loaded)]:
+                del self._tenants[evicted]
+                logger.info(f"[Tenants] Unloaded tenant {evicted}.")
+            return tenant
+
+    def loaded(self):
+        with self._lock:
+            return list(self._tenants)
+
+
+registry = TenantRegistry()
+
+
+def exists(name):
+    """Whether `name` is a tenant this process serves: listed in TENANTS or, without TENANTS, one with a data directory."""
+    if TENANTS:
+        return name in TENANTS
+    return os.path.isdir(os.path.join(TENANT_DATA_DIR, name))
+
+
+def resolve(name):
+    """The Tenant for a request's tenant name, or None for the default tenant.
+
+    Unknown names raise before the registry is touched, so made-up X-Tenant
+    values cannot create tenants or evict real ones.
+    """
+    if name is None or name == "" or name == DEFAULT_TENANT:
+        return None
+    if not isinstance(name, str) or not TENANT_RE.match(name) or not exists(name):
+        raise UnknownTenant(f"Unknown tenant: {name!r}")
+    return registry.get(name)
+
+
+def current():
+    """The Tenant the running request belongs to, or None for the default tenant."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use(tenant):
+    """Run the block on behalf of `tenant` (None for the default tenant)."""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def warm(tenant):
+    """Load a tenant's schema, compiled prompt and local search index ahead of its first request."""
+    schema = (schema_cache.schema_cache if tenant is None else tenant.schema_cache).get()
+    if schema:
+        compile_prompt(schema)
+    (local_search.default_index if tenant is None else tenant.local_index).get()
+    return bool(schema)
+
+
+def prewarm(names=None):
+    """Warm every TENANT_PREWARM tenant; one that fails is logged and left to load on first use."""
+    for name in TENANT_PREWARM if names is None else names:
+        try:
+            if warm(resolve(name)):
+                logger.info(f"[Tenants] Prewarmed tenant {name}.")
+            else:
+                logger.warning(f"[Tenants] No schema for tenant {name} yet; nothing to prewarm.")
+        except Exception as e:
+            logger.warning(f"[Tenants] Could not prewarm tenant {name}: {e}")
+
+
+def start_prewarm():
+    """Prewarm on a background thread so startup does not wait on Elasticsearch."""
+    if not TENANT_PREWARM:
+        return None
+    thread = threading.Thread(target=prewarm, name="tenant-prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -9,11 +9,20 @@ class ApiIntegrationTestCase(unittest.TestCase):
 
     def test_repopulate_es(self):
         resp = self.app.post('/repopulate-es')
-        self.assertIn(resp.status_code, [200, 500])
+        self.assertIn(resp.status_code, [202, 500])
         data = resp.get_json()
         self.assertIn('status', data)
         # Accept either success or error, but must be structured
         self.assertTrue(data['status'] in ['success', 'error'])
+        if data['status'] == 'success':
+            status = self.app.get(f"/repopulate-es/{data['job_id']}")
+            self.assertEqual(status.status_code, 200)
+            self.assertIn(status.get_json()['job']['state'], ['queued', 'running', 'succeeded', 'failed'])
+
+    def test_repopulate_es_unknown_job(self):
+        resp = self.app.get('/repopulate-es/does-not-exist')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json()['status'], 'error')
 
     def test_process_show_all(self):
         resp = self.app.post('/process', json={'prompt': 'show all'})
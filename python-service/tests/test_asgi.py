@@ -0,0 +1,114 @@
+import json
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from starlette.testclient import TestClient
+import api
+import asgi
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}}
+
+def fake_es(hits):
+    es = MagicMock()
+    es.search = AsyncMock(return_value={"hits": {"hits": hits}})
+    es.close = AsyncMock()
+    return es
+
+class TestAsgiApp(unittest.TestCase):
+    def client(self, es):
+        patcher = patch("asgi.create_async_es_client", return_value=es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        schema = patch("asgi.fetch_schema_fields", return_value=["id", "original.cve.kev.cveID"])
+        schema.start()
+        self.addCleanup(schema.stop)
+        schema_doc = patch("asgi.fetch_schema", return_value={"version": "1"})
+        schema_doc.start()
+        self.addCleanup(schema_doc.stop)
+        local = patch("local_search.current_index", return_value=None)
+        local.start()
+        self.addCleanup(local.stop)
+        return TestClient(asgi.app)
+
+    def test_process_rule_planned(self):
+        es = fake_es([CVE_HIT])
+        with self.client(es) as client:
+            resp = client.post("/process", json={"prompt": "show me CVE-2020-1472"})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["intent"], "cve")
+        self.assertEqual(data["planner"], "rules")
+        self.assertEqual(data["results"]["template"], "TemplateB")
+        es.close.assert_awaited()
+
+    def test_process_relationship_reads_link_index(self):
+        link = {"_id": "CVE-2020-1472|c1", "_source": {"cve_id": "CVE-2020-1472", "component_id": "c1"}}
+        es = fake_es([link])
+        with self.client(es) as client:
+            resp = client.post("/process", json={"prompt": "which packages does CVE-2020-1472 affect"})
+        self.assertEqual(resp.json()["intent"], "relationship")
+        self.assertEqual(es.search.call_args.kwargs["index"], api.LINK_INDEX)
+
+    @patch("asgi.generate_elasticsearch_query_async", new_callable=AsyncMock)
+    def test_process_rate_limited_falls_back(self, mock_generate):
+        mock_generate.side_effect = asgi.GeminiRateLimitExceeded("quota")
+        es = fake_es([])
+        with self.client(es) as client:
+            resp = client.post("/process", json={"prompt": "which packages are risky"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["planner"], "fallback")
+        self.assertIn("multi_match", es.search.call_args.kwargs["body"]["query"])
+
+    @patch("api.LLM_FALLBACK", False)
+    @patch("asgi.generate_elasticsearch_query_async", new_callable=AsyncMock)
+    def test_process_rate_limited(self, mock_generate):
+        mock_generate.side_effect = asgi.GeminiRateLimitExceeded("quota")
+        with self.client(fake_es([])) as client:
+            resp = client.post("/process", json={"prompt": "which packages are risky"})
+        self.assertEqual(resp.status_code, 500)
+        self.assertIn("Gemini rate-limit exceeded", resp.json()["error"])
+
+    def test_stream_show_all(self):
+        es = fake_es([])
+        es.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es.close_point_in_time = AsyncMock()
+        es.search.return_value = {"pit_id": "pit-1", "hits": {"hits": [dict(CVE_HIT, sort=[0])]}}
+        with self.client(es) as client:
+            resp = client.post("/process", json={"prompt": "show all", "stream": True})
+        lines = resp.text.splitlines()
+        self.assertEqual(resp.headers["content-type"], "application/x-ndjson")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(json.loads(lines[-1])["done"])
+        es.close_point_in_time.assert_awaited_once_with(id="pit-1")
+
+    def test_json_error_contract(self):
+        with self.client(fake_es([])) as client:
+            self.assertEqual(client.get("/nope").json()["error"], "Not Found")
+            resp = client.get("/process")
+            self.assertEqual(resp.status_code, 405)
+            self.assertEqual(resp.json()["intent"], "error")
+            resp = client.get("/repopulate-es/missing")
+            self.assertEqual(resp.status_code, 404)
+
+class TestRunUntilDisconnect(unittest.TestCase):
+    def test_cancels_work_when_client_leaves(self):
+        cancelled = []
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        request = MagicMock()
+        request.is_disconnected = AsyncMock(return_value=True)
+        with patch("asgi.DISCONNECT_POLL_INTERVAL", 0.01):
+            async def run():
+                result = await asgi.run_until_disconnect(request, slow())
+                await asyncio.sleep(0)
+                return result
+            result = asyncio.run(run())
+        self.assertIsNone(result)
+        self.assertEqual(cancelled, [True])
+
+if __name__ == "__main__":
+    unittest.main()
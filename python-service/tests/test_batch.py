@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import api
+import llm
+from llm_guard import LLMGuard, TokenBucket
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}}
+COMPONENT_HIT = {"_id": "c1", "_source": {"id": "c1", "type": "component"}}
+
+class TestParseLlmResponses(unittest.TestCase):
+    def test_json_array(self):
+        text = '```json\n[{"query": {"match_all": {}}}, {"match": {"id": "x"}}]\n```'
+        self.assertEqual(llm.parse_llm_responses(text, 2), [
+            {"query": {"match_all": {}}}, {"query": {"match": {"id": "x"}}}])
+
+    def test_consecutive_objects_and_padding(self):
+        text = '1. {"query": {"match_all": {}}}\n2. not json {broken\n'
+        self.assertEqual(llm.parse_llm_responses(text, 2), [{"query": {"match_all": {}}}, None])
+
+class TestProcessBatch(unittest.TestCase):
+    def setUp(self):
+        llm.query_cache.invalidate()
+        for target, value in [("api.fetch_schema_fields", ["id", "package.name"]),
+                              ("api.fetch_schema", {"fields": ["id"], "version": "1"}),
+                              ("llm.fetch_schema", {"fields": ["id"], "version": "1"}),
+                              # No local search index, so throttled prompts get the multi_match fallback
+                              ("local_search.current_index", None)]:
+            patcher = patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        guard = patch("llm.llm_guard", LLMGuard(bucket=TokenBucket(db_path=""), retry_on=(llm.exceptions.ResourceExhausted,), max_retries=0))
+        guard.start()
+        self.addCleanup(guard.stop)
+
+    @patch("api.es")
+    @patch("llm.get_model")
+    def test_dedupes_and_makes_one_llm_and_one_es_call(self, mock_model, mock_es):
+        mock_model.return_value.generate_content.return_value = MagicMock(
+            text='[{"query": {"match": {"type": "component"}}}]')
+        mock_es.msearch.return_value = {"responses": [
+            {"hits": {"hits": [CVE_HIT]}},
+            {"hits": {"hits": [COMPONENT_HIT]}},
+        ]}
+        prompts = ["show me CVE-2020-1472", "Show me cve-2020-1472 ", "which components are risky"]
+        items = api.process_batch(prompts)
+        self.assertEqual(mock_model.return_value.generate_content.call_count, 1)
+        self.assertEqual(mock_es.msearch.call_count, 1)
+        self.assertEqual(len(mock_es.msearch.call_args.kwargs["body"]), 4)
+        self.assertEqual([i["prompt"] for i in items], prompts)
+        self.assertEqual(items[0]["intent"], "cve")
+        self.assertEqual(items[0]["planner"], "rules")
+        self.assertEqual(items[1]["results"], items[0]["results"])
+        self.assertEqual(items[2]["planner"], "llm")
+        self.assertEqual(items[2]["results"]["template"], "TemplateA")
+
+    @patch("api.es")
+    @patch("llm.get_model")
+    def test_rate_limit_uses_fallback_for_llm_items(self, mock_model, mock_es):
+        mock_model.return_value.generate_content.side_effect = llm.exceptions.ResourceExhausted("quota")
+        mock_es.msearch.return_value = {"responses": [{"hits": {"hits": [CVE_HIT]}}, {"hits": {"hits": []}}]}
+        items = api.process_batch(["show me CVE-2020-1472", "which components are risky"])
+        self.assertEqual(items[0]["intent"], "cve")
+        self.assertEqual(items[1]["planner"], "fallback")
+        fallback = mock_es.msearch.call_args.kwargs["body"][3]
+        self.assertIn("multi_match", fallback["query"])
+
+    @patch("api.LLM_FALLBACK", False)
+    @patch("api.es")
+    @patch("llm.get_model")
+    def test_rate_limit_without_fallback_fails_only_llm_items(self, mock_model, mock_es):
+        mock_model.return_value.generate_content.side_effect = llm.exceptions.ResourceExhausted("quota")
+        mock_es.msearch.return_value = {"responses": [{"hits": {"hits": [CVE_HIT]}}]}
+        items = api.process_batch(["show me CVE-2020-1472", "which components are risky"])
+        self.assertEqual(items[0]["intent"], "cve")
+        self.assertEqual(items[1]["intent"], "error")
+        self.assertIn("Gemini rate-limit exceeded", items[1]["error"])
+
+    def test_endpoint_validates_prompts(self):
+        from app import app
+        client = app.test_client()
+        resp = client.post("/process/batch", json={"prompts": "show all"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.get_json()["intent"], "error")
+
+if __name__ == "__main__":
+    unittest.main()
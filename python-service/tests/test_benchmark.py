@@ -0,0 +1,43 @@
+import unittest
+import benchmark
+import llm
+
+class TestFakes(unittest.TestCase):
+    def test_fake_model_answers_parse(self):
+        model = benchmark.FakeGeminiModel(latency=0, jitter=0)
+        prompt = llm.build_full_prompt("risky packages", ["package.name"])
+        for _ in benchmark.LLM_RESPONSE_FORMATS:
+            text = model.generate_content(prompt).text
+            self.assertIn("multi_match", llm.parse_llm_response(text)["query"])
+        batch = model.generate_content(llm.build_batch_prompt(["a", "b"], ["id"])).text
+        self.assertEqual(len([q for q in llm.parse_llm_responses(batch, 2) if q]), 2)
+
+    def test_fake_es_pages_with_pit(self):
+        es = benchmark.FakeElasticsearch()
+        es.indices.create(index="idx-1")
+        es.indices.update_aliases(body={"actions": [{"add": {"index": "idx-1", "alias": "idx"}}]})
+        es.bulk(body=[b'{"index": {"_index": "idx-1", "_id": "%d"}}' % i if j == 0 else b'{"type": "cve"}'
+                      for i in range(3) for j in range(2)])
+        pit = es.open_point_in_time(index="idx", keep_alive="1m")["id"]
+        first = es.search(body={"size": 2, "pit": {"id": pit}, "query": {"term": {"type": "cve"}}})["hits"]["hits"]
+        rest = es.search(body={"size": 2, "pit": {"id": pit}, "search_after": first[-1]["sort"]})["hits"]["hits"]
+        self.assertEqual([h["_id"] for h in first + rest], ["0", "1", "2"])
+
+class TestBenchmark(unittest.TestCase):
+    def test_small_run_has_no_errors(self):
+        results = benchmark.run(size=40, requests=6, concurrency=2, llm_latency=0, llm_jitter=0)
+        self.assertEqual(set(results), set(benchmark.SCENARIOS))
+        self.assertEqual(results["populate"]["docs"], 40)
+        for name, result in results.items():
+            self.assertEqual(result["errors"], 0, name)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+
+    def test_regressions_against_baseline(self):
+        base = {"process_llm": {"throughput": 100.0, "p95_ms": 50.0, "errors": 0}}
+        ok = {"process_llm": {"throughput": 90.0, "p95_ms": 55.0, "errors": 0}}
+        slow = {"process_llm": {"throughput": 40.0, "p95_ms": 120.0, "errors": 0}}
+        self.assertEqual(benchmark.find_regressions(ok, base, tolerance=0.3), [])
+        self.assertEqual(len(benchmark.find_regressions(slow, base, tolerance=0.3)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import bulk_indexer
+from bulk_indexer import BulkIndexer, read_components
+
+def bulk_response(*statuses):
+    return {"items": [{"index": {"status": s, "error": None if s < 300 else "boom"}} for s in statuses]}
+
+class TestBulkIndexer(unittest.TestCase):
+    def test_chunks_by_size(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: bulk_response(*([201] * (len(body) // 2)))
+        indexer = BulkIndexer(es, "idx", chunk_size=2, workers=2)
+        for i in range(5):
+            indexer.add(str(i), {"n": i})
+        stats = indexer.close()
+        self.assertEqual(es.bulk.call_count, 3)
+        self.assertEqual(stats["docs"], 5)
+        self.assertEqual(stats["errors"], 0)
+
+    @patch("bulk_indexer.time.sleep")
+    def test_retries_rejected_items(self, _sleep):
+        es = MagicMock()
+        es.bulk.side_effect = [bulk_response(201, 429, 400), bulk_response(201)]
+        indexer = BulkIndexer(es, "idx", chunk_size=10, workers=1)
+        for i in range(3):
+            indexer.add(str(i), {"n": i})
+        stats = indexer.close()
+        self.assertEqual(stats["docs"], 2)
+        self.assertEqual(indexer.errors, [("2", "boom")])
+        # Only the throttled item is resent
+        self.assertEqual(len(es.bulk.call_args_list[1].kwargs["body"]), 2)
+
+    def test_failed_worker_keeps_the_next_chunk_and_its_slot(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: bulk_response(*([201] * (len(body) // 2)))
+        progress = MagicMock(side_effect=[RuntimeError("callback"), None])
+        indexer = BulkIndexer(es, "idx", chunk_size=1, workers=1, on_progress=progress)
+        indexer.add("0", {"n": 0})
+        indexer._futures[0].exception()  # wait for the first request
+        with self.assertRaises(RuntimeError):
+            indexer.add("1", {"n": 1})
+        stats = indexer.close()
+        self.assertEqual(es.bulk.call_count, 2)
+        self.assertEqual(stats["docs"], 2)
+        # Both slots are free again
+        self.assertTrue(indexer._slots.acquire(blocking=False) and indexer._slots.acquire(blocking=False))
+
+    def test_close_shuts_the_pool_down_when_a_worker_failed(self):
+        indexer = BulkIndexer(MagicMock(), "idx", workers=1)
+        indexer.add("0", {"n": 0})
+        with patch.object(indexer, "_send", side_effect=RuntimeError("worker")), self.assertRaises(RuntimeError):
+            indexer.close()
+        with self.assertRaises(RuntimeError):
+            indexer._pool.submit(print)
+
+class TestReadComponents(unittest.TestCase):
+    def write(self, doc):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "feed.json")
+        with open(path, "w") as f:
+            json.dump(doc, f)
+        return path
+
+    @unittest.skipIf(bulk_indexer.ijson is None, "ijson is not installed")
+    def test_streams_components_after_other_keys(self):
+        path = self.write({"status": True, "meta": {"components": "not this one"}, "components": [{"name": "a"}, {"name": "b"}]})
+        components, doc = read_components(path)
+        self.assertIsNone(doc)
+        self.assertEqual(list(components), [{"name": "a"}, {"name": "b"}])
+
+    @unittest.skipIf(bulk_indexer.ijson is None, "ijson is not installed")
+    def test_plain_document_is_parsed_once(self):
+        path = self.write({"cve": {"osv": {"id": "CVE-1", "components": []}}})
+        with patch("bulk_indexer.ijson.items") as items, patch("bulk_indexer.json.load", wraps=json.load) as load:
+            components, doc = read_components(path)
+        self.assertIsNone(components)
+        self.assertEqual(doc["cve"]["osv"]["id"], "CVE-1")
+        items.assert_not_called()
+        self.assertEqual(load.call_count, 1)
+
+    @patch("bulk_indexer.ijson", None)
+    def test_without_ijson(self):
+        self.assertEqual(read_components(self.write({"components": [{"name": "a"}]})), ([{"name": "a"}], None))
+        self.assertEqual(read_components(self.write([1, 2])), (None, [1, 2]))
+
+if __name__ == "__main__":
+    unittest.main()
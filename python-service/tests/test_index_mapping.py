@@ -0,0 +1,30 @@
+import unittest
+from index_mapping import index_body, field_clause, is_exact, is_searchable, nested_path, INDEX_REPLICAS
+
+
+class TestIndexMapping(unittest.TestCase):
+    def test_field_kinds(self):
+        self.assertTrue(is_exact("package.purl"))
+        self.assertTrue(is_exact("package.short_name"))
+        self.assertFalse(is_exact("description"))
+        self.assertFalse(is_searchable("original.cve.kev.cveID"))
+        self.assertTrue(is_searchable("originality"))
+        self.assertEqual(nested_path("affected_packages.name"), "affected_packages")
+        self.assertIsNone(nested_path("package.name"))
+
+    def test_field_clause_wraps_nested_fields(self):
+        self.assertEqual(field_clause("term", "package.name", "x"), {"term": {"package.name": "x"}})
+        self.assertEqual(field_clause("term", "affected_packages.name", "x"),
+                         {"nested": {"path": "affected_packages", "query": {"term": {"affected_packages.name": "x"}}}})
+
+    def test_bulk_load_settings(self):
+        bulk = index_body()["settings"]["index"]
+        self.assertEqual((bulk["refresh_interval"], bulk["number_of_replicas"]), ("-1", 0))
+        direct = index_body(bulk_load=False)["settings"]["index"]
+        self.assertNotIn("refresh_interval", direct)
+        self.assertEqual(direct["number_of_replicas"], INDEX_REPLICAS)
+        self.assertEqual(index_body()["mappings"]["properties"]["original"], {"type": "object", "enabled": False})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import unittest
+from jobs import RepopulateRunner
+
+class TestRepopulateRunner(unittest.TestCase):
+    def test_job_reports_progress_and_result(self):
+        def target(incremental, progress):
+            progress("indexing", docs=10, docs_per_sec=5.0)
+            return {"docs": 10, "incremental": incremental}
+        runner = RepopulateRunner(target)
+        job, created = runner.submit(incremental=True)
+        self.assertTrue(created)
+        for t in threading.enumerate():
+            if t.name.startswith("repopulate-"):
+                t.join(5)
+        job = runner.get(job.id).to_dict()
+        self.assertEqual(job["state"], "succeeded")
+        self.assertEqual(job["docs_indexed"], 10)
+        self.assertEqual(job["result"], {"docs": 10, "incremental": True})
+
+    def test_concurrent_submits_coalesce(self):
+        release = threading.Event()
+        calls = []
+        def target(incremental, progress):
+            calls.append(incremental)
+            release.wait(5)
+        runner = RepopulateRunner(target)
+        first, _ = runner.submit()
+        second, created = runner.submit()
+        self.assertFalse(created)
+        self.assertIs(first, second)
+        release.set()
+        for t in threading.enumerate():
+            if t.name.startswith("repopulate-"):
+                t.join(5)
+        self.assertEqual(calls, [False])
+        third, created = runner.submit()
+        self.assertTrue(created)
+        self.assertIsNot(third, first)
+
+    def test_full_request_is_not_absorbed_by_incremental_job(self):
+        release = threading.Event()
+        done = threading.Event()
+        calls = []
+        def target(incremental, progress):
+            calls.append(incremental)
+            if incremental:
+                release.wait(5)
+            else:
+                done.set()
+        runner = RepopulateRunner(target)
+        running, _ = runner.submit(incremental=True)
+        self.assertIs(runner.submit(incremental=True)[0], running)
+        follow_up, created = runner.submit()
+        self.assertTrue(created)
+        self.assertFalse(follow_up.incremental)
+        self.assertEqual(follow_up.state, "queued")
+        self.assertEqual(runner.submit(), (follow_up, False))
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, [True, False])
+
+    def test_full_job_absorbs_incremental_request(self):
+        release = threading.Event()
+        runner = RepopulateRunner(lambda incremental, progress: release.wait(5))
+        running, _ = runner.submit()
+        self.assertEqual(runner.submit(incremental=True), (running, False))
+        release.set()
+
+    def test_failed_job_records_error(self):
+        def target(incremental, progress):
+            raise RuntimeError("boom")
+        runner = RepopulateRunner(target)
+        job, _ = runner.submit()
+        for t in threading.enumerate():
+            if t.name.startswith("repopulate-"):
+                t.join(5)
+        self.assertEqual(job.state, "failed")
+        self.assertEqual(job.errors, ["RuntimeError: boom"])
+        self.assertIsNone(runner.get("missing"))
+
+if __name__ == "__main__":
+    unittest.main()
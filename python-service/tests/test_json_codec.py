@@ -0,0 +1,55 @@
+import json
+import unittest
+from unittest.mock import patch
+import api
+import json_codec
+from api import TemplatedHit, classify_hits
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "CVE"}}
+COMPONENT_HIT = {"_id": "c1", "_source": {"id": "c1", "type": "component"}}
+
+
+class TestClassifyHits(unittest.TestCase):
+    def test_template_and_intent_in_one_pass(self):
+        parsed, intent = classify_hits([CVE_HIT, CVE_HIT])
+        self.assertEqual(intent, "cve")
+        self.assertEqual(parsed[0], {"template": "TemplateB", "data": CVE_HIT})
+        # Entries reference the ES hit instead of copying it
+        self.assertIs(parsed[0]["data"], CVE_HIT)
+        self.assertEqual(classify_hits([COMPONENT_HIT])[1], "package")
+        self.assertEqual(classify_hits([CVE_HIT, COMPONENT_HIT])[1], "mixed")
+        self.assertEqual(classify_hits([])[1], "package")
+        self.assertEqual(classify_hits([{"_id": "x", "_source": {"type": None}}])[0][0].template, "Unknown")
+
+    def test_legacy_helpers_agree(self):
+        hits = [CVE_HIT, COMPONENT_HIT]
+        self.assertEqual(api.parse_hits_with_template(hits), classify_hits(hits)[0])
+        self.assertEqual(api.detect_intent_from_response(hits), "mixed")
+
+
+class TestJsonCodec(unittest.TestCase):
+    def check_encoding(self):
+        body = {"intent": "cve", "results": [TemplatedHit("TemplateB", CVE_HIT)], "planner": None}
+        self.assertEqual(json.loads(json_codec.dumps(body)),
+                         {"intent": "cve", "results": [{"template": "TemplateB", "data": CVE_HIT}], "planner": None})
+        self.assertEqual(json.loads(json_codec.dumps({1: 2 ** 70})), {"1": 2 ** 70})
+        with self.assertRaises(TypeError):
+            json_codec.dumps({"x": object()})
+
+    def test_fast_encoder(self):
+        self.check_encoding()
+
+    def test_stdlib_fallback(self):
+        with patch("json_codec.orjson", None):
+            self.check_encoding()
+            self.assertIsNone(json_codec.serializer())
+
+    def test_flask_jsonify_encodes_templated_hits(self):
+        from app import app
+        with app.app_context():
+            resp = api.jsonify(api.build_single_result_response([COMPONENT_HIT], "rules"))
+        self.assertEqual(resp.get_json()["results"], {"template": "TemplateA", "data": COMPONENT_HIT})
+
+
+if __name__ == "__main__":
+    unittest.main()
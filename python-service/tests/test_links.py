@@ -0,0 +1,111 @@
+import unittest
+from unittest.mock import patch
+from app import app
+import api
+from links import LinkBuilder, purl_key, ecosystem_key, in_ranges, parse_relationship, relationship_query
+
+COMPONENT = {"type": "component", "package": {"name": "maven:log4j-core:2.14.1", "version": "2.14.1",
+             "purl": "pkg:maven/org.apache.logging.log4j/log4j-core@2.14.1", "friendly_name": "log4j-core:2.14.1"}}
+PATCHED = {"type": "component", "package": {"version": "2.17.1",
+           "purl": "pkg:maven/org.apache.logging.log4j/log4j-core@2.17.1"}}
+CVE = {"type": "cve", "id": "CVE-2021-44228", "description": "Log4Shell", "original": {"cve": {"osv": {"affected": [{
+    "package": {"ecosystem": "Maven", "name": "org.apache.logging.log4j:log4j-core"},
+    "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "2.0-beta9"}, {"fixed": "2.15.0"}]}],
+}]}}}}
+PACKAGES = ["log4j-core", "log4jscanner"]
+LINK_HIT = {"_id": "CVE-2021-44228|c1", "_source": {"cve_id": "CVE-2021-44228", "component_id": "c1"}}
+
+
+class TestPackageKeys(unittest.TestCase):
+    def test_purl_and_osv_names_share_a_key(self):
+        self.assertEqual(purl_key("pkg:maven/org.apache.logging.log4j/log4j-core@2.14.1"),
+                         ("maven/org.apache.logging.log4j/log4j-core", "log4j-core", "2.14.1"))
+        self.assertEqual(ecosystem_key("Maven", "org.apache.logging.log4j:log4j-core"),
+                         "maven/org.apache.logging.log4j/log4j-core")
+        # Distro namespaces are not part of the identity
+        self.assertEqual(purl_key("pkg:apk/alpine/samba?arch=source")[0], ecosystem_key("Alpine:v3.10", "samba"))
+
+    def test_ranges(self):
+        ranges = [{"type": "ECOSYSTEM", "events": [{"introduced": "0"}, {"fixed": "4.10.18-r0"}]}]
+        self.assertTrue(in_ranges("4.10.2-r0", ranges))
+        self.assertFalse(in_ranges("4.10.18-r0", ranges))
+        self.assertIsNone(in_ranges("1.0", [{"type": "GIT", "events": []}]))
+
+
+class TestLinkBuilder(unittest.TestCase):
+    def test_joins_affected_versions_only(self):
+        builder = LinkBuilder()
+        builder.add("c1", COMPONENT)
+        builder.add("c2", PATCHED)
+        builder.add("CVE-2021-44228", CVE)
+        links = dict(builder.links())
+        self.assertEqual(list(links), ["CVE-2021-44228|c1"])
+        link = links["CVE-2021-44228|c1"]
+        self.assertEqual((link["package_name"], link["version"], link["match"]), ("log4j-core", "2.14.1", "range"))
+
+    def test_explicit_version_list(self):
+        cve = {"type": "cve", "id": "CVE-1", "affected_packages": [], "original": {"cve": {"osv": {"affected": [
+            {"package": {"purl": "pkg:maven/org.apache.logging.log4j/log4j-core"}, "versions": ["2.17.1"]}]}}}}
+        builder = LinkBuilder()
+        builder.add("c1", COMPONENT)
+        builder.add("c2", PATCHED)
+        builder.add("CVE-1", cve)
+        self.assertEqual([doc["component_id"] for _, doc in builder.links()], ["c2"])
+
+    def test_package_names(self):
+        builder = LinkBuilder()
+        builder.add("c2", {"type": "component", "package": {"short_name": "log4jscanner"}})
+        builder.add("c1", {"type": "component", "package": {**COMPONENT["package"], "short_name": "log4j-core"}})
+        builder.add("c3", PATCHED)
+        self.assertEqual(builder.package_names(), PACKAGES)
+
+
+class TestRelationships(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_relationship("which components are affected by CVE-2021-44228").kind, "components_for_cve")
+        relation = parse_relationship("what CVEs hit log4j-core 2.14", PACKAGES)
+        self.assertEqual((relation.kind, relation.name, relation.version), ("cves_for_component", "log4j-core", "2.14"))
+        self.assertEqual(parse_relationship("vulnerabilities in log4j-core:2.14.1", PACKAGES).version, "2.14.1")
+        self.assertEqual(parse_relationship("cves for log4jscanner", PACKAGES).name, "log4jscanner")
+        self.assertIsNone(parse_relationship("show me CVE-2021-44228"))
+        self.assertIsNone(parse_relationship("show me log4jscanner:1.0.0", PACKAGES))
+
+    def test_parse_leaves_other_prompts_to_the_planner(self):
+        for prompt in ("what is the impact of CVE-2020-1472", "does CVE-2020-1472 affect us",
+                       "cves in 2021", "show vulnerabilities in production", "what CVEs hit log4j-core 2.14"):
+            self.assertIsNone(parse_relationship(prompt, ["log4jscanner"]), prompt)
+        self.assertIsNone(parse_relationship("what CVEs hit log4j-core 2.14"))
+
+    def test_version_prefix_query(self):
+        query = relationship_query(parse_relationship("what CVEs hit log4j-core 2.14", PACKAGES))
+        filters = query["query"]["bool"]["filter"]
+        self.assertIn({"term": {"package_name": "log4j-core"}}, filters)
+        self.assertIn({"prefix": {"version": "2.14."}}, filters[1]["bool"]["should"])
+
+    @patch("api.es")
+    @patch("api.fetch_schema", return_value={"version": "1", "packages": PACKAGES})
+    def test_process_reads_link_index_once(self, _schema, mock_es):
+        mock_es.search.return_value = {"hits": {"hits": [LINK_HIT]}}
+        with patch("api.get_es_query") as get_es_query:
+            body = app.test_client().post("/process", json={"prompt": "components affected by CVE-2021-44228"}).get_json()
+        get_es_query.assert_not_called()
+        self.assertEqual(mock_es.search.call_count, 1)
+        self.assertEqual(mock_es.search.call_args.kwargs["index"], api.LINK_INDEX)
+        self.assertEqual(body, {"intent": "relationship", "relation": "components_for_cve",
+                                "results": [LINK_HIT["_source"]], "planner": "links"})
+
+    @patch("api.es")
+    @patch("api.fetch_schema", return_value={"version": "1"})
+    @patch("api.fetch_schema_fields", return_value=["id"])
+    @patch("api.fetch_package_names", return_value=PACKAGES)
+    def test_batch_routes_relationships_to_link_index(self, _packages, _fields, _schema, mock_es):
+        mock_es.msearch.return_value = {"responses": [{"hits": {"hits": [LINK_HIT]}}, {"hits": {"hits": []}}]}
+        items = api.process_batch(["components affected by CVE-2021-44228", "show me CVE-2021-44228"])
+        headers = mock_es.msearch.call_args.kwargs["body"][::2]
+        self.assertEqual(headers, [{"index": api.LINK_INDEX}, {"index": api.ES_INDEX}])
+        self.assertEqual(items[0]["intent"], "relationship")
+        self.assertEqual(items[1]["planner"], "rules")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+import unittest
+import subprocess
+from unittest.mock import MagicMock, patch
+import llm
+from llm_guard import LLMGuard, TokenBucket
+
+def stub_model(text="", delay=0):
+    model = MagicMock()
+    model.generate_content.return_value = MagicMock(text=text)
+    async def generate_content_async(prompt):
+        await asyncio.sleep(delay)
+        return MagicMock(text=text)
+    model.generate_content_async = generate_content_async
+    return model
+
+class TestLlm(unittest.TestCase):
+    def setUp(self):
+        llm.query_cache.invalidate()
+        patcher = patch("llm.fetch_schema", return_value={"fields": ["id"], "version": "1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        guard = patch("llm.llm_guard", LLMGuard(bucket=TokenBucket(db_path=""), retry_on=(llm.exceptions.ResourceExhausted,), max_retries=0))
+        guard.start()
+        self.addCleanup(guard.stop)
+
+    def test_parse_llm_response(self):
+        self.assertEqual(llm.parse_llm_response('```json\n{"match": {"id": "x"}}\n```'), {"query": {"match": {"id": "x"}}})
+        self.assertIsNone(llm.parse_llm_response("no json here"))
+
+    @patch("llm.get_model")
+    def test_generate_caches_by_normalized_prompt(self, mock_model):
+        mock_model.return_value = stub_model('{"query": {"match_all": {}}}')
+        self.assertEqual(llm.generate_elasticsearch_query("Which packages?"), {"query": {"match_all": {}}})
+        llm.generate_elasticsearch_query("  which   packages ")
+        self.assertEqual(mock_model.return_value.generate_content.call_count, 1)
+
+    @patch("llm.get_model")
+    def test_async_generate_times_out(self, mock_model):
+        mock_model.return_value = stub_model('{"query": {"match_all": {}}}', delay=1)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(llm.generate_elasticsearch_query_async("slow prompt", timeout=0.01))
+
+    @patch("llm.get_model")
+    def test_async_generate(self, mock_model):
+        mock_model.return_value = stub_model('{"query": {"ids": {"values": ["a"]}}}')
+        result = asyncio.run(llm.generate_elasticsearch_query_async("find a"))
+        self.assertEqual(result, {"query": {"ids": {"values": ["a"]}}})
+
+    @patch("llm.LLM_CONTEXT_CACHE", True)
+    def test_async_generate_uploads_context_cache_off_the_event_loop(self):
+        threads = []
+        def context_cached_model(prefix):
+            threads.append(threading.current_thread())
+            return stub_model('{"query": {"match_all": {}}}')
+        with patch("llm.context_cached_model", side_effect=context_cached_model):
+            asyncio.run(llm.generate_elasticsearch_query_async("find b"))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_import_has_no_filesystem_side_effects(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "ratelimit.db")
+            env = {**os.environ, "LLM_RATE_LIMIT_DB": db_path}
+            subprocess.run([sys.executable, "-c", "import llm"], cwd=os.path.dirname(os.path.dirname(__file__)) or ".",
+                           env=env, check=True, capture_output=True)
+            self.assertFalse(os.path.exists(db_path))
+
+    @patch("llm.llm_guard", None)
+    @patch("llm.LLMGuard")
+    def test_guard_is_built_once_on_first_use(self, mock_guard):
+        self.assertIs(llm.get_llm_guard(), llm.get_llm_guard())
+        mock_guard.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
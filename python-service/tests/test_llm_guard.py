@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from llm_guard import LLMGuard, TokenBucket, CircuitBreaker, Throttled
+
+class QuotaError(Exception):
+    pass
+
+class TestTokenBucket(unittest.TestCase):
+    def test_in_process_bucket(self):
+        bucket = TokenBucket(rate_per_min=60, capacity=2, db_path="")
+        self.assertEqual(bucket.try_take(), 0)
+        self.assertEqual(bucket.try_take(), 0)
+        self.assertGreater(bucket.try_take(), 0)
+        self.assertFalse(bucket.acquire(timeout=0))
+
+    def test_sqlite_bucket_is_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bucket.db")
+            a = TokenBucket(rate_per_min=60, capacity=1, db_path=path)
+            b = TokenBucket(rate_per_min=60, capacity=1, db_path=path)
+            self.assertEqual(a.try_take(), 0)
+            self.assertGreater(b.try_take(), 0)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_probes(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=10)
+        with patch("llm_guard.time.monotonic", return_value=100):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+        with patch("llm_guard.time.monotonic", return_value=111):
+            self.assertTrue(breaker.allow())
+            # Only one probe at a time
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.state, "closed")
+
+class TestLLMGuard(unittest.TestCase):
+    def guard(self, **kwargs):
+        kwargs.setdefault("bucket", TokenBucket(rate_per_min=0, db_path=""))
+        return LLMGuard(retry_on=(QuotaError,), backoff_base=0, **kwargs)
+
+    def test_retries_quota_errors(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            if len(calls) < 3:
+                raise QuotaError()
+            return "ok"
+        self.assertEqual(self.guard(max_retries=3).call("k", fn), "ok")
+        self.assertEqual(len(calls), 3)
+
+    def test_open_breaker_fails_fast(self):
+        guard = self.guard(max_retries=0, breaker=CircuitBreaker(threshold=1, cooldown=60))
+        with self.assertRaises(QuotaError):
+            guard.call("k", lambda: (_ for _ in ()).throw(QuotaError()))
+        with self.assertRaises(Throttled):
+            guard.call("k", lambda: "never called")
+
+    def test_identical_inflight_calls_coalesce(self):
+        guard = self.guard()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "shared"
+        results = []
+        leader = threading.Thread(target=lambda: results.append(guard.call("same", fn)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(guard.call("same", fn)))
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(results, ["shared", "shared"])
+        self.assertEqual(len(calls), 1)
+
+if __name__ == "__main__":
+    unittest.main()
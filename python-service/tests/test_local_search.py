@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import api
+import llm
+import local_search
+from local_search import LocalIndexBuilder, LocalIndex, tokens, ranked_query
+
+DOCS = [
+    ("c1", {"type": "component", "package": {"name": "log4j-core", "version": "2.14.1",
+                                             "purl": "pkg:maven/org.apache.logging.log4j/log4j-core@2.14.1"}}),
+    ("c2", {"type": "component", "package": {"name": "jackson-databind", "version": "2.9.8"}}),
+    ("CVE-2021-44228", {"id": "CVE-2021-44228", "type": "cve",
+                        "description": "Remote code execution in Apache Log4j JNDI lookups",
+                        "affected_packages": [{"name": "log4j-core"}]}),
+    ("CVE-2020-1472", {"id": "CVE-2020-1472", "type": "cve",
+                       "description": "Netlogon elevation of privilege in Windows domain controllers"}),
+]
+
+
+def build(path, docs=DOCS):
+    builder = LocalIndexBuilder(dim=4096)
+    for doc_id, doc in docs:
+        builder.add(doc_id, doc)
+    builder.write(path)
+    return builder
+
+
+class TestLocalSearch(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "local_index.bin")
+        patcher = patch("local_search.LOCAL_INDEX_PATH", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tokens_keep_compounds_and_parts(self):
+        self.assertEqual(list(tokens("Show me log4j-core 2.14")), ["log4j-core", "log4j", "core", "2.14", "2", "14"])
+
+    def test_ranks_by_similarity(self):
+        build(self.path)
+        index = LocalIndex(self.path)
+        self.assertEqual(index.docs, 4)
+        ranked = index.search("netlogon privilege escalation on domain controllers")
+        self.assertEqual(ranked[0][0], "CVE-2020-1472")
+        self.assertEqual([doc_id for doc_id, _ in index.search("log4j-core")][:2], ["c1", "CVE-2021-44228"])
+        self.assertEqual(index.search("kubernetes ingress"), [])
+
+    def test_current_index_follows_rewrites(self):
+        self.assertIsNone(local_search.current_index())
+        build(self.path, DOCS[:1])
+        self.assertEqual(local_search.current_index().docs, 1)
+        build(self.path)
+        self.assertEqual(local_search.current_index().docs, 4)
+
+    def test_plan_keeps_rank_order(self):
+        build(self.path)
+        plan = local_search.plan_local("apache log4j remote code execution")
+        self.assertEqual(plan.planner, "local")
+        self.assertEqual(plan.query, ranked_query(["CVE-2021-44228", "c1"]))
+        boosts = [c["constant_score"]["boost"] for c in plan.query["query"]["bool"]["should"]]
+        self.assertEqual(boosts, sorted(boosts, reverse=True))
+
+    def test_rerank_orders_hits_by_similarity(self):
+        hits = [{"_id": "c2"}, {"_id": "CVE-2021-44228"}, {"_id": "missing"}, {"_id": "c1"}]
+        self.assertEqual(local_search.rerank("log4j", hits), hits)  # no index yet
+        build(self.path)
+        reranked = local_search.rerank("apache log4j remote code execution", hits)
+        self.assertEqual([hit["_id"] for hit in reranked], ["CVE-2021-44228", "c1", "c2", "missing"])
+
+
+class TestProcessLocalSearch(unittest.TestCase):
+    def setUp(self):
+        llm.query_cache.invalidate()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "local_index.bin")
+        build(path)
+        for target, kwargs in [("local_search.LOCAL_INDEX_PATH", {"new": path}),
+                               ("api.fetch_schema_fields", {"return_value": ["id"]}),
+                               ("api.fetch_schema", {"return_value": {"version": "1"}})]:
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        es = patch("api.es")
+        self.es = es.start()
+        self.addCleanup(es.stop)
+        self.es.search.return_value = {"hits": {"hits": [{"_id": "c2", "_source": {"type": "component"}}]}}
+
+    def post(self, prompt):
+        from app import app
+        return app.test_client().post("/process", json={"prompt": prompt}).get_json()
+
+    @patch("api.generate_elasticsearch_query", side_effect=api.GeminiRateLimitExceeded("quota"))
+    def test_throttled_gemini_uses_local_index(self, _):
+        data = self.post("anything on jackson databind")
+        self.assertEqual(data["planner"], "local")
+        self.assertEqual(data["results"]["template"], "TemplateA")
+        self.assertEqual(self.es.search.call_args.kwargs["body"]["query"], ranked_query(["c2"])["query"])
+
+    @patch("api.generate_elasticsearch_query", side_effect=llm.LLMQueryError("LLM query generation timed out.", kind="llm_timeout"))
+    def test_failed_gemini_uses_local_index(self, _):
+        self.assertEqual(self.post("anything on jackson databind")["planner"], "local")
+
+    @patch("api.LOCAL_SEARCH", "first")
+    @patch("api.generate_elasticsearch_query")
+    def test_first_mode_skips_gemini(self, mock_generate):
+        self.assertEqual(self.post("anything on jackson databind")["planner"], "local")
+        mock_generate.assert_not_called()
+        # Prompts the index knows nothing about still go to Gemini
+        mock_generate.return_value = {"query": {"match_all": {}}}
+        self.assertEqual(self.post("kubernetes ingress")["planner"], "llm")
+
+    @patch("api.LOCAL_RERANK", True)
+    @patch("api.generate_elasticsearch_query", return_value={"query": {"match_all": {}}})
+    def test_rerank_picks_the_top_hit_without_gemini(self, _):
+        self.es.search.return_value = {"hits": {"hits": [
+            {"_id": "c2", "_source": {"type": "component", "package": {"name": "jackson-databind"}}},
+            {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}},
+        ]}}
+        data = self.post("anything on netlogon domain controllers")
+        self.assertEqual(data["planner"], "llm")
+        self.assertEqual(self.es.search.call_args.kwargs["body"]["size"], api.LOCAL_RERANK_DEPTH)
+        self.assertIn("CVE-2020-1472", str(data["results"]))
+        self.assertNotIn("jackson-databind", str(data["results"]))
+
+    def test_process_batch_uses_local_index_when_throttled(self):
+        with patch("api.generate_elasticsearch_queries", side_effect=api.GeminiRateLimitExceeded("quota")):
+            self.es.msearch.return_value = {"responses": [{"hits": {"hits": []}}]}
+            items = api.process_batch(["anything on jackson databind"])
+        self.assertEqual(items[0]["planner"], "local")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import gc
+import threading
+import unittest
+from unittest.mock import patch
+from app import app
+import metrics
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self._registry = list(metrics.REGISTRY)
+        self.addCleanup(lambda: metrics.REGISTRY.__setitem__(slice(None), self._registry))
+
+    def test_counter_sums_per_thread_shards(self):
+        counter = metrics.Counter("test_total", "Test.", ["kind"])
+        threads = [threading.Thread(target=lambda: [counter.inc(kind="a") for _ in range(1000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value(kind="a"), 4000)
+        self.assertIn('test_total{kind="a"} 4000', counter.samples())
+
+    def test_finished_threads_are_folded_into_totals(self):
+        counter = metrics.Counter("test_total", "Test.")
+        histogram = metrics.Histogram("test_seconds", "Test.", buckets=(1,))
+        for _ in range(50):
+            thread = threading.Thread(target=lambda: (counter.inc(), histogram.observe(0.5)))
+            thread.start()
+            thread.join()
+        del thread
+        gc.collect()
+        self.assertLessEqual(len(counter._shards), 1)
+        self.assertEqual(counter.value(), 50)
+        self.assertEqual(histogram.count(), 50)
+        self.assertIn("test_seconds_sum 25.0", histogram.samples())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        lines = histogram.samples()
+        self.assertEqual(lines[:3], ['test_seconds_bucket{le="0.1"} 2', 'test_seconds_bucket{le="1"} 3',
+                                     'test_seconds_bucket{le="+Inf"} 4'])
+        self.assertEqual(lines[-1], "test_seconds_count 4")
+
+    @patch("api.es")
+    @patch("api.fetch_schema", return_value={"version": "1"})
+    @patch("api.fetch_schema_fields", return_value=["id", "original.cve.kev.cveID"])
+    def test_process_is_visible_on_metrics_endpoint(self, _, _schema, mock_es):
+        mock_es.search.return_value = {"took": 3, "hits": {"hits": []}}
+        client = app.test_client()
+        before = metrics.REQUESTS.value(endpoint="/process")
+        took = metrics.ES_TOOK_SECONDS.count()
+        client.post("/process", json={"prompt": "show me CVE-2020-1472"})
+        self.assertEqual(metrics.REQUESTS.value(endpoint="/process"), before + 1)
+        self.assertEqual(metrics.ES_TOOK_SECONDS.count(), took + 1)
+        resp = client.get("/metrics")
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn("# TYPE nlp_stage_duration_seconds histogram", body)
+        self.assertIn('nlp_planner_total{planner="rules"}', body)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import unittest
+from unittest.mock import patch
+from app import app
+import api
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}}
+COMPONENT_HIT = {"_id": "c1", "_source": {"type": "component"}}
+
+def page(*hits, pit_id="pit-1"):
+    return {"pit_id": pit_id, "hits": {"hits": [dict(hit, sort=[i]) for i, hit in enumerate(hits)]}}
+
+class TestPaging(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        schema = patch("api.fetch_schema_fields", return_value=["id", "original.cve.kev.cveID"])
+        schema.start()
+        self.addCleanup(schema.stop)
+        # No data_version, so the result cache stays out of the way
+        schema_doc = patch("api.fetch_schema", return_value={"version": "1"})
+        schema_doc.start()
+        self.addCleanup(schema_doc.stop)
+        es = patch("api.es")
+        self.es = es.start()
+        self.addCleanup(es.stop)
+        self.es.open_point_in_time.return_value = {"id": "pit-1"}
+
+    def test_single_result_fetches_one_projected_hit(self):
+        self.es.search.return_value = {"hits": {"hits": [CVE_HIT]}}
+        resp = self.client.post("/process", json={"prompt": "show me CVE-2020-1472"})
+        self.assertEqual(resp.status_code, 200)
+        body = self.es.search.call_args.kwargs["body"]
+        self.assertEqual(body["size"], 1)
+        self.assertNotIn("original", body["_source"]["includes"])
+        self.assertIn("description", body["_source"]["includes"])
+
+    def test_full_source_opt_in(self):
+        self.es.search.return_value = {"hits": {"hits": [CVE_HIT]}}
+        self.client.post("/process", json={"prompt": "show me CVE-2020-1472", "full_source": True})
+        self.assertIs(self.es.search.call_args.kwargs["body"]["_source"], True)
+
+    def test_cursor_pages_through_show_all(self):
+        self.es.search.return_value = page(CVE_HIT, CVE_HIT, pit_id="pit-2")
+        first = self.client.post("/process", json={"prompt": "show all", "page_size": 2}).get_json()
+        self.assertEqual(len(first["results"]), 2)
+        self.assertEqual(api.decode_cursor(first["next_cursor"], api.ES_INDEX), ("pit-2", [1]))
+        body = self.es.search.call_args.kwargs["body"]
+        self.assertEqual(body["pit"]["id"], "pit-1")
+        self.assertEqual(body["sort"][-1], {"_shard_doc": "asc"})
+
+        self.es.search.return_value = page(COMPONENT_HIT, pit_id="pit-2")
+        second = self.client.post("/process", json={"prompt": "show all", "page_size": 2,
+                                                    "cursor": first["next_cursor"]}).get_json()
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(self.es.search.call_args.kwargs["body"]["search_after"], [1])
+        self.assertEqual(self.es.open_point_in_time.call_count, 1)
+        self.es.close_point_in_time.assert_called_once_with(id="pit-2")
+
+    def test_bad_paging_input(self):
+        resp = self.client.post("/process", json={"prompt": "show all", "cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post("/process", json={"prompt": "show all", "page_size": 0})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_stream_show_all_as_ndjson(self):
+        self.es.search.side_effect = [page(CVE_HIT, COMPONENT_HIT), page(CVE_HIT)]
+        resp = self.client.post("/process", json={"prompt": "show all", "stream": True, "page_size": 2})
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([line.get("template") for line in lines[:3]], ["TemplateB", "TemplateA", "TemplateB"])
+        self.assertEqual(lines[-1], {"intent": "mixed", "planner": "rules", "count": 3, "done": True})
+        self.es.close_point_in_time.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from planner import plan_query, is_show_all, fallback_query
+from local_search import field_values
+from populate_elasticsearch import iter_documents, extract_field_paths, transform_log4, LOG4_PATH
+
+SCHEMA_FIELDS = [
+    "id", "type", "package.name", "package.short_name", "package.version", "package.friendly_name",
+    "original.cve.kev.cveID", "original.cve.osv.id",
+]
+
+
+def matches(doc_id, doc, clause):
+    """Evaluate the clauses the planner emits the way Elasticsearch would on this index's mapping."""
+    kind, body = next(iter(clause.items()))
+    if kind == "bool":
+        if not all(matches(doc_id, doc, c) for c in body.get("filter", [])):
+            return False
+        should = body.get("should")
+        return not should or any(matches(doc_id, doc, c) for c in should)
+    if kind == "ids":
+        return doc_id in body["values"]
+    field, value = next(iter(body.items()))
+    values = [str(v).lower() for v in field_values(doc, field)]
+    if kind == "term":
+        # Keyword fields with the lowercase normalizer
+        return str(value).lower() in values
+    if kind == "match_phrase":
+        return any(str(value).lower() in v for v in values)
+    raise AssertionError(f"unexpected clause {clause}")
+
+class TestPlanner(unittest.TestCase):
+    def test_show_all(self):
+        self.assertTrue(is_show_all("  Show All "))
+        plan = plan_query("show all documents", SCHEMA_FIELDS)
+        self.assertEqual(plan.query, {"query": {"match_all": {}}})
+        self.assertEqual(plan.planner, "rules")
+
+    def test_cve_lookup(self):
+        plan = plan_query("show me cve-2020-1472", SCHEMA_FIELDS)
+        self.assertEqual(plan.intent, "cve")
+        should = plan.query["query"]["bool"]["should"]
+        self.assertIn({"ids": {"values": ["CVE-2020-1472"]}}, should)
+        # `id` is a keyword field, so the CVE is a term lookup; `original.*` is not indexed
+        self.assertIn({"terms": {"id": ["CVE-2020-1472"]}}, should)
+        self.assertEqual(len(should), 2)
+        # Fields missing from the schema are not queried
+        plan = plan_query("show me cve-2020-1472", ["type"])
+        self.assertEqual(plan.query["query"]["bool"]["should"], [{"ids": {"values": ["CVE-2020-1472"]}}])
+
+    def test_component_with_version(self):
+        plan = plan_query("show me log4jscanner:1.0.0", SCHEMA_FIELDS)
+        self.assertEqual(plan.intent, "package")
+        should = plan.query["query"]["bool"]["should"]
+        self.assertIn({"match_phrase": {"package.friendly_name": "log4jscanner:1.0.0"}}, should)
+        self.assertIn({"bool": {"filter": [{"term": {"package.short_name": "log4jscanner"}},
+                                           {"term": {"package.version": "1.0.0"}}]}}, should)
+
+    def test_component_plans_match_real_sbom_docs(self):
+        docs = dict(iter_documents(LOG4_PATH, transform_log4))
+        fields = sorted(set().union(*(extract_field_paths(doc) for doc in docs.values())))
+        versions = {doc_id: doc["package"]["version"] for doc_id, doc in docs.items()}
+        plan = plan_query("show me log4jscanner:1.0.0", fields)
+        name_and_version = next(c for c in plan.query["query"]["bool"]["should"] if "bool" in c)
+        hits = [doc_id for doc_id, doc in docs.items() if matches(doc_id, doc, name_and_version)]
+        self.assertEqual([versions[doc_id] for doc_id in hits], ["1.0.0"])
+        plan = plan_query("log4jscanner", fields, ["log4jscanner"])
+        hits = [doc_id for doc_id, doc in docs.items() if matches(doc_id, doc, plan.query["query"])]
+        self.assertEqual(sorted(hits), sorted(docs))
+
+    def test_bare_name_must_be_a_known_package(self):
+        packages = ["log4j-core", "log4jscanner"]
+        self.assertEqual(plan_query("show me log4jscanner", SCHEMA_FIELDS, packages).confidence, 0.75)
+        self.assertIsNone(plan_query("show me log4jscanner", [], packages))
+        self.assertIsNone(plan_query("show me log4jscanner", SCHEMA_FIELDS))
+        for word in ("vulnerabilities", "help", "kev"):
+            self.assertIsNone(plan_query(word, SCHEMA_FIELDS, packages), word)
+
+    def test_free_text_falls_back_to_llm(self):
+        self.assertIsNone(plan_query("which packages have critical vulnerabilities", SCHEMA_FIELDS))
+
+    def test_fallback_queries_nested_fields_separately(self):
+        query = fallback_query("samba exploit", ["id", "description", "affected_packages.name", "original.cve.osv.id"])
+        should = query["query"]["bool"]["should"]
+        self.assertIn({"multi_match": {"query": "samba exploit", "fields": ["id", "description"], "lenient": True}}, should)
+        self.assertIn({"nested": {"path": "affected_packages", "query": {
+            "multi_match": {"query": "samba exploit", "fields": ["affected_packages.name"], "lenient": True}}}}, should)
+
+if __name__ == "__main__":
+    unittest.main()
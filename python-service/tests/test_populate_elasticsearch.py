@@ -1,9 +1,16 @@
 import unittest
 import os
+import json
+import tempfile
 from unittest.mock import patch, MagicMock
 from populate_elasticsearch import (
-    load_json, transform_log4, transform_cve, get_es_client, reset_index, index_document, process_and_index_file, LOG4_PATH, CVE_PATH
+    load_json, transform_log4, transform_cve, get_es_client, reset_index, index_document, process_and_index_file, LOG4_PATH, CVE_PATH,
+    swap_aliases, prune_generations, populate, iter_documents, content_hash, extract_field_paths, validate_generation
 )
+from index_mapping import index_body
+
+# Distinct documents in the bundled data files; what a full load's new generation should hold
+DOC_COUNT = len(dict(iter_documents(LOG4_PATH, transform_log4))) + len(dict(iter_documents(CVE_PATH, transform_cve)))
 
 class TestPopulateElasticsearch(unittest.TestCase):
     def test_load_json_log4(self):
@@ -34,30 +41,145 @@ class TestPopulateElasticsearch(unittest.TestCase):
         self.assertIn("original", result)
         self.assertIsInstance(result["affected_packages"], list)
 
-    @patch("populate_elasticsearch.Elasticsearch")
-    def test_reset_index(self, mock_es):
-        es = mock_es.return_value
+    def test_reset_index(self):
+        es = MagicMock()
         es.indices.exists.return_value = True
         reset_index(es, "test_index")
         es.indices.delete.assert_called_with(index="test_index")
-        es.indices.create.assert_called_with(index="test_index", ignore=400)
+        es.indices.create.assert_called_with(index="test_index", body=index_body(bulk_load=False), ignore=400)
 
-    @patch("populate_elasticsearch.Elasticsearch")
-    def test_index_document(self, mock_es):
-        es = mock_es.return_value
+    def test_index_document(self):
+        es = MagicMock()
         doc = {"id": "foo", "type": "bar"}
         index_document(es, "test_index", doc)
         es.index.assert_called_with(index="test_index", id="foo", body=doc)
 
-    @patch("populate_elasticsearch.index_document")
-    @patch("populate_elasticsearch.load_json")
-    def test_process_and_index_file(self, mock_load_json, mock_index_document):
-        # Use real log4.json data for this test
+    def test_process_and_index_file(self):
+        # Use real log4.json data for this test; each component becomes a bulk item
         real_doc = load_json(LOG4_PATH)
-        mock_load_json.return_value = real_doc
-        process_and_index_file(MagicMock(), LOG4_PATH, transform_log4)
-        mock_load_json.assert_called_with(LOG4_PATH)
-        mock_index_document.assert_called()
+        indexer = MagicMock()
+        paths = set()
+        count = process_and_index_file(MagicMock(), LOG4_PATH, transform_log4, indexer=indexer, field_paths=paths)
+        self.assertEqual(count, len(real_doc["components"]))
+        self.assertEqual(indexer.add.call_count, len(real_doc["components"]))
+        doc_id, doc = indexer.add.call_args[0]
+        self.assertEqual(doc["type"], "component")
+        self.assertIn("package.name", paths)
+
+    def test_process_and_index_jsonl_file(self):
+        cve = load_json(CVE_PATH)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cves.jsonl")
+            with open(path, "w") as f:
+                f.write(json.dumps(cve) + "\n\n" + json.dumps(cve) + "\n")
+            indexer = MagicMock()
+            count = process_and_index_file(MagicMock(), path, transform_cve, indexer=indexer)
+        self.assertEqual(count, 2)
+        doc_id, doc = indexer.add.call_args[0]
+        self.assertEqual(doc_id, "CVE-2020-1472")
+        self.assertEqual(doc["type"], "cve")
+
+    def test_swap_aliases_replaces_legacy_index(self):
+        es = MagicMock()
+        es.indices.exists_alias.return_value = False
+        es.indices.exists.return_value = True
+        swap_aliases(es, {"nlp_index": "nlp_index-1"})
+        actions = es.indices.update_aliases.call_args.kwargs["body"]["actions"]
+        self.assertEqual(actions, [
+            {"remove_index": {"index": "nlp_index"}},
+            {"add": {"index": "nlp_index-1", "alias": "nlp_index"}},
+        ])
+
+    def test_swap_aliases_moves_existing_alias(self):
+        es = MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {"nlp_index-1": {}}
+        swap_aliases(es, {"nlp_index": "nlp_index-2"})
+        actions = es.indices.update_aliases.call_args.kwargs["body"]["actions"]
+        self.assertEqual(actions, [
+            {"remove": {"index": "nlp_index-1", "alias": "nlp_index"}},
+            {"add": {"index": "nlp_index-2", "alias": "nlp_index"}},
+        ])
+
+    def test_prune_generations_keeps_newest_and_live(self):
+        es = MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {"nlp_index-1": {}}
+        es.indices.get.return_value = {"nlp_index-1": {}, "nlp_index-2": {}, "nlp_index-3": {}, "nlp_index-4": {}}
+        prune_generations(es, "nlp_index", keep=2)
+        deleted = [c.kwargs["index"] for c in es.indices.delete.call_args_list]
+        self.assertEqual(deleted, ["nlp_index-2"])
+
+    @patch("populate_elasticsearch.wait_for_es")
+    @patch("populate_elasticsearch.get_es_client")
+    def test_populate_failed_validation_keeps_live_alias(self, mock_client, _wait):
+        es = mock_client.return_value
+        es.bulk.side_effect = lambda body: {"items": [{"index": {"status": 201}}] * (len(body) // 2)}
+        es.count.return_value = {"count": 0}
+        with self.assertRaises(RuntimeError):
+            populate()
+        es.indices.update_aliases.assert_not_called()
+        es.indices.delete.assert_called()
+
+    @patch("populate_elasticsearch.wait_for_es")
+    @patch("populate_elasticsearch.get_es_client")
+    def test_populate_missing_documents_keeps_live_alias(self, mock_client, _wait):
+        es = mock_client.return_value
+        es.bulk.side_effect = lambda body: {"items": [{"index": {"status": 201}}] * (len(body) // 2)}
+        es.count.return_value = {"count": DOC_COUNT - 1}
+        with self.assertRaisesRegex(RuntimeError, f"only {DOC_COUNT - 1} of {DOC_COUNT} documents"):
+            populate()
+        es.indices.update_aliases.assert_not_called()
+        with patch("populate_elasticsearch.POPULATE_MAX_ERRORS", 1):
+            self.assertEqual(validate_generation(es, "nlp_index-1", {"docs": DOC_COUNT, "errors": 0}), DOC_COUNT - 1)
+
+    @patch("local_search.LocalIndexBuilder.stage", side_effect=OSError("disk full"))
+    @patch("populate_elasticsearch.save_manifest")
+    @patch("populate_elasticsearch.wait_for_es")
+    @patch("populate_elasticsearch.get_es_client")
+    def test_populate_local_index_failure_keeps_live_alias(self, mock_client, _wait, mock_save, _stage):
+        es = mock_client.return_value
+        es.bulk.side_effect = lambda body: {"items": [{"index": {"status": 201}}] * (len(body) // 2)}
+        es.count.return_value = {"count": DOC_COUNT}
+        with self.assertRaises(OSError):
+            populate()
+        es.indices.update_aliases.assert_not_called()
+        es.indices.delete.assert_called()
+        mock_save.assert_not_called()
+
+    @patch("local_search.LOCAL_INDEX_PATH", os.path.join(tempfile.gettempdir(), "test_local_index.bin"))
+    @patch("populate_elasticsearch.save_manifest")
+    @patch("populate_elasticsearch.load_manifest")
+    @patch("populate_elasticsearch.wait_for_es")
+    @patch("populate_elasticsearch.get_es_client")
+    def test_populate_incremental_sends_only_changes(self, mock_client, _wait, mock_load, mock_save):
+        docs = dict(iter_documents(LOG4_PATH, transform_log4))
+        docs.update(iter_documents(CVE_PATH, transform_cve))
+        previous = {doc_id: content_hash(doc) for doc_id, doc in docs.items()}
+        changed_id = next(iter(docs))
+        previous[changed_id] = "stale"
+        previous["gone"] = "old"
+        mock_load.return_value = {"index": "nlp_index-1", "docs": previous}
+        es = mock_client.return_value
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {"nlp_index-1": {}}
+        es.bulk.side_effect = lambda body: {"items": [{"index": {"status": 200}}] * len(body)}
+        fields = set()
+        for doc in docs.values():
+            fields.update(extract_field_paths(doc))
+        es.get.return_value = {"_source": {"fields": sorted(fields), "doc_count": len(docs), "packages": ["log4jscanner"]}}
+        stats = populate(incremental=True)
+        self.assertEqual((stats["created"], stats["updated"], stats["deleted"]), (0, 1, 1))
+        lines = [json.loads(line) for line in es.bulk.call_args.kwargs["body"]]
+        self.assertIn({"delete": {"_index": "nlp_index-1", "_id": "gone"}}, lines)
+        self.assertIn({"index": {"_index": "nlp_index-1", "_id": changed_id}}, lines)
+        self.assertEqual(len(lines), 3)
+        # No new fields and same doc count: schema version untouched
+        es.index.assert_not_called()
+        es.indices.update_aliases.assert_not_called()
+        saved = mock_save.call_args[0][0]
+        self.assertNotIn("gone", saved["docs"])
+        self.assertEqual(saved["docs"][changed_id], content_hash(docs[changed_id]))
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import llm
+import prompt_compiler
+from prompt_compiler import CompiledPrompt, compile_prompt, estimate_tokens
+
+CATALOG = [
+    {"path": f"package.field_{i}", "type": "string", "count": 10, "cardinality": 50, "doc_types": ["component"],
+     "samples": ["x" * 30], "score": 1.0 - i / 100}
+    for i in range(40)
+] + [{"path": "id", "type": "string", "count": 10, "cardinality": 10, "doc_types": ["cve"], "samples": [], "score": 0.5}]
+
+
+class TestPromptCompiler(unittest.TestCase):
+    def test_compiled_once_per_schema_version(self):
+        first = compile_prompt({"version": "1", "catalog": CATALOG})
+        self.assertIs(compile_prompt({"version": "1", "catalog": CATALOG}), first)
+        self.assertIsNot(compile_prompt({"version": "2", "catalog": CATALOG}), first)
+
+    def test_static_prefix_then_fields_then_prompt(self):
+        compiled = CompiledPrompt({"version": "1", "catalog": CATALOG})
+        request = compiled.request("show me CVE-2021-44228 details")
+        self.assertTrue(request.startswith("\nAvailable fields: id (keyword"))
+        self.assertTrue(request.endswith("\nPrompt: show me CVE-2021-44228 details\nElasticsearch Query:"))
+        self.assertIn('Example: "Log4jScanner"', compiled.prefix)
+        self.assertNotIn("Available fields", compiled.prefix)
+
+    def test_budget_trims_fields_then_examples(self):
+        roomy = CompiledPrompt({"catalog": CATALOG}, budget=5000)
+        tight = CompiledPrompt({"catalog": CATALOG}, budget=550)
+        self.assertEqual(len(roomy.fields_for("package")), 40)
+        fields = tight.fields_for("package")
+        self.assertTrue(0 < len(fields) < 40)
+        self.assertLessEqual(estimate_tokens(tight.prefix + tight.request("package")), 550)
+        # Rules alone already need more than half of a tiny budget; the best field is still sent
+        tiny = CompiledPrompt({"fields": ["a", "b"]}, budget=100)
+        self.assertNotIn("Example:", tiny.prefix)
+        self.assertEqual(tiny.fields_for("x"), ["a"])
+
+
+class TestGeminiModel(unittest.TestCase):
+    def setUp(self):
+        for patcher in [patch.dict("os.environ", {"GEMINI_API_KEY": "key", "GEMINI_MODEL": "models/test"}),
+                        patch.dict(llm._models, clear=True), patch.dict(llm._context_caches, clear=True),
+                        patch("llm.genai")]:
+            self.genai = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_model_is_built_once(self):
+        self.assertIs(llm.get_model(), llm.get_model())
+        self.genai.GenerativeModel.assert_called_once_with("models/test")
+        self.genai.configure.assert_called_once_with(api_key="key")
+
+    @patch("llm.LLM_CONTEXT_CACHE", True)
+    def test_context_cache_sends_prefix_once(self):
+        compiled = CompiledPrompt({"fields": ["id"]})
+        with patch("google.generativeai.caching.CachedContent.create") as create:
+            model, text = llm.model_and_prompt(compiled, compiled.request("risky packages"))
+            llm.model_and_prompt(compiled, compiled.request("risky packages"))
+        create.assert_called_once()
+        self.assertEqual(create.call_args.kwargs["system_instruction"], compiled.prefix)
+        self.assertIs(model, self.genai.GenerativeModel.from_cached_content.return_value)
+        self.assertTrue(text.startswith("Available fields: id."))
+
+    @patch("llm.LLM_CONTEXT_CACHE", True)
+    def test_context_cache_refused_falls_back_inline(self):
+        compiled = CompiledPrompt({"fields": ["id"]})
+        with patch("google.generativeai.caching.CachedContent.create", side_effect=ValueError("too small")) as create:
+            for _ in range(2):
+                model, text = llm.model_and_prompt(compiled, compiled.request("risky packages"))
+        create.assert_called_once()
+        self.assertIs(model, self.genai.GenerativeModel.return_value)
+        self.assertTrue(text.startswith(compiled.prefix))
+
+    @patch("llm.LLM_CONTEXT_CACHE", True)
+    def test_context_cache_refusal_is_retried_after_ttl(self):
+        compiled = CompiledPrompt({"fields": ["id"]})
+        with patch("google.generativeai.caching.CachedContent.create", side_effect=[ValueError("busy"), MagicMock()]) as create, \
+                patch("llm.time.monotonic", return_value=100.0) as clock:
+            first, _ = llm.model_and_prompt(compiled, compiled.request("risky packages"))
+            llm.model_and_prompt(compiled, compiled.request("risky packages"))
+            clock.return_value += llm.LLM_CONTEXT_CACHE_TTL
+            second, text = llm.model_and_prompt(compiled, compiled.request("risky packages"))
+        self.assertEqual(create.call_count, 2)
+        self.assertIs(first, self.genai.GenerativeModel.return_value)
+        self.assertIs(second, self.genai.GenerativeModel.from_cached_content.return_value)
+        self.assertTrue(text.startswith("Available fields: id."))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from query_cache import QueryCache, normalize_prompt
+
+class TestNormalizePrompt(unittest.TestCase):
+    def test_case_and_whitespace_collapse_to_same_key(self):
+        a = normalize_prompt("show me CVE-2020-1472")
+        b = normalize_prompt("  Show me   cve-2020-1472 ")
+        self.assertEqual(a.key, b.key)
+        self.assertEqual(a.cves, ["CVE-2020-1472"])
+
+    def test_component_tokens_extracted(self):
+        norm = normalize_prompt("show me Log4jScanner:1.0.0")
+        self.assertEqual(norm.components, [("log4jscanner", "1.0.0")])
+        self.assertEqual(norm.key, "log4jscanner:1.0.0")
+
+class TestQueryCache(unittest.TestCase):
+    def test_hit_and_schema_version_miss(self):
+        cache = QueryCache(maxsize=4, ttl=60, db_path="")
+        cache.put("k", {"query": {"match_all": {}}}, "v1")
+        self.assertEqual(cache.get("k", "v1"), {"query": {"match_all": {}}})
+        self.assertIsNone(cache.get("k", "v2"))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = QueryCache(maxsize=2, ttl=60, db_path="")
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_ttl_expiry(self):
+        cache = QueryCache(maxsize=2, ttl=10, db_path="")
+        with patch("query_cache.time.time", return_value=1000):
+            cache.put("a", 1)
+        with patch("query_cache.time.time", return_value=1011):
+            self.assertIsNone(cache.get("a"))
+
+    def test_sqlite_tier_shared_and_invalidated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "cache.db")
+            writer = QueryCache(maxsize=2, ttl=60, db_path=db_path)
+            reader = QueryCache(maxsize=2, ttl=60, db_path=db_path)
+            writer.put("k", {"query": {"ids": {"values": ["x"]}}}, "v1")
+            self.assertEqual(reader.get("k", "v1"), {"query": {"ids": {"values": ["x"]}}})
+            writer.invalidate()
+            fresh = QueryCache(maxsize=2, ttl=60, db_path=db_path)
+            self.assertIsNone(fresh.get("k", "v1"))
+
+    def test_sqlite_connections_are_closed(self):
+        opened = []
+        real_connect = sqlite3.connect
+        def connect(*args, **kwargs):
+            opened.append(real_connect(*args, **kwargs))
+            return opened[-1]
+        with tempfile.TemporaryDirectory() as tmp, patch("query_cache.sqlite3.connect", side_effect=connect):
+            cache = QueryCache(maxsize=2, ttl=60, db_path=os.path.join(tmp, "cache.db"))
+            cache.put("k", 1, "v1")
+            cache.get("other", "v1")
+            cache.invalidate()
+        self.assertEqual(len(opened), 4)
+        for conn in opened:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+
+if __name__ == "__main__":
+    unittest.main()
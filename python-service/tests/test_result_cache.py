@@ -0,0 +1,84 @@
+import json
+import unittest
+from unittest.mock import patch
+from app import app
+import api
+from result_cache import ResultCache, canonical_key, generation_of, with_planner
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}}
+
+
+class TestResultCache(unittest.TestCase):
+    def test_canonical_key_ignores_key_order(self):
+        self.assertEqual(canonical_key({"query": {"ids": {"values": ["a"]}}, "size": 1}, size=1),
+                         canonical_key({"size": 1, "query": {"ids": {"values": ["a"]}}}, size=1))
+        self.assertNotEqual(canonical_key({"query": {}}, size=1), canonical_key({"query": {}}, size=100))
+
+    def test_lru_and_byte_bound(self):
+        cache = ResultCache(maxsize=2, max_bytes=1000)
+        for key in "abc":
+            cache.get(key, "g1")
+            cache.put(key, "g1", {"intent": "cve", "results": key})
+        self.assertIsNone(cache.get("a", "g1"))
+        self.assertEqual(cache.get("c", "g1")[0], {"intent": "cve", "results": "c"})
+        cache.put("big", "g1", {"results": "x" * 500})
+        self.assertIsNone(cache.get("big", "g1"))
+
+    def test_new_generation_empties_cache(self):
+        cache = ResultCache()
+        cache.get("a", "g1")
+        cache.put("a", "g1", {"intent": "cve"})
+        self.assertIsNone(cache.get("a", "g2"))
+        self.assertEqual(len(cache), 0)
+        # Without a data generation nothing is cached
+        self.assertIsNone(generation_of({"version": "1"}))
+        cache.put("a", None, {"intent": "cve"})
+        self.assertIsNone(cache.get("a", None))
+
+    def test_with_planner(self):
+        body = json.dumps({"intent": "cve", "results": None}).encode()
+        self.assertEqual(json.loads(with_planner(body, "rules")), {"intent": "cve", "results": None, "planner": "rules"})
+
+
+class TestProcessResultCache(unittest.TestCase):
+    def setUp(self):
+        api.result_cache.invalidate()
+        self.addCleanup(api.result_cache.invalidate)
+        self.schema = {"fields": ["id"], "version": "1", "data_version": "1"}
+        for target, kwargs in [("api.fetch_schema_fields", {"return_value": ["id"]}),
+                               ("api.fetch_schema", {"side_effect": lambda: self.schema})]:
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        es = patch("api.es")
+        self.es = es.start()
+        self.addCleanup(es.stop)
+        self.es.search.return_value = {"hits": {"hits": [CVE_HIT]}}
+        self.client = app.test_client()
+
+    def post(self, prompt):
+        return self.client.post("/process", json={"prompt": prompt}).get_json()
+
+    def test_repeated_search_skips_elasticsearch(self):
+        first = self.post("show me CVE-2020-1472")
+        second = self.post("Show me cve-2020-1472 ")
+        self.assertEqual(self.es.search.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second["planner"], "rules")
+        self.assertEqual(second["results"]["template"], "TemplateB")
+
+    def test_new_data_version_searches_again(self):
+        self.post("show me CVE-2020-1472")
+        self.schema = {**self.schema, "data_version": "2"}
+        self.post("show me CVE-2020-1472")
+        self.assertEqual(self.es.search.call_count, 2)
+
+    def test_batch_reuses_process_results(self):
+        self.post("show me CVE-2020-1472")
+        items = api.process_batch(["show me CVE-2020-1472"])
+        self.es.msearch.assert_not_called()
+        self.assertEqual(items[0]["intent"], "cve")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from schema_cache import SchemaCache
+from es_client import get_es_client
+
+class TestSchemaCache(unittest.TestCase):
+    def setUp(self):
+        self.es = MagicMock()
+        self.full = {"_source": {"fields": ["id", "type"], "version": "1"}}
+        self.head = {"_source": {"version": "1"}}
+        self.es.get.side_effect = lambda index, id, source_includes=None: self.head if source_includes else self.full
+        self.cache = SchemaCache(check_interval=10, client_factory=lambda: self.es)
+
+    def test_cached_within_interval(self):
+        with patch("schema_cache.time.monotonic", return_value=100):
+            self.assertEqual(self.cache.get()["fields"], ["id", "type"])
+            self.cache.get()
+        self.assertEqual(self.es.get.call_count, 1)
+
+    def test_version_check_after_interval(self):
+        with patch("schema_cache.time.monotonic", return_value=100):
+            self.cache.get()
+        with patch("schema_cache.time.monotonic", return_value=200):
+            self.cache.get()
+        # Only the version was fetched the second time
+        self.assertEqual(self.es.get.call_args.kwargs["source_includes"], ["version", "data_version"])
+        self.full = {"_source": {"fields": ["id"], "version": "2"}}
+        self.head = {"_source": {"version": "2"}}
+        with patch("schema_cache.time.monotonic", return_value=300):
+            self.assertEqual(self.cache.get()["fields"], ["id"])
+
+    def test_invalidate_and_error_fallback(self):
+        self.cache.get()
+        self.cache.invalidate()
+        self.es.get.side_effect = Exception("down")
+        self.assertEqual(self.cache.get(), {})
+
+class TestEsClient(unittest.TestCase):
+    def test_client_shared_per_url(self):
+        self.assertIs(get_es_client("example", "9200"), get_es_client("example", "9200"))
+        self.assertIsNot(get_es_client("example", "9200"), get_es_client("other", "9200"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from schema_catalog import FieldCatalog, DistinctSketch, select_fields, describe_field, merge_entries
+from populate_elasticsearch import extract_field_paths
+from llm import prompt_fields, build_full_prompt
+
+COMPONENT = {"type": "component", "sbom_id": "s1",
+             "package": {"name": "log4j-core", "version": "2.14.1", "purl": "pkg:maven/log4j-core@2.14.1"}}
+CVE = {"type": "cve", "id": "CVE-2021-44228", "description": "Remote code execution in log4j",
+       "affected_packages": [{"name": "log4j-core", "version": "2.14.1"}],
+       "original": {"cve": {"epss": {"epss": 0.97}}}}
+
+
+class TestSchemaCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = FieldCatalog()
+        for i in range(30):
+            self.catalog.add({**COMPONENT, "package": {**COMPONENT["package"], "name": f"pkg-{i}", "version": f"2.{i % 5}"}})
+        for i in range(3):
+            self.catalog.add({**CVE, "id": f"CVE-2021-4422{i}"})
+
+    def test_paths_match_extract_field_paths(self):
+        expected = set(extract_field_paths(COMPONENT)) | set(extract_field_paths(CVE))
+        self.assertEqual(self.catalog.paths(), {p for p in expected if not p.startswith("original.")})
+
+    def test_unindexed_objects_are_not_walked(self):
+        entries = {e["path"]: e for e in self.catalog.entries()}
+        self.assertEqual(entries["original"]["type"], "object")
+        self.assertEqual(entries["original"]["count"], 3)
+        self.assertFalse([p for p in self.catalog.paths() if p.startswith("original.")])
+
+    def test_entry_statistics(self):
+        entries = {e["path"]: e for e in self.catalog.entries()}
+        self.assertEqual(entries["package.name"]["count"], 30)
+        self.assertEqual(entries["package.name"]["cardinality"], 30)
+        self.assertEqual(entries["package.name"]["doc_types"], ["component"])
+        self.assertEqual(entries["id"]["doc_types"], ["cve"])
+        self.assertEqual(entries["package"]["type"], "object")
+
+    def test_sketch_estimates_large_cardinality(self):
+        sketch = DistinctSketch()
+        for i in range(10000):
+            sketch.add(f"value-{i}")
+        self.assertLess(abs(sketch.estimate() - 10000), 4000)
+
+    def test_select_fields_follows_prompt_intent(self):
+        entries = self.catalog.entries()
+        cve_fields = [e["path"] for e in select_fields(entries, "details for CVE-2021-44228", limit=3)]
+        self.assertIn("id", cve_fields)
+        self.assertNotIn("sbom_id", cve_fields)
+        component_fields = [e["path"] for e in select_fields(entries, "which package versions do we ship", limit=3)]
+        self.assertIn("package.version", component_fields)
+        self.assertNotIn("package", component_fields)
+
+    def test_describe_field_shows_samples_for_low_cardinality(self):
+        entries = {e["path"]: e for e in self.catalog.entries()}
+        self.assertEqual(describe_field(entries["type"]), "type (string, e.g. component | cve)")
+        self.assertEqual(describe_field(entries["package.name"]), "package.name (string)")
+
+    def test_merge_keeps_existing_entries(self):
+        old = [{"path": "id", "score": 1.0, "count": 5}]
+        new = [{"path": "id", "score": 0.1, "count": 1}, {"path": "cwe", "score": 0.5}]
+        merged = merge_entries(old, new)
+        self.assertEqual([e["path"] for e in merged], ["id", "cwe"])
+        self.assertEqual(merged[0]["count"], 5)
+
+    def test_prompt_lists_only_selected_fields(self):
+        schema = {"fields": sorted(self.catalog.paths()), "catalog": self.catalog.entries()}
+        fields = prompt_fields(schema, "CVE-2021-44228")
+        # Objects are not listed, only their leaves
+        self.assertNotIn("package", [f.split(" ")[0] for f in fields])
+        self.assertLess(len(fields), len(schema["fields"]))
+        # An older schema-index without a catalog still lists every path
+        self.assertEqual(prompt_fields({"fields": ["a", "b"]}, "x"), ["a", "b"])
+        # Keyword fields are marked as such and the unindexed `original` feed is never offered
+        self.assertIn("id (keyword", build_full_prompt("CVE-2021-44228", fields))
+        self.assertFalse([f for f in fields if f.startswith("original.")])
+
+
+if __name__ == "__main__":
+    unittest.main()
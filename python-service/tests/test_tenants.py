@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from app import app
+import api
+import llm
+import populate_elasticsearch
+import tenants
+from jobs import RepopulateRunner
+from tenants import Tenant, TenantRegistry, UnknownTenant
+
+CVE_HIT = {"_id": "CVE-2020-1472", "_source": {"id": "CVE-2020-1472", "type": "cve"}}
+
+
+def tenant_data_dir(test, *names):
+    """Point TENANT_DATA_DIR at a temporary directory holding a data directory per tenant name."""
+    tmp = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmp)
+    for name in names:
+        os.makedirs(os.path.join(tmp, name))
+    patcher = patch("tenants.TENANT_DATA_DIR", tmp)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return tmp
+
+
+class TestTenants(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("tenants.registry", TenantRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tenant_data_dir(self, "acme")
+
+    def test_resolve(self):
+        for name in (None, "", tenants.DEFAULT_TENANT):
+            self.assertIsNone(tenants.resolve(name))
+        self.assertIs(tenants.resolve("acme"), tenants.resolve("acme"))
+        for name in ("Acme", "acme-2", "../etc", 7, "a" * 40, "globex"):
+            with self.assertRaises(UnknownTenant):
+                tenants.resolve(name)
+        with patch("tenants.TENANTS", ["globex"]):
+            self.assertEqual(tenants.resolve("globex").name, "globex")
+            with self.assertRaises(UnknownTenant):
+                tenants.resolve("acme")
+
+    def test_unknown_names_do_not_evict_loaded_tenants(self):
+        with patch("tenants.registry", TenantRegistry(max_loaded=1, pinned=[])):
+            acme = tenants.resolve("acme")
+            for i in range(5):
+                with self.assertRaises(UnknownTenant):
+                    tenants.resolve(f"made_up_{i}")
+            self.assertEqual(tenants.registry.loaded(), ["acme"])
+            self.assertIs(tenants.resolve("acme"), acme)
+
+    def test_tenant_layout(self):
+        tenant = Tenant("acme")
+        self.assertEqual((tenant.data_index, tenant.schema_index, tenant.link_index),
+                         ("nlp_index-acme", "schema-index-acme", "nlp_links-acme"))
+        self.assertEqual(tenant.path("/srv/.populate_manifest.json"), "/srv/.populate_manifest.acme.json")
+        self.assertEqual(tenant.log4_path, os.path.join(tenants.TENANT_DATA_DIR, "acme", "log4.json"))
+        self.assertEqual(tenant.result_cache.max_bytes, tenants.TENANT_RESULT_CACHE_MAX_BYTES)
+
+    def test_registry_evicts_least_recently_used_unpinned(self):
+        registry = TenantRegistry(max_loaded=2, pinned=["hot"])
+        for name in ("hot", "a", "b"):
+            registry.get(name)
+        registry.get("a")
+        registry.get("c")
+        self.assertEqual(registry.loaded(), ["hot", "a", "c"])
+
+    def test_prewarm_loads_schema_and_prompt(self):
+        tenant = tenants.resolve("acme")
+        schema = {"version": "7", "fields": ["id"]}
+        with patch.object(tenant.schema_cache, "get", return_value=schema), \
+                patch("tenants.compile_prompt") as compile_prompt:
+            tenants.prewarm(["acme", "Not-A-Tenant"])
+        compile_prompt.assert_called_once_with(schema)
+
+    def test_repopulate_jobs_coalesce_per_tenant(self):
+        release = threading.Event()
+        calls = []
+        def target(incremental, progress, tenant=None):
+            calls.append(tenant)
+            release.wait(5)
+        runner = RepopulateRunner(target)
+        acme = tenants.resolve("acme")
+        first, _ = runner.submit(tenant=acme)
+        second, created = runner.submit(tenant=acme)
+        default, default_created = runner.submit()
+        self.assertFalse(created)
+        self.assertIs(first, second)
+        self.assertTrue(default_created)
+        release.set()
+        for t in threading.enumerate():
+            if t.name.startswith("repopulate-"):
+                t.join(5)
+        self.assertCountEqual(calls, [None, acme])
+        self.assertEqual(first.to_dict()["tenant"], "acme")
+
+
+class TestTenantRouting(unittest.TestCase):
+    def setUp(self):
+        for patcher in [patch("tenants.registry", TenantRegistry()), patch("llm.schema_cache")]:
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        tenant_data_dir(self, "acme", "globex")
+        api.result_cache.invalidate()
+        self.addCleanup(api.result_cache.invalidate)
+        self.acme = tenants.resolve("acme")
+        schema = {"fields": ["id"], "version": "1", "data_version": "1"}
+        llm.schema_cache.get.return_value = schema
+        patcher = patch.object(self.acme.schema_cache, "get", return_value=schema)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        es = patch("api.es")
+        self.es = es.start()
+        self.addCleanup(es.stop)
+        self.es.search.return_value = {"hits": {"hits": [CVE_HIT]}}
+        self.client = app.test_client()
+
+    def test_process_searches_the_tenants_index_and_cache(self):
+        body = {"prompt": "show me CVE-2020-1472"}
+        self.client.post("/process", json={**body, "tenant": "acme"})
+        self.client.post("/process", json=body, headers={"X-Tenant": "acme"})
+        self.client.post("/process", json=body)
+        indices = [c.kwargs["index"] for c in self.es.search.call_args_list]
+        self.assertEqual(indices, ["nlp_index-acme", api.ES_INDEX])
+        self.assertEqual((len(self.acme.result_cache), len(api.result_cache)), (1, 1))
+
+    def test_batch_searches_the_tenants_index(self):
+        self.es.msearch.return_value = {"responses": [{"hits": {"hits": [CVE_HIT]}}]}
+        resp = self.client.post("/process/batch", json={"prompts": ["show me CVE-2020-1472"], "tenant": "acme"})
+        self.assertEqual(resp.get_json()["results"][0]["intent"], "cve")
+        self.assertEqual(self.es.msearch.call_args.kwargs["body"][0], {"index": "nlp_index-acme"})
+
+    def test_cursor_only_pages_the_tenant_it_was_issued_for(self):
+        self.es.open_point_in_time.return_value = {"id": "pit-acme"}
+        self.es.search.return_value = {"pit_id": "pit-acme", "hits": {"hits": [dict(CVE_HIT, sort=[0])]}}
+        body = {"prompt": "show all", "page_size": 1}
+        cursor = self.client.post("/process", json={**body, "tenant": "acme"}).get_json()["next_cursor"]
+        self.assertEqual(self.es.open_point_in_time.call_args.kwargs["index"], "nlp_index-acme")
+        self.es.search.reset_mock()
+        with patch("schema_cache.SchemaCache.get", return_value={"fields": ["id"], "version": "1"}):
+            for tenant in ("globex", None):
+                resp = self.client.post("/process", json={**body, "cursor": cursor, "tenant": tenant})
+                self.assertEqual(resp.status_code, 400)
+        self.es.search.assert_not_called()
+        resp = self.client.post("/process", json={**body, "cursor": cursor}, headers={"X-Tenant": "acme"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.es.search.call_args.kwargs["body"]["pit"]["id"], "pit-acme")
+
+    def test_unknown_tenant_is_rejected(self):
+        resp = self.client.post("/process", json={"prompt": "show all", "tenant": "No Such"})
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json()["error"], "Unknown tenant: 'No Such'")
+        resp = self.client.post("/process", json={"prompt": "show all"}, headers={"X-Tenant": "initech"})
+        self.assertEqual(resp.status_code, 404)
+        self.es.search.assert_not_called()
+        self.assertEqual(tenants.registry.loaded(), ["acme"])
+
+
+class TestTenantPopulate(unittest.TestCase):
+    @patch("populate_elasticsearch.wait_for_es")
+    def test_populate_builds_tenant_generations(self, _wait):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        os.makedirs(os.path.join(tmp, "acme"))
+        for name in ("log4.json", "cve.json"):
+            shutil.copy(os.path.join(populate_elasticsearch.DATA_DIR, name), os.path.join(tmp, "acme", name))
+        with patch("tenants.TENANT_DATA_DIR", tmp), \
+                patch("local_search.LOCAL_INDEX_PATH", os.path.join(tmp, ".local_index.bin")), \
+                patch("populate_elasticsearch.MANIFEST_PATH", os.path.join(tmp, ".populate_manifest.json")):
+            tenant = Tenant("acme")
+            es = MagicMock()
+            es.bulk.side_effect = lambda body: {"items": [{"index": {"status": 201}}] * (len(body) // 2)}
+            es.count.return_value = {"count": sum(1 for _ in populate_elasticsearch.iter_documents(
+                tenant.log4_path, populate_elasticsearch.transform_log4)) + sum(1 for _ in populate_elasticsearch.iter_documents(
+                tenant.cve_path, populate_elasticsearch.transform_cve))}
+            es.indices.exists_alias.return_value = False
+            es.indices.exists.return_value = False
+            es.indices.get.return_value = {}
+            populate_elasticsearch.populate(es=es, tenant=tenant)
+        actions = es.indices.update_aliases.call_args.kwargs["body"]["actions"]
+        aliases = {a["add"]["alias"]: a["add"]["index"] for a in actions}
+        self.assertEqual(sorted(aliases), ["nlp_index-acme", "nlp_links-acme", "schema-index-acme"])
+        for alias, index in aliases.items():
+            self.assertRegex(index, rf"^{alias}-\d+$")
+        self.assertTrue(os.path.exists(os.path.join(tmp, ".local_index.acme.bin")))
+        self.assertTrue(os.path.exists(os.path.join(tmp, ".populate_manifest.acme.json")))
+        self.assertFalse(os.path.exists(os.path.join(tmp, ".local_index.bin")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+import tracing
+
+class TestTracing(unittest.TestCase):
+    def test_unsampled_trace_skips_payload_rendering(self):
+        render = MagicMock(return_value={"big": "payload"})
+        with patch("tracing.should_sample", return_value=False):
+            with tracing.trace_request("/process") as trace:
+                tracing.capture("hits", render)
+        render.assert_not_called()
+        self.assertNotIn("payloads", trace.to_dict())
+
+    def test_sampled_trace_captures_truncated_payload(self):
+        with patch("tracing.should_sample", return_value=True), patch("tracing.TRACE_PAYLOAD_MAX_CHARS", 10):
+            with tracing.trace_request("/process") as trace:
+                tracing.capture("hits", lambda: ["x" * 50])
+        self.assertEqual(len(trace.payloads["hits"]), 10)
+
+    def test_spans_accumulate_and_one_line_is_logged(self):
+        with self.assertLogs("trace", level="INFO") as logs:
+            with tracing.trace_request("/process"):
+                with tracing.span("es_search"):
+                    pass
+                with tracing.span("es_search"):
+                    pass
+                tracing.annotate(planner="rules", hits=3)
+        self.assertEqual(len(logs.records), 1)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["planner"], "rules")
+        self.assertEqual(list(record["spans"]), ["es_search"])
+
+    def test_helpers_are_noops_outside_a_request(self):
+        with tracing.span("llm"):
+            tracing.annotate(planner="llm")
+            tracing.capture("x", lambda: 1 / 0)
+        self.assertIsNone(tracing.current_trace())
+
+if __name__ == "__main__":
+    unittest.main()
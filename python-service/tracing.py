@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import contextlib
+import contextvars
+import metrics
+
+# One structured line per request with per-stage timings; set to false to drop them
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fraction of requests whose payloads (queries, hits, responses) are rendered into the trace.
+# Payloads are also captured for every request when the "trace" logger is at DEBUG.
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+# Captured payloads are cut to this many characters
+TRACE_PAYLOAD_MAX_CHARS = int(os.environ.get("TRACE_PAYLOAD_MAX_CHARS", "2000"))
+
+logger = logging.getLogger("trace")
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def _render_default(obj):
+    # Objects like api.TemplatedHit know their JSON form; anything else is shown as text
+    to_json = getattr(obj, "__json__", None)
+    return to_json() if to_json is not None else str(obj)
+
+
+class Trace:
+    """Stage timings and optional payloads for one request.
+
+    Payloads are passed as callables and only rendered when the trace is
+    sampled, so unsampled requests never pay for serializing them.
+    """
+
+    def __init__(self, name, sampled=False):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+        self.payloads = {}
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Stages that run more than once (e.g. paged searches) accumulate
+            self.spans[stage] = self.spans.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def capture(self, key, render):
+        if self.sampled:
+            try:
+                text = json.dumps(render(), default=_render_default)
+            except Exception as e:
+                text = f"<unrenderable: {e}>"
+            self.payloads[key] = text[:TRACE_PAYLOAD_MAX_CHARS]
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        record = {
+            "trace_id": self.id,
+            "name": self.name,
+            "total_ms": round(self.elapsed_ms(), 2),
+            "spans": {stage: round(ms, 2) for stage, ms in self.spans.items()},
+            **self.fields,
+        }
+        if self.payloads:
+            record["payloads"] = self.payloads
+        return record
+
+
+def should_sample():
+    return logger.isEnabledFor(logging.DEBUG) or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+
+
+@contextlib.contextmanager
+def trace_request(name):
+    """Make a new Trace current for the duration of a request and log it when done."""
+    trace = Trace(name, sampled=should_sample())
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        record_metrics(trace)
+        if TRACE_ENABLED and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(trace.to_dict(), default=str))
+
+
+def record_metrics(trace):
+    metrics.REQUESTS.inc(endpoint=trace.name)
+    metrics.REQUEST_SECONDS.observe(trace.elapsed_ms() / 1000, endpoint=trace.name)
+    for stage, ms in trace.spans.items():
+        metrics.STAGE_SECONDS.observe(ms / 1000, stage=stage)
+    if "planner" in trace.fields:
+        metrics.PLANNER.inc(planner=trace.fields["planner"])
+
+
+def current_trace():
+    return _current.get()
+
+
+def span(stage):
+    """Time `stage` on the current trace; a no-op outside a request."""
+    trace = _current.get()
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.span(stage)
+
+
+def capture(key, render):
+    trace = _current.get()
+    if trace is not None:
+        trace.capture(key, render)
+
+
+def annotate(**fields):
+    trace = _current.get()
+    if trace is not None:
+        trace.set(**fields)
+
+
+def record_error(kind):
+    """Count a failure in nlp_errors_total and note it on the current trace."""
+    metrics.ERRORS.inc(kind=kind)
+    annotate(error=kind)